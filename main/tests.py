@@ -1,3 +1,44 @@
+import uuid
+from types import SimpleNamespace
+
+from celery import states
+from celery.result import AsyncResult
 from django.test import TestCase
+from django.urls import reverse
+
+from vetis_tools.celery import app
+
+
+class TaskInfoTests(TestCase):
+
+    def store_result(self, result, state: str, children: list[str] = ()) -> str:
+        task_id = str(uuid.uuid4())
+        request = SimpleNamespace(children=[AsyncResult(child_id) for child_id in children])
+        app.backend.store_result(task_id, result, state, request=request)
+        return task_id
+
+    def get_task_info(self, task_id: str):
+        return self.client.get(reverse('main:task_info'), {'task_id': task_id})
+
+    def test_scheduled_failure(self):
+        # application is submitted, its result is collected by the tasks sent after
+        collect_id = self.store_result(RuntimeError('Запрос отклонен (REJECTED)'), states.FAILURE)
+        poll_id = self.store_result('Ожидание результата обработки запроса (статус IN_PROCESS)', states.SUCCESS, [collect_id])
+        task_id = self.store_result('Запрос складского журнала отправлен.', states.SUCCESS, [poll_id])
+
+        response = self.get_task_info(task_id)
+        self.assertContains(response, 'FAILURE', status_code=286)
+        self.assertContains(response, 'REJECTED', status_code=286)
+
+    def test_scheduled_pending(self):
+        task_id = self.store_result('Запрос складского журнала отправлен.', states.SUCCESS, [str(uuid.uuid4())])
+
+        response = self.get_task_info(task_id)
+        self.assertContains(response, 'PENDING')
+        self.assertContains(response, 'Запрос складского журнала отправлен.')
+
+    def test_blocking(self):
+        task_id = self.store_result('Складские записи для предприятия успешно обновлены. Всего: 10', states.SUCCESS)
 
-# Create your tests here.
+        response = self.get_task_info(task_id)
+        self.assertContains(response, 'успешно обновлены', status_code=286)
@@ -3,6 +3,7 @@ import json
 from celery.result import AsyncResult
 from datetime import datetime, time
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import Http404
@@ -10,13 +11,16 @@ from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.urls import reverse
 
+from vetis_api.current_stock import refresh_current_stock_main
 from vetis_api.models import *
+from vetis_api.search import search
 from vetis_api.tasks import (
     test_task,
     reload_enterprises,
     reload_product_items,
     reload_product_subproduct,
     update_stock_entries,
+    update_stock_entries_scheduled,
     update_stock_entry_history,
     update_stock_entry_main_records
     )
@@ -25,12 +29,10 @@ from .forms import WorkspaceSelectionForm, ProductItemsFilterForm, StockEntriesF
 
 
 def index(request):
-    stock_entries_expiry = StockEntry.objects.filter(
-        is_last=True,
-        is_active=True,
+    stock_entries_expiry = CurrentStockEntry.objects.filter(
         volume__gt=0,
         date_expiry__lte=(datetime.now(tz=TZ_MOSCOW)+timedelta(days=30))
-        ).select_related('main').order_by('date_expiry')
+        ).select_related('enterprise', 'unit').order_by('date_expiry')
     
     context = {
         'stock_entries_expiry': stock_entries_expiry
@@ -116,7 +118,8 @@ def product_items(request):
                 product_items = product_items.filter(producer=form.cleaned_data['business_entity'])
                 show_business_entity = False
             if form.cleaned_data['search_query']:
-                product_items = product_items.filter(name__icontains=form.cleaned_data['search_query'])
+                # grouped list keeps its order
+                product_items = search(product_items, form.cleaned_data['search_query'], fields=['name', 'gtin'], vector_field='name', rank=not by_groups)
 
     else:
         form = ProductItemsFilterForm()
@@ -167,15 +170,11 @@ def stock_entries(request):
     if request.method == 'POST':
         form = StockEntriesFilterForm(request.POST)
         if form.is_valid():
-            stock_entries = StockEntry.objects.filter(enterprise=enterprise, is_last=True, is_active=True).select_related('main').order_by('date_expiry', '-entry_number')
+            stock_entries = CurrentStockEntry.objects.filter(enterprise=enterprise).select_related('unit').order_by('date_expiry', '-entry_number')
             if form.cleaned_data['product']:
                 stock_entries = stock_entries.filter(product= form.cleaned_data['product'])
             if form.cleaned_data['search_query']:
-                for query in form.cleaned_data['search_query'].split(' '):
-                    if query[0] == '-':
-                        stock_entries = stock_entries.exclude(product_item_name__icontains=query[1:])
-                    else:
-                        stock_entries = stock_entries.filter(product_item_name__icontains=query)
+                stock_entries = search(stock_entries, form.cleaned_data['search_query'], fields=['product_item_name'], vector_field='product_item_name')
             if form.cleaned_data['has_quantity']:
                 stock_entries = stock_entries.filter(volume__gt=0)
             if form.cleaned_data['date_produced_begin']:
@@ -236,6 +235,7 @@ def stock_entry_detail(request, id):
                 messages.add_message(request, messages.WARNING, 'Комментарий удален.')
 
             stock_entry.main.save()
+            refresh_current_stock_main(stock_entry.main)
             return redirect(reverse('main:stock_entry_detail', kwargs={'id': stock_entry.id}))
 
     else:
@@ -250,6 +250,21 @@ def stock_entry_detail(request, id):
     return TemplateResponse(request, 'main/stock_entry_detail.html', context=context)
 
 
+def follow_task_chain(task_result: AsyncResult) -> tuple[AsyncResult, AsyncResult | None]:
+    """
+    Returns the task a chain of tasks has got to and the task before it.
+    In scheduled mode (VETIS_APPLICATION_MODE) the started task only submits an application,
+    its result is collected and saved by tasks it has sent (see vetis_api.tasks.schedule_application),
+    so the sync is done or failed when the last of them is.
+    """
+
+    previous_result = None
+    while task_result.successful() and task_result.children:
+        previous_result = task_result
+        task_result = task_result.children[-1]
+    return task_result, previous_result
+
+
 # htmx partial render
 def task_info(request):
 
@@ -258,10 +273,12 @@ def task_info(request):
     
     context = {}
     if task_result:
+        task_result, previous_result = follow_task_chain(task_result)
         context = {
             'task_id': task_id,
             'task_ready': task_result.ready(),
             'task_result': task_result,
+            'previous_result': previous_result,
             'tick': ('.'*10)[:datetime.now().second%10+1] if not task_result.ready() else '',
         }
 
@@ -310,7 +327,10 @@ def vetis_task(request):
                 return redirect(build_url('main:vetis_task', task_id=task_id, next=next))
             
             if vetis_task == 'update_stock_entries' and request.user.vetis_login:
-                task_id = update_stock_entries.delay(credentials_id, request.user.vetis_login, ent_id)
+                if settings.VETIS_APPLICATION_MODE == 'scheduled':
+                    task_id = update_stock_entries_scheduled.delay(credentials_id, request.user.vetis_login, ent_id)
+                else:
+                    task_id = update_stock_entries.delay(credentials_id, request.user.vetis_login, ent_id)
                 next = reverse('main:stock_entries')
                 return redirect(build_url('main:vetis_task', task_id=task_id, next=next))
 
@@ -5,9 +5,13 @@ from .models import *
 
 @admin.register(ApiRequestsHistoryRecord)
 class ApiRequestsHistoryRecordAdmin(admin.ModelAdmin):
-    list_display = ['datetime', 'soap_action', 'response_status_code', 'comment']
+    list_display = ['datetime', 'soap_action', 'response_status_code', 'request_size', 'response_size', 'comment']
+    exclude = ['request_data', 'response_data']
     list_filter = ['datetime', 'soap_action']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('request_data', 'response_data')
+
 
 @admin.register(VetisCredentials)
 class VetisCredentialsAdmin(admin.ModelAdmin):
@@ -24,6 +28,12 @@ class EnterpriseAdmin(admin.ModelAdmin):
     list_display = ['name', 'address', 'number_list']
 
 
+@admin.register(SyncCheckpoint)
+class SyncCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['task', 'object_guid', 'mode', 'list_offset', 'total', 'date_updated']
+    list_filter = ['task']
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'product_type']
@@ -0,0 +1,154 @@
+import xml.etree.ElementTree as ET
+from time import sleep, time
+
+import requests
+
+from django.conf import settings
+
+from .exceptions import VetisApplicationError, parse_errors
+from .models import VetisCredentials
+from .transport import send_soap_request
+from .util import get_shared_cache
+from .xml.build_xml import AbstractRequest, ReceiveApplicationResultRequest
+from .xml.settings import NAMESPACES
+from .xml.stream import find_first_text
+
+
+MIN_POLL_DELAY = 2.0  # seconds
+MAX_POLL_DELAY = 60.0
+DEFAULT_PROCESSING_TIME = 5.0  # until statistics are collected
+PROCESSING_TIME_WEIGHT = 0.3  # weight of the latest observation in moving average
+
+
+def get_request_type(soap_request: AbstractRequest) -> str:
+    return soap_request.__class__.__name__
+
+
+def get_processing_time(request_type: str) -> float:
+    """Typical time Vetis needs to complete application of given type (moving average)"""
+    return get_shared_cache().get(f'vetis-application-time:{request_type}', DEFAULT_PROCESSING_TIME)
+
+
+def record_processing_time(request_type: str, submitted_at: float, last_poll_at: float | None):
+    """
+    Updates moving average with application that was found completed just now.
+    It was completed somewhere between the previous poll and now, midpoint is taken.
+    """
+
+    seconds = ((last_poll_at or submitted_at) + time()) / 2 - submitted_at
+    average = get_processing_time(request_type)
+    average += PROCESSING_TIME_WEIGHT * (seconds - average)
+    get_shared_cache().set(f'vetis-application-time:{request_type}', average, timeout=None)
+
+
+def get_poll_delay(request_type: str, elapsed: float, try_num: int) -> float:
+    """
+    Delay before next result poll.
+    First poll is made when application is expected to be completed,
+    later polls back off exponentially.
+    """
+
+    expected_left = get_processing_time(request_type) - elapsed
+    if try_num == 0:
+        # application submitted ahead of time may be ready already
+        delay = max(expected_left, 0)
+    else:
+        delay = max(expected_left, MIN_POLL_DELAY * 2 ** try_num)
+    return min(delay, MAX_POLL_DELAY)
+
+
+def submit_application(soap_request: AbstractRequest, credentials: VetisCredentials) -> str:
+    """Sends submitApplicationRequest, returns application ID"""
+
+    response = send_soap_request(soap_request, credentials)
+
+    result_xml = ET.fromstring(response.content)
+
+    response_xml = result_xml.find('./soapenv:Body/apldef:submitApplicationResponse', NAMESPACES)
+
+    status = response_xml.find('apl:application/apl:status', NAMESPACES).text
+
+    print(f'Status: {status}')
+
+    if status != 'ACCEPTED':
+        raise VetisApplicationError(f'Ошибка обработки запроса ({status})', status, parse_errors(response_xml))
+
+    return response_xml.find('apl:application/apl:applicationId', NAMESPACES).text
+
+
+def receive_application_result(application_id: str, credentials: VetisCredentials) -> tuple[str, requests.Response]:
+    """
+    Polls application result once.
+    Returns (status, response). Raises VetisApplicationError if application is rejected.
+    """
+
+    application_result_request = ReceiveApplicationResultRequest(api_key=credentials.api_key, issuer_id=credentials.issuer_id, application_id=application_id)
+
+    response = send_soap_request(application_result_request, credentials)
+
+    # completed result may be a large page: status goes before result and is read without building the tree
+    status = find_first_text(response.content, 'apl:status')
+
+    print(f'Status: {status}')
+
+    if status == 'REJECTED':
+        raise VetisApplicationError('Запрос отклонен (REJECTED)', status, parse_errors(ET.fromstring(response.content)))
+
+    if status is None:
+        raise VetisApplicationError('Ошибка парсинга ответа: не найден статус заявки')
+
+    return status, response
+
+
+def get_application_timeout() -> float:
+    return getattr(settings, 'VETIS_APPLICATION_TIMEOUT', 120)
+
+
+def check_application_timeout(status: str, waiting_since: float):
+    if time() - waiting_since > get_application_timeout():
+        raise VetisApplicationError(f'Таймаут ожидания результата обработки. Последний полученный статус запроса: {status}', status)
+
+
+def wait_application_result(application_id: str, request_type: str, credentials: VetisCredentials, submitted_at: float) -> requests.Response:
+    """
+    Blocks until application is completed.
+    Timeout is counted from the moment of call: application may have been submitted ahead of time.
+    """
+
+    try_num = 0
+    last_poll_at = None
+    waiting_since = time()
+
+    while True:
+        sleep(get_poll_delay(request_type, time() - submitted_at, try_num))
+
+        print(f'Receiving result... Try #{try_num}')
+
+        status, response = receive_application_result(application_id, credentials)
+
+        if status == 'COMPLETED':
+            record_processing_time(request_type, submitted_at, last_poll_at)
+            return response
+
+        check_application_timeout(status, waiting_since)
+        last_poll_at = time()
+        try_num += 1
+
+
+_handlers = {}
+
+
+def application_handler(name: str):
+    """
+    Registers function handling completed application result for scheduled mode.
+    Handler is called as handler(response, credentials, state).
+    """
+
+    def decorator(handler):
+        _handlers[name] = handler
+        return handler
+    return decorator
+
+
+def get_application_handler(name: str):
+    return _handlers[name]
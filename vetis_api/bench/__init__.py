@@ -0,0 +1,79 @@
+import json
+import platform
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from timeit import Timer
+
+import django
+from django.db import connection, transaction
+
+
+def measure(fn, repeat: int = 5) -> dict:
+    """
+    Best time of one call of fn over `repeat` runs.
+    Number of calls in a run is picked by timeit so that a run takes at least 0.2 s.
+    """
+
+    timer = Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {'per_call': best, 'number': number}
+
+
+def measure_in_transaction(fn, setup=None, repeat: int = 3) -> dict:
+    """
+    Best time of one call of fn writing to the database.
+    Every run is made in a transaction that is rolled back afterwards,
+    setup() prepares data in the same transaction, is not timed and returns arguments of fn.
+    """
+
+    times = []
+    for _ in range(repeat):
+        with transaction.atomic():
+            args = setup() if setup is not None else ()
+            started = perf_counter()
+            fn(*args)
+            times.append(perf_counter() - started)
+            transaction.set_rollback(True)
+    return {'per_call': min(times), 'number': 1}
+
+
+def get_git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_meta() -> dict:
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': get_git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.node(),
+    }
+
+
+def save_results(path: str, results: dict[str, dict]):
+    data = {'meta': get_meta(), 'results': results}
+    Path(path).write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding='utf-8')
+
+
+def load_results(path: str) -> dict:
+    return json.loads(Path(path).read_text(encoding='utf-8'))
+
+
+def compare_results(baseline: dict[str, dict], current: dict[str, dict]) -> list[tuple[str, float | None, float | None, float | None]]:
+    """Returns (name, baseline time, current time, current / baseline) for every benchmark in either set"""
+
+    rows = []
+    for name in sorted(baseline.keys() | current.keys()):
+        before = baseline[name]['per_call'] if name in baseline else None
+        after = current[name]['per_call'] if name in current else None
+        ratio = after / before if before and after is not None else None
+        rows.append((name, before, after, ratio))
+    return rows
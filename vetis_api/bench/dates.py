@@ -0,0 +1,16 @@
+from ..models import ComplexDate
+from . import measure
+
+
+def run(sizes: list[int]) -> dict[str, dict]:
+    """ComplexDate as it is used for every production and expiry date of a stock entry"""
+
+    date = ComplexDate(year=2025, month=7, day=14, hour=9)
+
+    return {
+        'ComplexDate.__init__': measure(lambda: ComplexDate(year=2025, month=7)),
+        'ComplexDate.update': measure(lambda: ComplexDate(year=2025, month=7).update('day', 14).update('hour', 9)),
+        'ComplexDate.to_string': measure(date.to_string),
+        'ComplexDate.to_datetime': measure(date.to_datetime),
+        'ComplexDate.from_string': measure(lambda: ComplexDate.from_string('14.07.2025:09')),
+    }
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.template.loader import render_to_string
+
+from ..models import TZ_MOSCOW
+from ..xml.build_xml import *
+from . import measure
+
+
+GUID = 'f4e6c2f6-3b6a-4d1e-9c57-7d2b6b4a1c11'
+
+
+def get_sample_requests() -> list[AbstractRequest]:
+    credentials = {
+        'api_key': 'YmI0ZGE2ZjItYjZlMy00YzQ3LWE0NjItNTk1ZDM3ZmI4ZTJk',
+        'service_id': 'mercury-g2b.service:2.1',
+        'issuer_id': GUID,
+        'initiator_login': 'user',
+    }
+    now = datetime.now(TZ_MOSCOW)
+    return [
+        ProductItemByGuidRequest(GUID),
+        ProductItemListRequest(GUID, list_count=1000, list_offset=0),
+        GetStockEntryListRequest(GUID, **credentials),
+        GetStockEntryChangesListRequest(GUID, now, now, **credentials),
+        ReceiveApplicationResultRequest(credentials['api_key'], credentials['issuer_id'], GUID),
+    ]
+
+
+def run(sizes: list[int]) -> dict[str, dict]:
+    """Compiled envelope against the render_to_string path it replaced"""
+
+    results = {}
+    for soap_request in get_sample_requests():
+        name = soap_request.__class__.__name__
+        template_name = f'vetis_api/xml/{soap_request.template_name}'
+        soap_request.render()  # two-step requests set issue_date on render
+
+        results[f'{name}.render_to_string'] = measure(lambda: render_to_string(template_name, {'vetis_request': soap_request}))
+        results[f'{name}.envelope'] = measure(lambda: soap_request.render().encode('utf-8'))
+        results[f'{name}.get_xml'] = measure(soap_request.get_xml)
+    return results
@@ -0,0 +1,113 @@
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import requests
+
+from ..fake.data import UNITS, FakeData
+from ..fake.server import ENVELOPE, application_result_xml, list_xml
+from ..models import *
+from ..tasks import fill_product_from_xml, fill_product_item_from_xml, fill_subproduct_from_xml
+from ..xml.settings import NAMESPACES
+
+
+def get_fake_data(size: int) -> FakeData:
+    return FakeData(stock_entries=size, product_items=min(size, 300), products=20, subproducts=60)
+
+
+def get_stock_page(data: FakeData, enterprise_guid: str, count: int, offset: int = 0) -> bytes:
+    """Completed receiveApplicationResult response with a stock journal page"""
+
+    total, items = data.stock_entry_list(enterprise_guid, count, offset)
+    result = f'<merc:getStockEntryListResponse>{list_xml("vd:stockEntryList", total, count, offset, items)}</merc:getStockEntryListResponse>'
+    content = f'<apl:status>COMPLETED</apl:status><apl:result>{result}</apl:result>'
+    return ENVELOPE.format(application_result_xml(data.make_guid('application', offset), content)).encode('utf-8')
+
+
+def make_response(content: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    return response
+
+
+def parse_fragment(fragment: str) -> ET.Element:
+    return ET.fromstring(ENVELOPE.format(fragment)).find('soapenv:Body', NAMESPACES)[0]
+
+
+def seed_workspace(data: FakeData) -> tuple[VetisCredentials, BusinessEntity, Enterprise]:
+    credentials = VetisCredentials.objects.create(name='bench', login='bench', password='bench', api_key='bench', service_id='bench', issuer_id='bench')
+    business_entity = BusinessEntity.objects.create(
+        guid=data.make_guid('bench-business-entity'),
+        uuid=data.make_guid('bench-business-entity-version'),
+        type=1,
+        name='Бенчмарк',
+        credentials=credentials,
+    )
+    enterprise = Enterprise.objects.create(
+        business_entity=business_entity,
+        guid=data.enterprise_guid(str(business_entity.guid), 0),
+        uuid=data.make_guid('bench-enterprise-version'),
+        type=1,
+        name='Склад',
+        is_allowed=True,
+    )
+    return credentials, business_entity, enterprise
+
+
+def seed_dictionaries(data: FakeData, credentials: VetisCredentials):
+    """Stores all products, subproducts and product items of fake data, so pages are saved without requests"""
+
+    for index in range(data.products):
+        product = Product()
+        fill_product_from_xml(product, parse_fragment(data.product_xml(data.product_guid(index))))
+        product.save()
+
+    for index in range(data.subproducts):
+        subproduct = SubProduct()
+        fill_subproduct_from_xml(subproduct, parse_fragment(data.subproduct_xml(data.subproduct_guid(index))), credentials)
+        subproduct.save()
+
+    for index in range(data.product_items):
+        product_item = ProductItem()
+        fill_product_item_from_xml(product_item, parse_fragment(data.product_item_xml(data.product_item_guid(index))), credentials)
+        product_item.save()
+
+
+def seed_stock_entries(data: FakeData, enterprise: Enterprise, count: int):
+    """Stores `count` last versions of stock entries directly, for benchmarks of views"""
+
+    unit, _ = Unit.objects.get_or_create(guid=UNITS[0][0], defaults={'name': UNITS[0][1]})
+    now = datetime.now(tz=TZ_MOSCOW)
+
+    mains = StockEntryMain.objects.bulk_create(
+        [StockEntryMain(guid=data.stock_entry_guid(index)) for index in range(count)],
+        batch_size=500
+    )
+
+    stock_entries = []
+    for index, main in enumerate(mains):
+        date_expiry = now + timedelta(days=index % 90 - 10)
+        stock_entries.append(StockEntry(
+            main=main,
+            enterprise=enterprise,
+            guid=main.guid,
+            uuid=data.stock_entry_uuid(index, 0),
+            is_active=True,
+            is_last=True,
+            status=100,
+            date_created=now - timedelta(hours=index),
+            date_updated=now - timedelta(minutes=index),
+            entry_number=index + 1,
+            product_type=1,
+            product_item_name=f'Наименование {index % data.product_items} & Ко',
+            volume=Decimal(index % 50),
+            unit=unit,
+            date_produced_1=(date_expiry - timedelta(days=60)).strftime('%d.%m.%Y'),
+            date_produced=date_expiry - timedelta(days=60),
+            date_expiry_1=date_expiry.strftime('%d.%m.%Y'),
+            date_expiry=date_expiry,
+            is_perishable=bool(index % 2),
+        ))
+
+    StockEntry.objects.bulk_create(stock_entries, batch_size=500)
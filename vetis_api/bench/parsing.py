@@ -0,0 +1,38 @@
+import xml.etree.ElementTree as ET
+
+from ..xml.schemas import STOCK_ENTRY
+from ..xml.settings import NAMESPACES
+from ..xml.stream import ElementStream, find_first_text
+from . import measure
+from .fixtures import get_fake_data, get_stock_page
+
+
+def parse_tree(page: bytes) -> int:
+    result_xml = ET.fromstring(page)
+    return len(result_xml.findall('.//vd:stockEntryList/vd:stockEntry', NAMESPACES))
+
+
+def parse_stream(page: bytes) -> int:
+    stream = ElementStream(page, 'vd:stockEntryList', 'vd:stockEntry')
+    return sum(len(batch) for batch in stream.iter_batches(100))
+
+
+def extract_records(result_xml: ET.Element) -> int:
+    return len(STOCK_ENTRY.extract_all(result_xml.iterfind('.//vd:stockEntryList/vd:stockEntry', NAMESPACES)))
+
+
+def run(sizes: list[int]) -> dict[str, dict]:
+    """Parsing of stock journal pages: whole tree, incremental stream, status lookup and record extraction"""
+
+    results = {}
+    for size in sizes:
+        data = get_fake_data(size)
+        page = get_stock_page(data, data.make_guid('enterprise'), size)
+
+        results[f'stock_list_{size}.ET.fromstring'] = measure(lambda: parse_tree(page), repeat=3)
+        results[f'stock_list_{size}.ElementStream'] = measure(lambda: parse_stream(page), repeat=3)
+        results[f'stock_list_{size}.find_first_text'] = measure(lambda: find_first_text(page, 'apl:status'), repeat=3)
+
+        result_xml = ET.fromstring(page)
+        results[f'stock_list_{size}.extract_records'] = measure(lambda: extract_records(result_xml), repeat=3)
+    return results
@@ -0,0 +1,37 @@
+import xml.etree.ElementTree as ET
+
+from ..tasks import fill_stock_entry_from_xml, save_stock_entries_page
+from ..models import StockEntry
+from ..xml.settings import NAMESPACES
+from . import measure_in_transaction
+from .fixtures import get_fake_data, get_stock_page, make_response, seed_dictionaries, seed_workspace
+
+
+def run(sizes: list[int]) -> dict[str, dict]:
+    """
+    Saving of a stock journal page into an empty journal.
+    Dictionaries are seeded beforehand, so nothing is requested from Vetis.
+    """
+
+    results = {}
+    for size in sizes:
+        data = get_fake_data(size)
+        repeat = 3 if size <= 1000 else 1
+
+        def setup():
+            credentials, business_entity, enterprise = seed_workspace(data)
+            seed_dictionaries(data, credentials)
+            page = get_stock_page(data, str(enterprise.guid), size)
+            return page, enterprise, credentials
+
+        def fill_page(page, enterprise, credentials):
+            result_xml = ET.fromstring(page)
+            for stock_entry_xml in result_xml.iterfind('.//vd:stockEntryList/vd:stockEntry', NAMESPACES):
+                fill_stock_entry_from_xml(StockEntry(), enterprise, stock_entry_xml, credentials)
+
+        def save_page(page, enterprise, credentials):
+            save_stock_entries_page(make_response(page), enterprise, credentials)
+
+        results[f'stock_page_{size}.fill_stock_entry_from_xml'] = measure_in_transaction(fill_page, setup, repeat)
+        results[f'stock_page_{size}.save_stock_entries_page'] = measure_in_transaction(save_page, setup, repeat)
+    return results
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.test import RequestFactory
+
+from main import views
+from . import measure
+from .fixtures import get_fake_data, seed_stock_entries, seed_workspace
+
+
+def render(view, request) -> int:
+    response = view(request)
+    response.render()
+    return len(response.content)
+
+
+def run(sizes: list[int]) -> dict[str, dict]:
+    """Stock journal and index pages on a database seeded with `size` current stock entries"""
+
+    factory = RequestFactory()
+
+    results = {}
+    for size in sizes:
+        data = get_fake_data(size)
+
+        with transaction.atomic():
+            credentials, business_entity, enterprise = seed_workspace(data)
+            seed_stock_entries(data, enterprise, size)
+
+            def stock_entries():
+                request = factory.post('/stock/', {'has_quantity': 'on'})
+                request.user = AnonymousUser()
+                request.session = {'business_entity': business_entity.id, 'enterprise': enterprise.id}
+                return render(views.stock_entries, request)
+
+            def index():
+                request = factory.get('/')
+                request.user = AnonymousUser()
+                request.session = {}
+                return render(views.index, request)
+
+            results[f'seeded_{size}.stock_entries'] = measure(stock_entries, repeat=3)
+            results[f'seeded_{size}.index'] = measure(index, repeat=3)
+
+            transaction.set_rollback(True)
+    return results
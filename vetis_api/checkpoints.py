@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import F, QuerySet
+
+from .models import TZ_MOSCOW, SyncCheckpoint
+
+
+DEACTIVATE_BATCH_SIZE = 1000
+
+
+# Multi-page syncs commit every page together with their checkpoint. A failed or
+# killed task started again resumes after the last committed page instead of
+# requesting all pages from Vetis again:
+#
+#     checkpoint = start_checkpoint('reload_enterprises', business_entity.guid)
+#     while not is_checkpoint_done(checkpoint):
+#         response = request page at checkpoint.list_offset
+#         with transaction.atomic():
+#             save page
+#             advance_checkpoint(checkpoint, list_count, total, page_guids)
+#     with transaction.atomic():
+#         deactivate_unseen(rows of the list, checkpoint)  # if the list is complete, e.g. enterprises
+#         finish_checkpoint(checkpoint)  # with "sync is done" marks, if any
+#
+# Rows are never deactivated page by page: a sync interrupted midway would leave
+# the rows of pages not reached yet inactive until it is resumed.
+
+
+def get_checkpoint_max_age() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'VETIS_SYNC_CHECKPOINT_MAX_AGE', 24 * 60 * 60))
+
+
+def start_checkpoint(task: str, object_guid, start=None) -> SyncCheckpoint:
+    """
+    Returns checkpoint of an interrupted sync or a new one at offset 0.
+
+    start() returns fields of a new checkpoint (mode, begin_date, end_date). An interrupted
+    sync is resumed with the window it was started with. Checkpoints not updated for
+    VETIS_SYNC_CHECKPOINT_MAX_AGE seconds are discarded: the list has changed since,
+    offsets do not point to the same entries any more.
+    """
+
+    checkpoint, is_created = SyncCheckpoint.objects.get_or_create(
+        task=task,
+        object_guid=object_guid,
+        defaults=start() if start is not None else {}
+    )
+
+    if not is_created and checkpoint.date_updated < datetime.now(tz=TZ_MOSCOW) - get_checkpoint_max_age():
+        print(f'{task}: discarding checkpoint of {checkpoint.date_updated} at list_offset={checkpoint.list_offset}')
+        checkpoint.delete()
+        return start_checkpoint(task, object_guid, start)
+
+    if not is_created:
+        print(f'{task}: resuming from list_offset={checkpoint.list_offset}')
+
+    return checkpoint
+
+
+def advance_checkpoint(checkpoint: SyncCheckpoint, list_count: int, total: int, seen_guids=None):
+    """
+    Moves checkpoint past the page saved in current transaction, seen_guids of the page are added
+    to the checkpoint for deactivate_unseen.
+    Raises RuntimeError if another task has moved or finished it meanwhile, so the page is rolled back.
+    """
+
+    fields = {
+        'list_offset': F('list_offset') + list_count,
+        'total': total,
+        'date_updated': datetime.now(tz=TZ_MOSCOW),
+    }
+    if seen_guids is not None:
+        # the row is ours while list_offset matches, so the list is not changed by another task in between
+        fields['seen_guids'] = checkpoint.seen_guids + [str(guid).lower() for guid in seen_guids]
+
+    is_updated = SyncCheckpoint.objects.filter(id=checkpoint.id, list_offset=checkpoint.list_offset).update(**fields)
+    if not is_updated:
+        raise RuntimeError('Синхронизация выполняется другой задачей')
+
+    checkpoint.list_offset += list_count
+    checkpoint.total = total
+    if seen_guids is not None:
+        checkpoint.seen_guids = fields['seen_guids']
+
+
+def is_checkpoint_done(checkpoint: SyncCheckpoint) -> bool:
+    return checkpoint.total is not None and checkpoint.list_offset >= checkpoint.total
+
+
+def deactivate_unseen(queryset: QuerySet, checkpoint: SyncCheckpoint) -> int:
+    """Deactivates active rows of queryset missing from the pages of the sync, returns their number"""
+
+    seen_guids = set(checkpoint.seen_guids)
+    unseen_ids = [pk for pk, guid in queryset.filter(is_active=True).values_list('pk', 'guid') if str(guid) not in seen_guids]
+
+    for i in range(0, len(unseen_ids), DEACTIVATE_BATCH_SIZE):
+        queryset.model.objects.filter(pk__in=unseen_ids[i:i + DEACTIVATE_BATCH_SIZE]).update(is_active=False)
+
+    return len(unseen_ids)
+
+
+def finish_checkpoint(checkpoint: SyncCheckpoint):
+    checkpoint.delete()
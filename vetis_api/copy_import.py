@@ -0,0 +1,410 @@
+from django.conf import settings
+from django.db import connection
+
+from .current_stock import get_refresh_sql
+from .models import *
+from .records import StockEntryRecord
+
+
+# Initial import of a stock journal on PostgreSQL.
+#
+# Parsed entries are streamed with COPY into temporary staging tables, which are
+# merged into journal tables with a few set-based statements at the end, instead
+# of saving batch by batch through the ORM. Staging tables are dropped on commit.
+
+
+TABLES = {
+    'stage_stock_entry': 'vetis_stage_stockentry',
+    'stage_package': 'vetis_stage_package',
+    'stage_vet_document': 'vetis_stage_vetdocument',
+    'stock_entry': StockEntry._meta.db_table,
+    'stock_entry_main': StockEntryMain._meta.db_table,
+    'package': Package._meta.db_table,
+    'vet_document': StockEntryVetDocument._meta.db_table,
+    'packing_type': PackingType._meta.db_table,
+    'unit': Unit._meta.db_table,
+    'product': Product._meta.db_table,
+    'subproduct': SubProduct._meta.db_table,
+    'product_item': ProductItem._meta.db_table,
+    'enterprise': Enterprise._meta.db_table,
+}
+
+
+STAGE_STOCK_ENTRY_COLUMNS = (
+    'position', 'guid', 'uuid', 'is_active', 'is_last', 'status', 'date_created', 'date_updated',
+    'previous_uuid', 'next_uuid', 'entry_number', 'product_type', 'product_guid', 'subproduct_guid',
+    'product_item_guid', 'product_item_name', 'volume', 'unit_guid', 'unit_name',
+    'date_produced_1', 'date_produced_2', 'date_produced', 'date_expiry_1', 'date_expiry_2', 'date_expiry',
+    'is_perishable', 'origin_country', 'producer_name', 'producer_guid',
+)
+
+STAGE_PACKAGE_COLUMNS = (
+    'position', 'level', 'packing_type_guid', 'packing_type_uuid', 'packing_type_name',
+    'packing_type_global_id', 'quantity', 'product_marks',
+)
+
+STAGE_VET_DOCUMENT_COLUMNS = ('position', 'uuid')
+
+
+CREATE_STAGE_SQL = [
+    '''
+    CREATE TEMPORARY TABLE {stage_stock_entry} (
+        position bigint NOT NULL,
+        guid uuid NOT NULL,
+        uuid uuid NOT NULL,
+        is_active boolean NOT NULL,
+        is_last boolean NOT NULL,
+        status integer NOT NULL,
+        date_created timestamp with time zone NOT NULL,
+        date_updated timestamp with time zone NOT NULL,
+        previous_uuid uuid,
+        next_uuid uuid,
+        entry_number bigint NOT NULL,
+        product_type integer NOT NULL,
+        product_guid uuid,
+        subproduct_guid uuid,
+        product_item_guid uuid,
+        product_item_name varchar(255) NOT NULL,
+        volume numeric(15, 6) NOT NULL,
+        unit_guid uuid NOT NULL,
+        unit_name varchar(255) NOT NULL,
+        date_produced_1 varchar(16) NOT NULL,
+        date_produced_2 varchar(16),
+        date_produced timestamp with time zone NOT NULL,
+        date_expiry_1 varchar(16) NOT NULL,
+        date_expiry_2 varchar(16),
+        date_expiry timestamp with time zone NOT NULL,
+        is_perishable boolean NOT NULL,
+        origin_country varchar(255),
+        producer_name varchar(255),
+        producer_guid uuid
+    ) ON COMMIT DROP
+    ''',
+    '''
+    CREATE TEMPORARY TABLE {stage_package} (
+        position bigint NOT NULL,
+        level integer NOT NULL,
+        packing_type_guid uuid NOT NULL,
+        packing_type_uuid uuid NOT NULL,
+        packing_type_name varchar(255) NOT NULL,
+        packing_type_global_id varchar(2),
+        quantity integer NOT NULL,
+        product_marks text NOT NULL
+    ) ON COMMIT DROP
+    ''',
+    '''
+    CREATE TEMPORARY TABLE {stage_vet_document} (
+        position bigint NOT NULL,
+        uuid uuid NOT NULL
+    ) ON COMMIT DROP
+    ''',
+]
+
+
+# Statements are run in this order, %(enterprise_id)s is the only parameter.
+MERGE_SQL = [
+    # the last occurrence wins if a version is repeated on several pages
+    '''
+    DELETE FROM {stage_stock_entry} s
+    USING {stage_stock_entry} later
+    WHERE later.uuid = s.uuid AND later.position > s.position
+    ''',
+    'ANALYZE {stage_stock_entry}',
+    'ANALYZE {stage_package}',
+    'ANALYZE {stage_vet_document}',
+    '''
+    INSERT INTO {unit} (guid, name)
+    SELECT DISTINCT ON (unit_guid) unit_guid, unit_name
+    FROM {stage_stock_entry}
+    ORDER BY unit_guid
+    ON CONFLICT (guid) DO NOTHING
+    ''',
+    '''
+    INSERT INTO {packing_type} (guid, uuid, name, global_id)
+    SELECT DISTINCT ON (packing_type_guid) packing_type_guid, packing_type_uuid, packing_type_name, COALESCE(packing_type_global_id, '')
+    FROM {stage_package}
+    ORDER BY packing_type_guid
+    ON CONFLICT DO NOTHING
+    ''',
+    '''
+    INSERT INTO {stock_entry_main} (guid, is_populated, source_be_name, source_ent_name, comment_important, comment_text)
+    SELECT DISTINCT guid, false, '', '', false, ''
+    FROM {stage_stock_entry}
+    ON CONFLICT (guid) DO NOTHING
+    ''',
+    # optional values keep stored ones when missing, as set_stock_entry_fields does;
+    # unchanged versions are not rewritten (see is_stock_entry_unchanged)
+    '''
+    INSERT INTO {stock_entry} AS se (
+        main_id, enterprise_id, guid, uuid, is_active, is_last, status, date_created, date_updated,
+        previous_uuid, next_uuid, entry_number, product_type, product_guid, product_id,
+        subproduct_guid, subproduct_id, product_item_guid, product_item_name, product_item_id,
+        volume, unit_id, date_produced_1, date_produced_2, date_produced,
+        date_expiry_1, date_expiry_2, date_expiry, is_perishable,
+        origin_country, producer_name, producer_guid, producer_id
+    )
+    SELECT
+        m.id, %(enterprise_id)s, s.guid, s.uuid, s.is_active, s.is_last, s.status, s.date_created, s.date_updated,
+        s.previous_uuid, s.next_uuid, s.entry_number, s.product_type, s.product_guid, p.id,
+        s.subproduct_guid, sp.id, s.product_item_guid, s.product_item_name, pi.id,
+        s.volume, u.id, s.date_produced_1, COALESCE(s.date_produced_2, ''), s.date_produced,
+        s.date_expiry_1, COALESCE(s.date_expiry_2, ''), s.date_expiry, s.is_perishable,
+        s.origin_country, s.producer_name, s.producer_guid, pr.id
+    FROM {stage_stock_entry} s
+    JOIN {stock_entry_main} m ON m.guid = s.guid
+    JOIN {unit} u ON u.guid = s.unit_guid
+    LEFT JOIN {product} p ON p.guid = s.product_guid
+    LEFT JOIN {subproduct} sp ON sp.guid = s.subproduct_guid
+    LEFT JOIN {product_item} pi ON pi.guid = s.product_item_guid
+    LEFT JOIN {enterprise} pr ON pr.guid = s.producer_guid
+    ON CONFLICT (uuid) DO UPDATE SET
+        main_id = EXCLUDED.main_id,
+        enterprise_id = EXCLUDED.enterprise_id,
+        guid = EXCLUDED.guid,
+        is_active = EXCLUDED.is_active,
+        is_last = EXCLUDED.is_last,
+        status = EXCLUDED.status,
+        date_created = EXCLUDED.date_created,
+        date_updated = EXCLUDED.date_updated,
+        previous_uuid = COALESCE(EXCLUDED.previous_uuid, se.previous_uuid),
+        next_uuid = COALESCE(EXCLUDED.next_uuid, se.next_uuid),
+        entry_number = EXCLUDED.entry_number,
+        product_type = EXCLUDED.product_type,
+        product_guid = EXCLUDED.product_guid,
+        product_id = EXCLUDED.product_id,
+        subproduct_guid = EXCLUDED.subproduct_guid,
+        subproduct_id = EXCLUDED.subproduct_id,
+        product_item_guid = COALESCE(EXCLUDED.product_item_guid, se.product_item_guid),
+        product_item_name = EXCLUDED.product_item_name,
+        product_item_id = CASE WHEN EXCLUDED.product_item_guid IS NULL THEN se.product_item_id ELSE EXCLUDED.product_item_id END,
+        volume = EXCLUDED.volume,
+        unit_id = EXCLUDED.unit_id,
+        date_produced_1 = EXCLUDED.date_produced_1,
+        date_produced_2 = COALESCE(NULLIF(EXCLUDED.date_produced_2, ''), se.date_produced_2),
+        date_produced = EXCLUDED.date_produced,
+        date_expiry_1 = EXCLUDED.date_expiry_1,
+        date_expiry_2 = COALESCE(NULLIF(EXCLUDED.date_expiry_2, ''), se.date_expiry_2),
+        date_expiry = EXCLUDED.date_expiry,
+        is_perishable = EXCLUDED.is_perishable,
+        origin_country = COALESCE(EXCLUDED.origin_country, se.origin_country),
+        producer_name = COALESCE(EXCLUDED.producer_name, se.producer_name),
+        producer_guid = COALESCE(EXCLUDED.producer_guid, se.producer_guid),
+        producer_id = COALESCE(EXCLUDED.producer_id, se.producer_id)
+    WHERE (se.enterprise_id, se.date_updated, se.is_active, se.is_last, se.status, se.next_uuid)
+        IS DISTINCT FROM (EXCLUDED.enterprise_id, EXCLUDED.date_updated, EXCLUDED.is_active, EXCLUDED.is_last, EXCLUDED.status, EXCLUDED.next_uuid)
+    ''',
+    # packages and vet documents: equal rows are numbered, so duplicates are matched
+    # one to one and only the differences are deleted and inserted (see diff_rows)
+    '''
+    WITH staged AS (
+        SELECT se.id AS stock_entry_id, sp.level, pt.id AS packing_type_id, sp.quantity, sp.product_marks,
+            row_number() OVER (PARTITION BY se.id, sp.level, pt.id, sp.quantity, sp.product_marks) AS n
+        FROM {stage_package} sp
+        JOIN {stage_stock_entry} s ON s.position = sp.position
+        JOIN {stock_entry} se ON se.uuid = s.uuid
+        JOIN {packing_type} pt ON pt.guid = sp.packing_type_guid
+    ), stored AS (
+        SELECT p.id, p.stock_entry_id, p.level, p.packing_type_id, p.quantity, p.product_marks,
+            row_number() OVER (PARTITION BY p.stock_entry_id, p.level, p.packing_type_id, p.quantity, p.product_marks ORDER BY p.id) AS n
+        FROM {package} p
+        JOIN {stock_entry} se ON se.id = p.stock_entry_id
+        JOIN {stage_stock_entry} s ON s.uuid = se.uuid
+    )
+    DELETE FROM {package}
+    WHERE id IN (
+        SELECT stored.id FROM stored
+        WHERE NOT EXISTS (
+            SELECT 1 FROM staged
+            WHERE staged.stock_entry_id = stored.stock_entry_id AND staged.level = stored.level
+                AND staged.packing_type_id = stored.packing_type_id AND staged.quantity = stored.quantity
+                AND staged.product_marks = stored.product_marks AND staged.n = stored.n
+        )
+    )
+    ''',
+    '''
+    WITH staged AS (
+        SELECT se.id AS stock_entry_id, sp.level, pt.id AS packing_type_id, sp.quantity, sp.product_marks,
+            row_number() OVER (PARTITION BY se.id, sp.level, pt.id, sp.quantity, sp.product_marks) AS n
+        FROM {stage_package} sp
+        JOIN {stage_stock_entry} s ON s.position = sp.position
+        JOIN {stock_entry} se ON se.uuid = s.uuid
+        JOIN {packing_type} pt ON pt.guid = sp.packing_type_guid
+    ), stored AS (
+        SELECT p.stock_entry_id, p.level, p.packing_type_id, p.quantity, p.product_marks,
+            row_number() OVER (PARTITION BY p.stock_entry_id, p.level, p.packing_type_id, p.quantity, p.product_marks ORDER BY p.id) AS n
+        FROM {package} p
+        JOIN {stock_entry} se ON se.id = p.stock_entry_id
+        JOIN {stage_stock_entry} s ON s.uuid = se.uuid
+    )
+    INSERT INTO {package} (stock_entry_id, level, packing_type_id, quantity, product_marks)
+    SELECT staged.stock_entry_id, staged.level, staged.packing_type_id, staged.quantity, staged.product_marks
+    FROM staged
+    WHERE NOT EXISTS (
+        SELECT 1 FROM stored
+        WHERE stored.stock_entry_id = staged.stock_entry_id AND stored.level = staged.level
+            AND stored.packing_type_id = staged.packing_type_id AND stored.quantity = staged.quantity
+            AND stored.product_marks = staged.product_marks AND stored.n = staged.n
+    )
+    ''',
+    '''
+    WITH staged AS (
+        SELECT se.id AS stock_entry_id, vd.uuid,
+            row_number() OVER (PARTITION BY se.id, vd.uuid) AS n
+        FROM {stage_vet_document} vd
+        JOIN {stage_stock_entry} s ON s.position = vd.position
+        JOIN {stock_entry} se ON se.uuid = s.uuid
+    ), stored AS (
+        SELECT d.id, d.stock_entry_id, d.uuid,
+            row_number() OVER (PARTITION BY d.stock_entry_id, d.uuid ORDER BY d.id) AS n
+        FROM {vet_document} d
+        JOIN {stock_entry} se ON se.id = d.stock_entry_id
+        JOIN {stage_stock_entry} s ON s.uuid = se.uuid
+    )
+    DELETE FROM {vet_document}
+    WHERE id IN (
+        SELECT stored.id FROM stored
+        WHERE NOT EXISTS (
+            SELECT 1 FROM staged
+            WHERE staged.stock_entry_id = stored.stock_entry_id AND staged.uuid = stored.uuid AND staged.n = stored.n
+        )
+    )
+    ''',
+    '''
+    WITH staged AS (
+        SELECT se.id AS stock_entry_id, vd.uuid,
+            row_number() OVER (PARTITION BY se.id, vd.uuid) AS n
+        FROM {stage_vet_document} vd
+        JOIN {stage_stock_entry} s ON s.position = vd.position
+        JOIN {stock_entry} se ON se.uuid = s.uuid
+    ), stored AS (
+        SELECT d.stock_entry_id, d.uuid,
+            row_number() OVER (PARTITION BY d.stock_entry_id, d.uuid ORDER BY d.id) AS n
+        FROM {vet_document} d
+        JOIN {stock_entry} se ON se.id = d.stock_entry_id
+        JOIN {stage_stock_entry} s ON s.uuid = se.uuid
+    )
+    INSERT INTO {vet_document} (stock_entry_id, uuid)
+    SELECT staged.stock_entry_id, staged.uuid
+    FROM staged
+    WHERE NOT EXISTS (
+        SELECT 1 FROM stored
+        WHERE stored.stock_entry_id = staged.stock_entry_id AND stored.uuid = staged.uuid AND stored.n = staged.n
+    )
+    ''',
+]
+
+
+def use_copy_import(update_mode: str) -> bool:
+    """COPY import is used for INITIAL updates on PostgreSQL unless disabled with VETIS_INITIAL_COPY_IMPORT"""
+
+    return (
+        update_mode == 'INITIAL'
+        and connection.vendor == 'postgresql'
+        and getattr(settings, 'VETIS_INITIAL_COPY_IMPORT', True)
+    )
+
+
+def stock_entry_row(position: int, record: StockEntryRecord) -> tuple:
+    return (
+        position,
+        record.guid,
+        record.uuid,
+        record.is_active,
+        record.is_last,
+        record.status,
+        record.date_created,
+        record.date_updated,
+        record.previous_uuid,
+        record.next_uuid,
+        record.entry_number,
+        record.product_type,
+        record.product_guid,
+        record.subproduct_guid,
+        record.product_item_guid,
+        record.product_item_name,
+        0 if record.status in [201] else record.volume,  # запись аннулирована
+        record.unit_guid,
+        record.unit_name,
+        record.date_produced_1.to_string(),
+        record.date_produced_2.to_string() if record.date_produced_2 is not None else None,
+        record.date_produced_1.to_datetime(),
+        record.date_expiry_1.to_string(),
+        record.date_expiry_2.to_string() if record.date_expiry_2 is not None else None,
+        record.date_expiry_1.to_datetime(),
+        record.is_perishable,
+        record.origin_country,
+        record.producer_name,
+        record.producer_guid,
+    )
+
+
+class StockEntryCopyImport:
+    """
+    Collects stock entries of an INITIAL update in staging tables and merges them
+    into the journal of the enterprise. Must be used inside one transaction:
+
+        with transaction.atomic():
+            importer = StockEntryCopyImport(enterprise)
+            for each page:
+                importer.add(stock_entry_records)  # dictionaries are expected to be loaded
+            importer.merge()
+    """
+
+    def __init__(self, enterprise: Enterprise):
+        self.enterprise = enterprise
+        self.position = 0
+        self.staged = 0
+        self._is_created = False
+
+    def _create_stage(self, cursor):
+        for sql in CREATE_STAGE_SQL:
+            cursor.execute(sql.format(**TABLES))
+        self._is_created = True
+
+    def add(self, records: list[StockEntryRecord]):
+        with connection.cursor() as cursor:
+            if not self._is_created:
+                self._create_stage(cursor)
+
+            packages = []
+            vet_documents = []
+
+            with cursor.copy(f'COPY {TABLES["stage_stock_entry"]} ({", ".join(STAGE_STOCK_ENTRY_COLUMNS)}) FROM STDIN') as copy:
+                for record in records:
+                    self.position += 1
+                    copy.write_row(stock_entry_row(self.position, record))
+                    for package_record in record.packages:
+                        packages.append((
+                            self.position,
+                            package_record.level,
+                            package_record.packing_type_guid,
+                            package_record.packing_type_uuid,
+                            package_record.packing_type_name,
+                            package_record.packing_type_global_id,
+                            package_record.quantity,
+                            ' '.join(package_record.product_marks),
+                        ))
+                    for vet_document_uuid in record.vet_document_uuids:
+                        vet_documents.append((self.position, vet_document_uuid))
+
+            with cursor.copy(f'COPY {TABLES["stage_package"]} ({", ".join(STAGE_PACKAGE_COLUMNS)}) FROM STDIN') as copy:
+                for row in packages:
+                    copy.write_row(row)
+
+            with cursor.copy(f'COPY {TABLES["stage_vet_document"]} ({", ".join(STAGE_VET_DOCUMENT_COLUMNS)}) FROM STDIN') as copy:
+                for row in vet_documents:
+                    copy.write_row(row)
+
+        self.staged += len(records)
+
+    def merge(self):
+        if not self._is_created:
+            return
+
+        with connection.cursor() as cursor:
+            for sql in MERGE_SQL:
+                params = {'enterprise_id': self.enterprise.id} if '%(enterprise_id)s' in sql else None
+                cursor.execute(sql.format(**TABLES), params)
+
+            for sql in get_refresh_sql('{table}.guid IN (SELECT guid FROM ' + TABLES['stage_stock_entry'] + ')'):
+                cursor.execute(sql)
@@ -0,0 +1,111 @@
+from django.db import connection
+
+from .models import CurrentStockEntry, StockEntry, StockEntryMain
+
+
+# CurrentStockEntry holds one row per journal entry (GUID): its last active version
+# with the fields of the main record the journal shows. Rows are rebuilt with one
+# INSERT ... SELECT for the GUIDs a sync has written versions of.
+
+
+TABLES = {
+    'current_stock_entry': CurrentStockEntry._meta.db_table,
+    'stock_entry': StockEntry._meta.db_table,
+    'stock_entry_main': StockEntryMain._meta.db_table,
+}
+
+# column of CurrentStockEntry: expression over stock entry "se" and its main record "m"
+CURRENT_STOCK_COLUMNS = {
+    'guid': 'se.guid',
+    'stock_entry_id': 'se.id',
+    'main_id': 'se.main_id',
+    'enterprise_id': 'se.enterprise_id',
+    'entry_number': 'se.entry_number',
+    'product_type': 'se.product_type',
+    'product_id': 'se.product_id',
+    'product_item_name': 'se.product_item_name',
+    'volume': 'se.volume',
+    'unit_id': 'se.unit_id',
+    'date_produced_1': 'se.date_produced_1',
+    'date_produced_2': 'se.date_produced_2',
+    'date_produced': 'se.date_produced',
+    'date_expiry_1': 'se.date_expiry_1',
+    'date_expiry_2': 'se.date_expiry_2',
+    'date_expiry': 'se.date_expiry',
+    'date_created': 'se.date_created',
+    'date_updated': 'se.date_updated',
+    'is_perishable': 'se.is_perishable',
+    'origin_country': 'se.origin_country',
+    'producer_name': 'se.producer_name',
+    'is_populated': 'm.is_populated',
+    'initial_status': 'm.initial_status',
+    'initial_volume': 'm.initial_volume',
+    'source_be_name': 'm.source_be_name',
+    'source_ent_name': 'm.source_ent_name',
+    'comment_important': 'm.comment_important',
+    'comment_text': 'm.comment_text',
+}
+
+MAIN_FIELDS = [
+    'is_populated', 'initial_status', 'initial_volume', 'source_be_name', 'source_ent_name',
+    'comment_important', 'comment_text',
+]
+
+
+def get_refresh_sql(guid_condition: str) -> list[str]:
+    """
+    Statements rebuilding current stock rows of GUIDs selected by guid_condition
+    (SQL over {table}.guid). Of several versions marked last the latest updated one wins.
+    Works on PostgreSQL and SQLite.
+    """
+
+    columns = ', '.join(CURRENT_STOCK_COLUMNS)
+    expressions = ', '.join(CURRENT_STOCK_COLUMNS.values())
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in CURRENT_STOCK_COLUMNS if column != 'guid')
+
+    return [
+        # entries that are not current any more (closed, deleted, superseded)
+        f'''
+        DELETE FROM {TABLES['current_stock_entry']}
+        WHERE {guid_condition.format(table=TABLES['current_stock_entry'])}
+        AND NOT EXISTS (
+            SELECT 1 FROM {TABLES['stock_entry']} se
+            WHERE se.id = {TABLES['current_stock_entry']}.stock_entry_id AND se.is_last AND se.is_active
+        )
+        ''',
+        f'''
+        INSERT INTO {TABLES['current_stock_entry']} ({columns})
+        SELECT {expressions}
+        FROM {TABLES['stock_entry']} se
+        JOIN {TABLES['stock_entry_main']} m ON m.id = se.main_id
+        WHERE {guid_condition.format(table='se')} AND se.is_last AND se.is_active
+        AND NOT EXISTS (
+            SELECT 1 FROM {TABLES['stock_entry']} later
+            WHERE later.guid = se.guid AND later.is_last AND later.is_active
+            AND (later.date_updated > se.date_updated OR (later.date_updated = se.date_updated AND later.id > se.id))
+        )
+        ON CONFLICT (guid) DO UPDATE SET {updates}
+        ''',
+    ]
+
+
+def refresh_current_stock(guids):
+    """Rebuilds current stock rows of the journal entries with given GUIDs"""
+
+    guid_field = StockEntry._meta.get_field('guid')
+    params = [guid_field.get_db_prep_value(guid, connection) for guid in {str(guid).lower() for guid in guids}]
+    if not params:
+        return
+
+    guid_condition = '{table}.guid IN (' + ', '.join(['%s'] * len(params)) + ')'
+    with connection.cursor() as cursor:
+        for sql in get_refresh_sql(guid_condition):
+            cursor.execute(sql, params)
+
+
+def refresh_current_stock_main(stock_entry_main: StockEntryMain):
+    """Copies main record fields (origin, comment) to its current stock row"""
+
+    CurrentStockEntry.objects.filter(main=stock_entry_main).update(
+        **{field: getattr(stock_entry_main, field) for field in MAIN_FIELDS}
+    )
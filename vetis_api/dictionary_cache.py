@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection, models, transaction
+
+from .util import get_shared_cache
+
+
+DEFAULT_SIZE = 2000  # records per model
+GENERATION_CHECK_INTERVAL = 10.0  # seconds between checks of invalidations made by other processes
+CACHED_MODELS = ('Product', 'SubProduct', 'ProductItem', 'Unit', 'PackingType', 'Enterprise')
+
+
+class _Pending:
+    """
+    Marks a record cached inside a transaction. The record is valid while its on_commit
+    callback is still registered (transaction or savepoint was not rolled back) or has run.
+    """
+
+    __slots__ = ('committed', 'callback')
+
+    def __init__(self):
+        self.committed = False
+
+        def commit():
+            self.committed = True
+
+        self.callback = commit
+        transaction.on_commit(commit)
+
+    def is_valid(self) -> bool:
+        if self.committed:
+            return True
+        return any(callback is self.callback for _, callback, *_ in connection.run_on_commit)
+
+
+class ModelCache:
+    """
+    LRU of model records by lowercase GUID, local to the process.
+    Invalidation is published in the shared cache as a new generation of the model,
+    other processes drop their records when they notice it.
+    """
+
+    def __init__(self, label: str, maxsize: int):
+        self.label = label
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        self._lock = Lock()
+        self._generation = None
+        self._checked_at = None
+
+    def _generation_key(self) -> str:
+        return f'vetis-dictionary-cache:{self.label}'
+
+    def _check_generation(self):
+        now = monotonic()
+        if self._checked_at is not None and now - self._checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        generation = get_shared_cache().get(self._generation_key())
+        if generation != self._generation:
+            with self._lock:
+                self._records.clear()
+            self._generation = generation
+
+    def get(self, guid) -> models.Model | None:
+        if not self.maxsize:
+            self.misses += 1
+            return None
+
+        self._check_generation()
+        key = str(guid).lower()
+        with self._lock:
+            item = self._records.get(key)
+            if item is not None:
+                record, pending = item
+                if pending is None or pending.is_valid():
+                    self._records.move_to_end(key)
+                    self.hits += 1
+                    return record
+                # written by a transaction that was rolled back
+                del self._records[key]
+            self.misses += 1
+        return None
+
+    def get_many(self, guids) -> dict[str, models.Model]:
+        """Cached records among guids, keyed by lowercase GUID"""
+
+        result = {}
+        for guid in guids:
+            record = self.get(guid)
+            if record is not None:
+                result[str(guid).lower()] = record
+        return result
+
+    def put(self, record: models.Model):
+        if not self.maxsize or record.pk is None:
+            return
+
+        pending = _Pending() if connection.in_atomic_block else None
+        key = str(record.guid).lower()
+        with self._lock:
+            self._records[key] = (record, pending)
+            self._records.move_to_end(key)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Drops records of the model here and, once the current transaction is committed,
+        in other processes (until then they could read and cache the old rows again).
+        """
+
+        with self._lock:
+            self._records.clear()
+        transaction.on_commit(self._publish_invalidation)
+
+    def _publish_invalidation(self):
+        self._generation = uuid4().hex
+        self._checked_at = monotonic()
+        get_shared_cache().set(self._generation_key(), self._generation, timeout=None)
+        with self._lock:
+            self._records.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._records),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+        }
+
+
+class DictionaryCache:
+    """
+    Per-process cache of dictionary records looked up by GUID while filling stock entries.
+    Models not listed in CACHED_MODELS pass through: nothing is cached or counted.
+    """
+
+    def __init__(self, model_names):
+        self.model_names = tuple(model_names)
+        self._caches = {}
+
+    def _cache(self, model: type[models.Model]) -> ModelCache | None:
+        if model.__name__ not in self.model_names:
+            return None
+        cache = self._caches.get(model.__name__)
+        if cache is None:
+            maxsize = getattr(settings, 'VETIS_DICTIONARY_CACHE_SIZE', DEFAULT_SIZE)
+            cache = self._caches.setdefault(model.__name__, ModelCache(model._meta.label_lower, maxsize))
+        return cache
+
+    def get(self, model: type[models.Model], guid) -> models.Model | None:
+        cache = self._cache(model)
+        return cache.get(guid) if cache is not None else None
+
+    def get_many(self, model: type[models.Model], guids) -> dict[str, models.Model]:
+        cache = self._cache(model)
+        return cache.get_many(guids) if cache is not None else {}
+
+    def put(self, record: models.Model):
+        cache = self._cache(record.__class__)
+        if cache is not None:
+            cache.put(record)
+
+    def invalidate(self, model: type[models.Model]):
+        cache = self._cache(model)
+        if cache is not None:
+            cache.invalidate()
+
+    def stats(self) -> dict[str, dict]:
+        """Size and hit/miss counters by model name, for sizing VETIS_DICTIONARY_CACHE_SIZE"""
+        return {name: cache.stats() for name, cache in self._caches.items()}
+
+    def format_stats(self) -> str:
+        return ', '.join(
+            f'{name} {stats["hits"]}/{stats["hits"] + stats["misses"]} ({stats["size"]}/{stats["maxsize"]})'
+            for name, stats in self.stats().items()
+        )
+
+
+dictionary_cache = DictionaryCache(CACHED_MODELS)
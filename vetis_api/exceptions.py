@@ -0,0 +1,106 @@
+import xml.etree.ElementTree as ET
+
+from .xml.settings import NAMESPACES
+
+
+class VetisError(RuntimeError):
+    """Base class for errors of Vetis API calls"""
+
+
+class VetisConnectionError(VetisError):
+    """Request was not delivered or response was not received"""
+
+
+class VetisHttpError(VetisError):
+    """Vetis responded with HTTP error status"""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def is_retryable(self) -> bool:
+        return self.status_code in (502, 503, 504)
+
+
+class VetisSoapFault(VetisHttpError):
+    """
+    SOAP fault returned by Vetis.
+    `fault_type` is the local name of the fault element in detail
+    (internalServiceErrorFault, incorrectRequestFault, accessDeniedFault...),
+    `errors` is a list of (code, text) from bs:error elements.
+    """
+
+    RETRYABLE_FAULT_TYPES = ('internalServiceErrorFault', 'serviceUnavailableFault')
+
+    def __init__(self, status_code: int, fault_code: str, fault_string: str, fault_type: str = None, errors: list = None):
+        self.fault_code = fault_code
+        self.fault_string = fault_string
+        self.fault_type = fault_type
+        self.errors = errors or []
+        message = f'Ошибка Ветис ({status_code}, {fault_type or fault_code}): {fault_string}'
+        if self.errors:
+            message += ' ' + '; '.join(f'[{code}] {text}' for code, text in self.errors)
+        super().__init__(message, status_code)
+
+    @property
+    def is_retryable(self) -> bool:
+        if self.fault_type is not None:
+            return self.fault_type in self.RETRYABLE_FAULT_TYPES
+        return bool(self.fault_code) and self.fault_code.split(':')[-1] == 'Server'
+
+
+class VetisApplicationError(VetisError):
+    """Two-step application was not accepted or was rejected"""
+
+    def __init__(self, message: str, status: str = None, errors: list = None):
+        self.status = status
+        self.errors = errors or []
+        if self.errors:
+            message += ' ' + '; '.join(f'[{code}] {text}' for code, text in self.errors)
+        super().__init__(message)
+
+
+def parse_errors(parent_xml: ET.Element) -> list[tuple[str, str]]:
+    errors = []
+    for error_xml in parent_xml.iter(f'{{{NAMESPACES["bs"]}}}error'):
+        errors.append((error_xml.get('code'), (error_xml.text or '').strip()))
+    return errors
+
+
+def parse_soap_fault(status_code: int, content: bytes) -> VetisSoapFault | None:
+    """Returns parsed SOAP fault or None if response body is not a fault"""
+
+    try:
+        result_xml = ET.fromstring(content)
+    except ET.ParseError:
+        return None
+
+    fault_xml = result_xml.find('./soapenv:Body/soapenv:Fault', NAMESPACES)
+    if fault_xml is None:
+        return None
+
+    fault_code = fault_xml.findtext('faultcode', default='')
+    fault_string = fault_xml.findtext('faultstring', default='').strip()
+
+    fault_type = None
+    errors = []
+    detail_xml = fault_xml.find('detail')
+    if detail_xml is not None and len(detail_xml):
+        fault_type = detail_xml[0].tag.split('}')[-1]
+        errors = parse_errors(detail_xml)
+
+    return VetisSoapFault(status_code, fault_code, fault_string, fault_type, errors)
+
+
+def get_response_error(response) -> VetisHttpError | None:
+    """Returns typed error for unsuccessful response or None for HTTP 200"""
+
+    if response.status_code == 200:
+        return None
+
+    fault = parse_soap_fault(response.status_code, response.content)
+    if fault is not None:
+        return fault
+
+    return VetisHttpError(f'Ошибка запроса ({response.status_code}): {response.reason}', response.status_code)
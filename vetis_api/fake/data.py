@@ -0,0 +1,245 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from uuid import NAMESPACE_URL, UUID, uuid5
+from xml.sax.saxutils import escape
+
+from ..models import TZ_MOSCOW
+
+
+UNITS = (
+    ('21ed96c9-337b-4a27-8761-c6e6ad3c9f5a', 'кг'),
+    ('6ea8e4c8-f0e3-4d51-b4c6-4aa3fcd8de4d', 'шт'),
+)
+
+PACKING_TYPES = (
+    ('7ee4d4b4-1bde-4a2a-95cf-9da5c7b3b6a1', 'BX', 'Ящик'),
+    ('d6e4c8b3-6f4f-4c3b-9f2a-1b7c5e3a2d10', 'BG', 'Мешок'),
+    ('0f6a6d53-3f1b-4e9c-a0a3-5e2d7c9b8a41', 'PK', 'Упаковка'),
+)
+
+BASE_DATE = datetime(2025, 1, 1, tzinfo=TZ_MOSCOW)
+
+
+def format_datetime(value: datetime) -> str:
+    return value.astimezone(TZ_MOSCOW).isoformat(timespec='seconds')
+
+
+def complex_date_xml(tag: str, value: datetime, with_day: bool = True) -> str:
+    day = f'<dt:day>{value.day}</dt:day>' if with_day else ''
+    return f'<vd:{tag}><dt:year>{value.year}</dt:year><dt:month>{value.month}</dt:month>{day}</vd:{tag}>'
+
+
+@dataclass
+class FakeData:
+    """
+    Deterministic synthetic Vetis data for the fake server.
+    Nothing is stored: every record is generated from its index, so a journal
+    of any size costs only the page being served. Records requested by GUID
+    that were not generated here are made up from the GUID itself.
+    """
+
+    stock_entries: int = 1000
+    versions: int = 2  # versions of every stock entry, the last one is in the journal
+    changed_entries: int = 100  # entries returned by getStockEntryChangesList
+    product_items: int = 100
+    products: int = 10
+    subproducts: int = 30
+    enterprises: int = 3
+    seed: int = 0
+
+    def make_guid(self, *parts) -> str:
+        return str(uuid5(NAMESPACE_URL, f'vetis-fake:{self.seed}:' + ':'.join(str(part) for part in parts)))
+
+    def _index(self, kind: str, guid: str, count: int) -> int:
+        for index in range(count):
+            if self.make_guid(kind, index) == guid:
+                return index
+        return UUID(guid).int % count
+
+    # dictionaries
+
+    def product_guid(self, index: int) -> str:
+        return self.make_guid('product', index % self.products)
+
+    def subproduct_guid(self, index: int) -> str:
+        return self.make_guid('subproduct', index % self.subproducts)
+
+    def product_item_guid(self, index: int) -> str:
+        return self.make_guid('product-item', index % self.product_items)
+
+    def product_xml(self, guid: str) -> str:
+        index = self._index('product', guid, self.products)
+        return (
+            f'<dt:product><bs:uuid>{self.make_guid("product-version", guid)}</bs:uuid><bs:guid>{guid}</bs:guid>'
+            f'<bs:active>true</bs:active><bs:last>true</bs:last><bs:status>100</bs:status>'
+            f'<dt:name>Продукция {index}</dt:name><dt:code>{1000 + index}</dt:code>'
+            f'<dt:productType>{index % 8 + 1}</dt:productType></dt:product>'
+        )
+
+    def subproduct_xml(self, guid: str) -> str:
+        index = self._index('subproduct', guid, self.subproducts)
+        return (
+            f'<dt:subProduct><bs:uuid>{self.make_guid("subproduct-version", guid)}</bs:uuid><bs:guid>{guid}</bs:guid>'
+            f'<bs:active>true</bs:active><bs:last>true</bs:last><bs:status>100</bs:status>'
+            f'<dt:name>Вид продукции {index}</dt:name><dt:code>{2000 + index}</dt:code>'
+            f'<dt:productGuid>{self.product_guid(index)}</dt:productGuid></dt:subProduct>'
+        )
+
+    def product_item_xml(self, guid: str, producer_guid: str = None) -> str:
+        index = self._index('product-item', guid, self.product_items)
+        producer = f'<dt:producer><bs:guid>{producer_guid}</bs:guid></dt:producer>' if producer_guid else ''
+        gost = '<dt:gost>ГОСТ 31798-2012</dt:gost>' if index % 4 == 0 else ''
+        return (
+            f'<dt:productItem><bs:uuid>{self.make_guid("product-item-version", guid)}</bs:uuid><bs:guid>{guid}</bs:guid>'
+            f'<bs:active>true</bs:active><bs:last>true</bs:last><bs:status>100</bs:status>'
+            f'<dt:globalID>{4600000000000 + index}</dt:globalID><dt:name>{escape(f"Наименование {index} & Ко")}</dt:name>'
+            f'<dt:productType>{index % 8 + 1}</dt:productType>'
+            f'<dt:product><bs:guid>{self.product_guid(index)}</bs:guid></dt:product>'
+            f'<dt:subProduct><bs:guid>{self.subproduct_guid(index)}</bs:guid></dt:subProduct>'
+            f'<dt:correspondsToGost>{"true" if gost else "false"}</dt:correspondsToGost>{gost}{producer}'
+            f'</dt:productItem>'
+        )
+
+    def business_entity_xml(self, guid: str) -> str:
+        return (
+            f'<dt:businessEntity><bs:uuid>{self.make_guid("business-entity-version", guid)}</bs:uuid><bs:guid>{guid}</bs:guid>'
+            f'<bs:active>true</bs:active><dt:type>1</dt:type><dt:name>ООО &quot;Поставщик {guid[:8]}&quot;</dt:name>'
+            f'<dt:inn>{UUID(guid).int % 10**10:010d}</dt:inn></dt:businessEntity>'
+        )
+
+    def enterprise_guid(self, business_entity_guid: str, index: int) -> str:
+        return self.make_guid('enterprise', business_entity_guid, index)
+
+    def enterprise_xml(self, guid: str, index: int = 0) -> str:
+        return (
+            f'<dt:enterprise><bs:uuid>{self.make_guid("enterprise-version", guid)}</bs:uuid><bs:guid>{guid}</bs:guid>'
+            f'<bs:active>true</bs:active><dt:name>Склад {index + 1}</dt:name><dt:type>1</dt:type>'
+            f'<dt:numberList><dt:enterpriseNumber>77-{index + 1:04d}</dt:enterpriseNumber></dt:numberList>'
+            f'<dt:address><dt:addressView>г. Москва, ул. Складская, д. {index + 1}</dt:addressView></dt:address>'
+            f'</dt:enterprise>'
+        )
+
+    def product_item_list(self, producer_guid: str, count: int, offset: int) -> tuple[int, str]:
+        items = ''.join(
+            self.product_item_xml(self.product_item_guid(index), producer_guid)
+            for index in range(offset, min(offset + count, self.product_items))
+        )
+        return self.product_items, items
+
+    def activity_location_list(self, business_entity_guid: str, count: int, offset: int) -> tuple[int, str]:
+        items = ''.join(
+            f'<dt:location>{self.enterprise_xml(self.enterprise_guid(business_entity_guid, index), index)}</dt:location>'
+            for index in range(offset, min(offset + count, self.enterprises))
+        )
+        return self.enterprises, items
+
+    # stock journal
+
+    def stock_entry_guid(self, index: int) -> str:
+        return self.make_guid('stock-entry', index)
+
+    def stock_entry_uuid(self, index: int, version: int) -> str:
+        return self.make_guid('stock-entry', index, version)
+
+    def stock_entry_status(self, index: int, version: int) -> int:
+        if version == 0:
+            return (102, 103, 100)[index % 3]
+        if version == self.versions - 1 and index % 50 == 49:
+            return 201
+        return 202
+
+    def stock_entry_xml(self, enterprise_guid: str, index: int, version: int = None, update_date: datetime = None) -> str:
+        if version is None:
+            version = self.versions - 1
+        is_last = version == self.versions - 1
+        status = self.stock_entry_status(index, version)
+
+        date_received = BASE_DATE + timedelta(hours=index)
+        date_created = date_received + timedelta(days=version)
+        if update_date is None:
+            update_date = date_created
+        date_produced = date_received - timedelta(days=index % 300)
+        date_expiry = date_produced + timedelta(days=30 + index % 335)
+
+        previous = f'<bs:previous>{self.stock_entry_uuid(index, version - 1)}</bs:previous>' if version else ''
+        following = '' if is_last else f'<bs:next>{self.stock_entry_uuid(index, version + 1)}</bs:next>'
+
+        product_item_guid = self.product_item_guid(index)
+        product_item = f'<vd:productItem><bs:guid>{product_item_guid}</bs:guid><dt:name>{escape(f"Наименование {index % self.product_items} & Ко")}</dt:name></vd:productItem>'
+        if index % 20 == 19:
+            product_item = f'<vd:productItem><dt:name>Продукция без справочника {index}</dt:name></vd:productItem>'
+        item_index = index % self.product_items
+
+        unit_guid, unit_name = UNITS[index % len(UNITS)]
+        volume = f'{(index % 50) + 1}.{version}' if status != 201 else '0'
+
+        production = complex_date_xml('firstDate', date_produced, with_day=index % 7 != 0)
+        if index % 11 == 0:
+            production += complex_date_xml('secondDate', date_produced + timedelta(days=1))
+        expiry = complex_date_xml('firstDate', date_expiry, with_day=index % 7 != 0)
+
+        packages = []
+        for level in range(1 + index % 2):
+            packing_guid, global_id, packing_name = PACKING_TYPES[(index + level) % len(PACKING_TYPES)]
+            marks = f'<dt:productMarks class="BN">{index:08d}-{level}</dt:productMarks>' if level == 0 else ''
+            packages.append(
+                f'<dt:package><dt:level>{level + 4}</dt:level>'
+                f'<dt:packingType><bs:uuid>{packing_guid}</bs:uuid><bs:guid>{packing_guid}</bs:guid><dt:globalID>{global_id}</dt:globalID><dt:name>{packing_name}</dt:name></dt:packingType>'
+                f'<dt:quantity>{(index % 10) + 1}</dt:quantity>{marks}</dt:package>'
+            )
+
+        vet_documents = ''
+        if self.stock_entry_status(index, 0) == 102:
+            vet_documents = f'<vd:vetDocument><bs:uuid>{self.make_guid("vet-document", index)}</bs:uuid></vd:vetDocument>'
+
+        return (
+            f'<vd:stockEntry><bs:uuid>{self.stock_entry_uuid(index, version)}</bs:uuid><bs:guid>{self.stock_entry_guid(index)}</bs:guid>'
+            f'<bs:active>{"true" if is_last else "false"}</bs:active><bs:last>{"true" if is_last else "false"}</bs:last>'
+            f'<bs:status>{status}</bs:status>'
+            f'<bs:createDate>{format_datetime(date_created)}</bs:createDate><bs:updateDate>{format_datetime(update_date)}</bs:updateDate>'
+            f'{previous}{following}<vd:entryNumber>{index + 1}</vd:entryNumber>'
+            f'<vd:batch><vd:productType>{item_index % 8 + 1}</vd:productType>'
+            f'<vd:product><bs:guid>{self.product_guid(item_index)}</bs:guid></vd:product>'
+            f'<vd:subProduct><bs:guid>{self.subproduct_guid(item_index)}</bs:guid></vd:subProduct>'
+            f'{product_item}<vd:volume>{volume}</vd:volume>'
+            f'<vd:unit><bs:uuid>{unit_guid}</bs:uuid><bs:guid>{unit_guid}</bs:guid><dt:name>{unit_name}</dt:name></vd:unit>'
+            f'<vd:dateOfProduction>{production}</vd:dateOfProduction><vd:expiryDate>{expiry}</vd:expiryDate>'
+            f'<vd:perishable>{"true" if index % 2 else "false"}</vd:perishable>'
+            f'<vd:origin><vd:country><bs:guid>74a3cbb1-56fa-94f3-ab3f-e8db4940d96b</bs:guid><dt:name>Российская Федерация</dt:name></vd:country>'
+            f'<vd:producer><dt:enterprise><bs:guid>{enterprise_guid}</bs:guid><dt:name>Производитель</dt:name></dt:enterprise></vd:producer></vd:origin>'
+            f'<vd:packageList>{"".join(packages)}</vd:packageList></vd:batch>{vet_documents}'
+            f'</vd:stockEntry>'
+        )
+
+    def stock_entry_list(self, enterprise_guid: str, count: int, offset: int) -> tuple[int, str]:
+        items = ''.join(
+            self.stock_entry_xml(enterprise_guid, index)
+            for index in range(offset, min(offset + count, self.stock_entries))
+        )
+        return self.stock_entries, items
+
+    def stock_entry_changes_list(self, enterprise_guid: str, end_date: datetime, count: int, offset: int) -> tuple[int, str]:
+        total = min(self.changed_entries, self.stock_entries)
+        items = ''.join(
+            self.stock_entry_xml(enterprise_guid, index, update_date=end_date)
+            for index in range(offset, min(offset + count, total))
+        )
+        return total, items
+
+    def stock_entry_version_list(self, enterprise_guid: str, stock_entry_guid: str, count: int, offset: int) -> tuple[int, str]:
+        index = self._index('stock-entry', stock_entry_guid, self.stock_entries)
+        items = ''.join(
+            self.stock_entry_xml(enterprise_guid, index, version)
+            for version in range(offset, min(offset + count, self.versions))
+        )
+        return self.versions, items
+
+    def vet_document_xml(self, uuid: str) -> str:
+        consignor_guid = self.make_guid('consignor', uuid)
+        return (
+            f'<vd:vetDocument><bs:uuid>{uuid}</bs:uuid><vd:vetDType>TRANSPORT</vd:vetDType>'
+            f'<vd:certifiedConsignment><vd:consignor>'
+            f'<dt:businessEntity><bs:guid>{consignor_guid}</bs:guid></dt:businessEntity>'
+            f'<dt:enterprise><bs:guid>{self.make_guid("consignor-enterprise", uuid)}</bs:guid></dt:enterprise>'
+            f'</vd:consignor></vd:certifiedConsignment></vd:vetDocument>'
+        )
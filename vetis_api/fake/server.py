@@ -0,0 +1,263 @@
+import random
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep, time
+from uuid import uuid4
+
+from ..xml.settings import NAMESPACES
+from .data import FakeData
+
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soapenv:Envelope ' + ' '.join(f'xmlns:{prefix}="{uri}"' for prefix, uri in NAMESPACES.items()) + '>'
+    '<soapenv:Header/><soapenv:Body>{}</soapenv:Body></soapenv:Envelope>'
+)
+
+APPLICATION_TTL = 3600  # seconds an application result can be received
+
+
+def local_name(tag: str) -> str:
+    return tag.split('}')[-1]
+
+
+def get_list_options(request_xml: ET.Element) -> tuple[int, int]:
+    count = int(request_xml.findtext('bs:listOptions/bs:count', '1000', NAMESPACES))
+    offset = int(request_xml.findtext('bs:listOptions/bs:offset', '0', NAMESPACES))
+    return count, offset
+
+
+def list_xml(tag: str, total: int, count: int, offset: int, items: str) -> str:
+    returned = max(min(count, total - offset), 0)
+    return f'<{tag} count="{returned}" offset="{offset}" total="{total}">{items}</{tag}>'
+
+
+def fault_xml(fault_code: str, fault_string: str, fault_type: str, error_code: str) -> str:
+    return (
+        f'<soapenv:Fault><faultcode>{fault_code}</faultcode><faultstring>{fault_string}</faultstring>'
+        f'<detail><apldef:{fault_type}><bs:error code="{error_code}">{fault_string}</bs:error></apldef:{fault_type}></detail>'
+        f'</soapenv:Fault>'
+    )
+
+
+def application_result_xml(application_id: str, content: str) -> str:
+    return (
+        f'<apldef:receiveApplicationResultResponse><apl:application>'
+        f'<apl:applicationId>{application_id}</apl:applicationId>{content}'
+        f'</apl:application></apldef:receiveApplicationResultResponse>'
+    )
+
+
+@dataclass
+class FakeServerConfig:
+    latency: float = 0.0  # seconds added to every response
+    latency_jitter: float = 0.0  # random extra latency, up to this many seconds
+    processing_delay: float = 1.0  # seconds until a submitted application is completed
+    error_rate: float = 0.0  # share of requests answered with HTTP 503
+    fault_rate: float = 0.0  # share of requests answered with internalServiceErrorFault
+    reject_rate: float = 0.0  # share of applications completed as REJECTED
+    seed: int = None  # seed of injected failures and jitter
+    verbose: bool = False
+
+
+class FakeVetisServer(ThreadingHTTPServer):
+    """
+    Local stand-in for Vetis SOAP services used by vetis_api: ProductService,
+    EnterpriseService and ApplicationManagementService with the two-step
+    submitApplication/receiveApplicationResult flow. Requests are dispatched by
+    the body element, so endpoint paths do not matter.
+
+        server = FakeVetisServer(('127.0.0.1', 0), FakeData(stock_entries=10000), FakeServerConfig(latency=0.05))
+        server.start()
+        settings.VETIS_ENDPOINT_BASE_URL = server.base_url
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], data: FakeData = None, config: FakeServerConfig = None):
+        super().__init__(address, FakeVetisRequestHandler)
+        self.data = data or FakeData()
+        self.config = config or FakeServerConfig()
+        self.random = random.Random(self.config.seed)
+        self.applications = {}
+        self.lock = Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> Thread:
+        """Serves in a background thread, for benchmarks and tests"""
+        thread = Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _chance(self, rate: float) -> bool:
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def get_latency(self) -> float:
+        jitter = 0.0
+        if self.config.latency_jitter:
+            with self.lock:
+                jitter = self.random.uniform(0, self.config.latency_jitter)
+        return self.config.latency + jitter
+
+    def handle_soap(self, body: bytes) -> tuple[int, str]:
+        """Returns (HTTP status, response body)"""
+
+        if self._chance(self.config.error_rate):
+            return 503, 'Service Unavailable'
+
+        if self._chance(self.config.fault_rate):
+            return 500, ENVELOPE.format(fault_xml('soapenv:Server', 'Internal error', 'internalServiceErrorFault', 'APLM0012'))
+
+        try:
+            request_xml = ET.fromstring(body).find('soapenv:Body', NAMESPACES)[0]
+        except (ET.ParseError, TypeError, IndexError):
+            return 500, ENVELOPE.format(fault_xml('soapenv:Client', 'Malformed request', 'incorrectRequestFault', 'APLM0001'))
+
+        handler = getattr(self, f'on_{local_name(request_xml.tag)}', None)
+        if handler is None:
+            return 500, ENVELOPE.format(fault_xml('soapenv:Client', f'Unsupported request {local_name(request_xml.tag)}', 'incorrectRequestFault', 'APLM0001'))
+
+        return 200, ENVELOPE.format(handler(request_xml))
+
+    # ProductService
+
+    def on_getProductByGuidRequest(self, request_xml: ET.Element) -> str:
+        guid = request_xml.findtext('bs:guid', namespaces=NAMESPACES)
+        return f'<ws:getProductByGuidResponse>{self.data.product_xml(guid)}</ws:getProductByGuidResponse>'
+
+    def on_getSubProductByGuidRequest(self, request_xml: ET.Element) -> str:
+        guid = request_xml.findtext('bs:guid', namespaces=NAMESPACES)
+        return f'<ws:getSubProductByGuidResponse>{self.data.subproduct_xml(guid)}</ws:getSubProductByGuidResponse>'
+
+    def on_getProductItemByGuidRequest(self, request_xml: ET.Element) -> str:
+        guid = request_xml.findtext('bs:guid', namespaces=NAMESPACES)
+        return f'<ws:getProductItemByGuidResponse>{self.data.product_item_xml(guid)}</ws:getProductItemByGuidResponse>'
+
+    def on_getProductItemListRequest(self, request_xml: ET.Element) -> str:
+        count, offset = get_list_options(request_xml)
+        business_entity_guid = request_xml.findtext('dt:businessEntity/bs:guid', namespaces=NAMESPACES)
+        total, items = self.data.product_item_list(business_entity_guid, count, offset)
+        return f'<ws:getProductItemListResponse>{list_xml("dt:productItemList", total, count, offset, items)}</ws:getProductItemListResponse>'
+
+    # EnterpriseService
+
+    def on_getBusinessEntityByGuidRequest(self, request_xml: ET.Element) -> str:
+        guid = request_xml.findtext('bs:guid', namespaces=NAMESPACES)
+        return f'<ws:getBusinessEntityByGuidResponse>{self.data.business_entity_xml(guid)}</ws:getBusinessEntityByGuidResponse>'
+
+    def on_getEnterpriseByGuidRequest(self, request_xml: ET.Element) -> str:
+        guid = request_xml.findtext('bs:guid', namespaces=NAMESPACES)
+        return f'<ws:getEnterpriseByGuidResponse>{self.data.enterprise_xml(guid)}</ws:getEnterpriseByGuidResponse>'
+
+    def on_getActivityLocationListRequest(self, request_xml: ET.Element) -> str:
+        count, offset = get_list_options(request_xml)
+        business_entity_guid = request_xml.findtext('dt:businessEntity/bs:guid', namespaces=NAMESPACES)
+        total, items = self.data.activity_location_list(business_entity_guid, count, offset)
+        return f'<ws:getActivityLocationListResponse>{list_xml("dt:activityLocationList", total, count, offset, items)}</ws:getActivityLocationListResponse>'
+
+    # ApplicationManagementService
+
+    def on_submitApplicationRequest(self, request_xml: ET.Element) -> str:
+        data_xml = request_xml.find('apl:application/apl:data', NAMESPACES)[0]
+        application_id = str(uuid4())
+
+        with self.lock:
+            expired_before = time() - APPLICATION_TTL
+            for expired_id in [key for key, value in self.applications.items() if value['submitted_at'] < expired_before]:
+                del self.applications[expired_id]
+            self.applications[application_id] = {
+                'submitted_at': time(),
+                'data_xml': data_xml,
+                'rejected': self.config.reject_rate and self.random.random() < self.config.reject_rate,
+            }
+
+        return (
+            f'<apldef:submitApplicationResponse><apl:application>'
+            f'<apl:applicationId>{application_id}</apl:applicationId><apl:status>ACCEPTED</apl:status>'
+            f'</apl:application></apldef:submitApplicationResponse>'
+        )
+
+    def on_receiveApplicationResultRequest(self, request_xml: ET.Element) -> str:
+        application_id = request_xml.findtext('apldef:applicationId', namespaces=NAMESPACES)
+
+        with self.lock:
+            application = self.applications.get(application_id)
+
+        if application is None:
+            content = '<apl:status>REJECTED</apl:status><apl:errors><bs:error code="APLM0007">Заявка не найдена</bs:error></apl:errors>'
+        elif time() - application['submitted_at'] < self.config.processing_delay:
+            content = '<apl:status>IN_PROCESS</apl:status>'
+        elif application['rejected']:
+            content = '<apl:status>REJECTED</apl:status><apl:errors><bs:error code="MERC13001">Заявка отклонена</bs:error></apl:errors>'
+        else:
+            result = getattr(self, f'result_{local_name(application["data_xml"].tag)}')(application['data_xml'])
+            content = f'<apl:status>COMPLETED</apl:status><apl:result>{result}</apl:result>'
+
+        return application_result_xml(application_id, content)
+
+    def result_getStockEntryListRequest(self, data_xml: ET.Element) -> str:
+        count, offset = get_list_options(data_xml)
+        enterprise_guid = data_xml.findtext('dt:enterpriseGuid', namespaces=NAMESPACES)
+        total, items = self.data.stock_entry_list(enterprise_guid, count, offset)
+        return f'<merc:getStockEntryListResponse>{list_xml("vd:stockEntryList", total, count, offset, items)}</merc:getStockEntryListResponse>'
+
+    def result_getStockEntryChangesListRequest(self, data_xml: ET.Element) -> str:
+        count, offset = get_list_options(data_xml)
+        enterprise_guid = data_xml.findtext('dt:enterpriseGuid', namespaces=NAMESPACES)
+        end_date = datetime.fromisoformat(data_xml.findtext('bs:updateDateInterval/bs:endDate', namespaces=NAMESPACES))
+        total, items = self.data.stock_entry_changes_list(enterprise_guid, end_date, count, offset)
+        return f'<merc:getStockEntryChangesListResponse>{list_xml("vd:stockEntryList", total, count, offset, items)}</merc:getStockEntryChangesListResponse>'
+
+    def result_getStockEntryVersionListRequest(self, data_xml: ET.Element) -> str:
+        count, offset = get_list_options(data_xml)
+        enterprise_guid = data_xml.findtext('dt:enterpriseGuid', namespaces=NAMESPACES)
+        stock_entry_guid = data_xml.findtext('bs:guid', namespaces=NAMESPACES)
+        total, items = self.data.stock_entry_version_list(enterprise_guid, stock_entry_guid, count, offset)
+        return f'<merc:getStockEntryVersionListResponse>{list_xml("vd:stockEntryList", total, count, offset, items)}</merc:getStockEntryVersionListResponse>'
+
+    def result_getVetDocumentByUuidRequest(self, data_xml: ET.Element) -> str:
+        uuid = data_xml.findtext('bs:uuid', namespaces=NAMESPACES)
+        return f'<merc:getVetDocumentByUuidResponse>{self.data.vet_document_xml(uuid)}</merc:getVetDocumentByUuidResponse>'
+
+
+class FakeVetisRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as with real Vetis
+
+    def _respond(self, status: int, body: bytes, content_type: str = 'text/xml;charset=UTF-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._respond(200, b'')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status, content = self.server.handle_soap(body)
+
+        latency = self.server.get_latency()
+        if latency:
+            sleep(latency)
+
+        self._respond(status, content.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        if self.server.config.verbose:
+            super().log_message(format, *args)
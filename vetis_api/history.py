@@ -0,0 +1,164 @@
+import atexit
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.timezone import now as timezone_now
+
+from .models import ApiRequestsHistoryRecord
+
+
+# API request history is written by a background thread of each process.
+#
+# Calls only put an entry into a bounded queue. The thread saves entries with
+# bulk_create in its own connection and transaction, when VETIS_HISTORY_BATCH_SIZE
+# entries are collected or VETIS_HISTORY_FLUSH_INTERVAL seconds have passed, so a
+# sync neither waits for history inserts nor rolls them back on error. If the queue
+# is full or the database keeps failing, entries are dropped and counted.
+#
+# Not used with SQLite: it has one writer at a time, and a sync transaction that
+# has read before writing fails with "database is locked" instead of waiting for
+# the writer thread's transaction.
+
+
+WRITE_ATTEMPTS = 3
+
+
+class HistoryEntry:
+    def __init__(self, soap_action: str, comment: str, response_status_code: int, soap_request: str | bytes, response_body: str | bytes):
+        self.datetime = timezone_now()
+        self.soap_action = soap_action
+        self.comment = comment
+        self.response_status_code = response_status_code
+        self.soap_request = soap_request
+        self.response_body = response_body
+
+    def to_record(self) -> ApiRequestsHistoryRecord:
+        record = ApiRequestsHistoryRecord(
+            datetime=self.datetime,
+            soap_action=self.soap_action,
+            comment=self.comment,
+            response_status_code=self.response_status_code,
+        )
+        # compressed here, not in the calling thread
+        record.set_payloads(self.soap_request, self.response_body)
+        return record
+
+
+class HistoryWriter:
+
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.written = 0
+        self.dropped = 0
+        self._lock = Lock()
+
+    def _get_batch_size(self) -> int:
+        return getattr(settings, 'VETIS_HISTORY_BATCH_SIZE', 100)
+
+    def _get_flush_interval(self) -> float:
+        return getattr(settings, 'VETIS_HISTORY_FLUSH_INTERVAL', 1.0)
+
+    def _start(self):
+        with self._lock:
+            # started in the process that writes: a thread does not survive fork of a worker process
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.queue = Queue(maxsize=getattr(settings, 'VETIS_HISTORY_QUEUE_SIZE', 1000))
+            self.thread = Thread(target=self._run, name='vetis-history-writer', daemon=True)
+            self.thread.start()
+
+    def put(self, entry: HistoryEntry):
+        """Queues entry without waiting, drops it if the queue is full"""
+
+        self._start()
+        try:
+            self.queue.put_nowait(entry)
+        except Full:
+            dropped = self._drop(1)
+            if dropped % 100 == 1:
+                print(f'History writer: queue is full, {dropped} entries dropped')
+
+    def _drop(self, count: int) -> int:
+        # entries are dropped both by calling threads and by the writer thread
+        with self._lock:
+            self.dropped += count
+            return self.dropped
+
+    def _take_batch(self) -> list[HistoryEntry]:
+        """Waits for the first entry, then collects entries until the batch is full or the interval has passed"""
+
+        batch = [self.queue.get()]
+        deadline = monotonic() + self._get_flush_interval()
+        batch_size = self._get_batch_size()
+
+        while len(batch) < batch_size:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, batch: list[HistoryEntry]):
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                close_old_connections()
+                with transaction.atomic():
+                    ApiRequestsHistoryRecord.objects.bulk_create([entry.to_record() for entry in batch])
+                self.written += len(batch)
+                return
+            except Exception as e:
+                print(f'History writer: failed to write {len(batch)} entries (try #{attempt+1}): {e}')
+                if attempt < WRITE_ATTEMPTS - 1:
+                    sleep(self._get_flush_interval())
+
+        self._drop(len(batch))
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Waits until queued entries are written, e.g. before the process exits. Returns False on timeout."""
+
+        if self.queue is None:
+            return True
+
+        deadline = monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not self.thread.is_alive():
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+
+history_writer = HistoryWriter()
+
+atexit.register(history_writer.flush)
+
+
+def is_buffered() -> bool:
+    return getattr(settings, 'VETIS_HISTORY_BUFFERED', True) and connection.vendor != 'sqlite'
+
+
+def record_history(soap_action: str, comment: str, response_status_code: int, soap_request: str | bytes, response_body: str | bytes):
+    """Records API request in history: in background if VETIS_HISTORY_BUFFERED (except SQLite), at once otherwise"""
+
+    entry = HistoryEntry(soap_action, comment, response_status_code, soap_request, response_body)
+
+    if is_buffered():
+        history_writer.put(entry)
+    else:
+        entry.to_record().save()
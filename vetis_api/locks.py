@@ -0,0 +1,93 @@
+from time import sleep, time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.core.exceptions import ImproperlyConfigured
+
+
+# Cross-process locks in the cache set with VETIS_LOCK_CACHE (rate limits, single-flight loads).
+#
+# A lock is cache.add of a key holding the owner's token: add must be atomic, so the backend
+# must be Redis, memcached, or LocMemCache when a single worker process runs. FileBasedCache
+# (has_key + set) and DatabaseCache (its add is a savepoint of the caller's transaction,
+# invisible to other processes until commit) let several processes take the same lock.
+
+
+NON_ATOMIC_BACKENDS = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.db.DatabaseCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# shared by worker processes on several hosts, LocMemCache only by threads of one process
+SHARED_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+)
+
+LOCK_WAIT = 0.01
+
+
+class LockTimeout(RuntimeError):
+    """Lock was not released by another process in time"""
+
+
+def get_lock_cache() -> BaseCache:
+    alias = getattr(settings, 'VETIS_LOCK_CACHE', 'default')
+    backend = settings.CACHES[alias]['BACKEND']
+    if backend in NON_ATOMIC_BACKENDS:
+        raise ImproperlyConfigured(f'VETIS_LOCK_CACHE: кэш {alias} ({backend}) не поддерживает атомарный add, нужен Redis или memcached')
+    return caches[alias]
+
+
+def is_lock_cache_shared() -> bool:
+    alias = getattr(settings, 'VETIS_LOCK_CACHE', 'default')
+    return settings.CACHES[alias]['BACKEND'] in SHARED_BACKENDS
+
+
+class CacheLock:
+    """
+    Lock held by one owner at a time, expires after `timeout` seconds if the owner dies.
+    Released only by its owner: a lock that expired and was taken by another process is left alone.
+    """
+
+    def __init__(self, key: str, timeout: float):
+        self.key = key
+        self.timeout = timeout
+        self.token = None
+        self.cache = get_lock_cache()
+
+    def claim(self) -> bool:
+        """Takes lock without waiting"""
+
+        token = uuid4().hex
+        if not self.cache.add(self.key, token, timeout=self.timeout):
+            return False
+        self.token = token
+        return True
+
+    def acquire(self, wait: float, poll: float = LOCK_WAIT):
+        """Waits for lock up to `wait` seconds, raises LockTimeout if it is still held by another owner"""
+
+        deadline = time() + wait
+        while not self.claim():
+            if time() > deadline:
+                raise LockTimeout(f'Блокировка {self.key} не освобождена за {wait} с')
+            sleep(poll)
+
+    def release(self):
+        if self.token is None:
+            return
+        # the lock cannot expire between get and delete unless it was held for nearly its whole timeout
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+        self.token = None
+
+    def __enter__(self):
+        self.acquire(self.timeout)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,82 @@
+import contextlib
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vetis_api.bench import compare_results, load_results, save_results
+from vetis_api.bench import dates, envelopes, parsing, persistence, views
+
+
+SUITES = {
+    'envelopes': envelopes.run,
+    'dates': dates.run,
+    'parsing': parsing.run,
+    'persistence': persistence.run,
+    'views': views.run,
+}
+
+
+def format_time(seconds: float | None) -> str:
+    if seconds is None:
+        return '-'
+    if seconds >= 0.1:
+        return f'{seconds:.3f} s'
+    if seconds >= 1e-4:
+        return f'{seconds * 1e3:.3f} ms'
+    return f'{seconds * 1e6:.2f} us'
+
+
+class Command(BaseCommand):
+    help = 'Runs benchmarks of Vetis API code paths. Database suites run in transactions that are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', help=f'suites to run: {", ".join(SUITES)}. All by default')
+        parser.add_argument('--sizes', default='1000,10000', help='stock journal sizes, comma separated')
+        parser.add_argument('--output', help='save results to JSON file')
+        parser.add_argument('--baseline', help='compare results with JSON file saved earlier')
+
+    def handle(self, *args, **options):
+        suites = options['suites'] or list(SUITES)
+        for suite in suites:
+            if suite not in SUITES:
+                raise CommandError(f'Unknown suite: {suite}')
+
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+
+        results = {}
+        for suite in suites:
+            self.stdout.write(self.style.MIGRATE_HEADING(suite))
+            # sync code reports its progress with print
+            with contextlib.redirect_stdout(io.StringIO()):
+                suite_results = SUITES[suite](sizes)
+            for name, result in suite_results.items():
+                self.stdout.write(f'  {name:<60} {format_time(result["per_call"]):>12}  ({result["number"]} calls)')
+                results[f'{suite}.{name}'] = result
+
+        if options['output']:
+            save_results(options['output'], results)
+            self.stdout.write(f'Results saved to {options["output"]}')
+
+        if options['baseline']:
+            baseline = load_results(options['baseline'])
+            write_comparison(self, compare_results(baseline['results'], results))
+
+
+def write_comparison(command: BaseCommand, rows: list, threshold: float = 0.1) -> int:
+    """Writes comparison table, returns number of regressions slower than threshold"""
+
+    regressions = 0
+    for name, before, after, ratio in rows:
+        line = f'  {name:<70} {format_time(before):>12} {format_time(after):>12}'
+        if ratio is None:
+            command.stdout.write(line)
+            continue
+        line += f'  x{ratio:.2f}'
+        if ratio > 1 + threshold:
+            regressions += 1
+            command.stdout.write(command.style.ERROR(line))
+        elif ratio < 1 - threshold:
+            command.stdout.write(command.style.SUCCESS(line))
+        else:
+            command.stdout.write(line)
+    return regressions
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vetis_api.bench import compare_results, load_results
+from .vetis_bench import write_comparison
+
+
+class Command(BaseCommand):
+    help = 'Compares two benchmark result files saved by vetis_bench --output'
+
+    def add_arguments(self, parser):
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as regression or improvement')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        baseline = load_results(options['baseline'])
+        current = load_results(options['current'])
+
+        for label, data in (('baseline', baseline), ('current', current)):
+            meta = data['meta']
+            self.stdout.write(f'{label}: {meta["created"]} revision {meta["revision"]}, {meta["database"]}, Python {meta["python"]}')
+
+        regressions = write_comparison(self, compare_results(baseline['results'], current['results']), options['threshold'])
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Regressions: {regressions}')
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+
+from vetis_api.fake.data import FakeData
+from vetis_api.fake.server import FakeServerConfig, FakeVetisServer
+
+
+class Command(BaseCommand):
+    help = 'Runs local fake Vetis SOAP server with synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8800)
+
+        parser.add_argument('--stock-entries', type=int, default=1000, help='stock journal size per enterprise')
+        parser.add_argument('--versions', type=int, default=2, help='versions of every stock entry')
+        parser.add_argument('--changed-entries', type=int, default=100, help='entries returned as changes')
+        parser.add_argument('--product-items', type=int, default=100)
+        parser.add_argument('--enterprises', type=int, default=3, help='enterprises per business entity')
+        parser.add_argument('--data-seed', type=int, default=0, help='different seeds give different GUIDs')
+
+        parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+        parser.add_argument('--latency-jitter', type=float, default=0.0, help='random extra latency, seconds')
+        parser.add_argument('--processing-delay', type=float, default=1.0, help='seconds until application is completed')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='share of HTTP 503 responses')
+        parser.add_argument('--fault-rate', type=float, default=0.0, help='share of internalServiceErrorFault responses')
+        parser.add_argument('--reject-rate', type=float, default=0.0, help='share of rejected applications')
+        parser.add_argument('--seed', type=int, default=None, help='seed of injected failures')
+
+    def handle(self, *args, **options):
+        data = FakeData(
+            stock_entries=options['stock_entries'],
+            versions=options['versions'],
+            changed_entries=options['changed_entries'],
+            product_items=options['product_items'],
+            enterprises=options['enterprises'],
+            seed=options['data_seed'],
+        )
+        config = FakeServerConfig(
+            latency=options['latency'],
+            latency_jitter=options['latency_jitter'],
+            processing_delay=options['processing_delay'],
+            error_rate=options['error_rate'],
+            fault_rate=options['fault_rate'],
+            reject_rate=options['reject_rate'],
+            seed=options['seed'],
+            verbose=options['verbosity'] > 1,
+        )
+
+        server = FakeVetisServer((options['host'], options['port']), data, config)
+
+        self.stdout.write(f'Fake Vetis server is listening on {server.base_url}')
+        self.stdout.write(f"Set VETIS_ENDPOINT_BASE_URL = '{server.base_url}' to use it")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-17 23:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0032_businessentityinfo_enterpriseinfo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockentry',
+            name='enterprise',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='vetis_api.enterprise', verbose_name='предприятие'),
+        ),
+        migrations.AlterField(
+            model_name='stockentry',
+            name='guid',
+            field=models.UUIDField(),
+        ),
+        migrations.AlterField(
+            model_name='stockentry',
+            name='main',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='vetis_api.stockentrymain', verbose_name='головная запись'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_last', True)), fields=['enterprise', 'date_expiry', '-entry_number'], name='stockentry_current_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_last', True), ('volume__gt', 0)), fields=['date_expiry'], name='stockentry_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['guid', 'date_created'], name='stockentry_guid_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['main', 'date_created'], name='stockentry_main_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['enterprise', '-date_updated'], name='stockentry_ent_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.db.models.functions import Cast, Upper
+
+
+# PostgreSQL only, see vetis_api.search. The indexes are not declared in models:
+# other backends (SQLite in development) cannot create them.
+
+CURRENT = models.Q(is_last=True, is_active=True)
+
+
+def trigram(field_name: str) -> OpClass:
+    # the expression icontains compares: UPPER("field"::text) LIKE UPPER('%word%')
+    return OpClass(Upper(Cast(field_name, models.TextField())), name='gin_trgm_ops')
+
+
+SEARCH_INDEXES = [
+    ('StockEntry', GinIndex(trigram('product_item_name'), condition=CURRENT, name='stockentry_name_trgm_idx')),
+    ('StockEntry', GinIndex(SearchVector('product_item_name', config='russian'), condition=CURRENT, name='stockentry_name_fts_idx')),
+    ('ProductItem', GinIndex(trigram('name'), name='productitem_name_trgm_idx')),
+    ('ProductItem', GinIndex(trigram('gtin'), name='productitem_gtin_trgm_idx')),
+    ('ProductItem', GinIndex(SearchVector('name', config='russian'), name='productitem_name_fts_idx')),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for model_name, index in SEARCH_INDEXES:
+        schema_editor.add_index(apps.get_model('vetis_api', model_name), index)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, index in SEARCH_INDEXES:
+        schema_editor.remove_index(apps.get_model('vetis_api', model_name), index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0033_stockentry_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
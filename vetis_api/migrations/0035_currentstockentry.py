@@ -0,0 +1,165 @@
+# Generated by Django 5.2.6 on 2026-10-17 23:31
+
+import django.db.models.deletion
+import vetis_api.models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.db.models.functions import Cast, Upper
+
+
+COLUMNS = [
+    ('guid', 'se.guid'), ('stock_entry_id', 'se.id'), ('main_id', 'se.main_id'), ('enterprise_id', 'se.enterprise_id'),
+    ('entry_number', 'se.entry_number'), ('product_type', 'se.product_type'), ('product_id', 'se.product_id'),
+    ('product_item_name', 'se.product_item_name'), ('volume', 'se.volume'), ('unit_id', 'se.unit_id'),
+    ('date_produced_1', 'se.date_produced_1'), ('date_produced_2', 'se.date_produced_2'), ('date_produced', 'se.date_produced'),
+    ('date_expiry_1', 'se.date_expiry_1'), ('date_expiry_2', 'se.date_expiry_2'), ('date_expiry', 'se.date_expiry'),
+    ('date_created', 'se.date_created'), ('date_updated', 'se.date_updated'), ('is_perishable', 'se.is_perishable'),
+    ('origin_country', 'se.origin_country'), ('producer_name', 'se.producer_name'),
+    ('is_populated', 'm.is_populated'), ('initial_status', 'm.initial_status'), ('initial_volume', 'm.initial_volume'),
+    ('source_be_name', 'm.source_be_name'), ('source_ent_name', 'm.source_ent_name'),
+    ('comment_important', 'm.comment_important'), ('comment_text', 'm.comment_text'),
+]
+
+
+def fill_current_stock(apps, schema_editor):
+    # last active version of each entry, the latest updated one if several are marked last
+    schema_editor.execute(f'''
+        INSERT INTO vetis_api_currentstockentry ({', '.join(column for column, _ in COLUMNS)})
+        SELECT {', '.join(expression for _, expression in COLUMNS)}
+        FROM vetis_api_stockentry se
+        JOIN vetis_api_stockentrymain m ON m.id = se.main_id
+        WHERE se.is_last AND se.is_active
+        AND NOT EXISTS (
+            SELECT 1 FROM vetis_api_stockentry later
+            WHERE later.guid = se.guid AND later.is_last AND later.is_active
+            AND (later.date_updated > se.date_updated OR (later.date_updated = se.date_updated AND later.id > se.id))
+        )
+    ''')
+
+
+# search indexes (see 0034) move to the current stock table, PostgreSQL only
+
+STOCK_ENTRY_SEARCH_INDEXES = [
+    GinIndex(
+        OpClass(Upper(Cast('product_item_name', models.TextField())), name='gin_trgm_ops'),
+        condition=models.Q(is_last=True, is_active=True),
+        name='stockentry_name_trgm_idx'
+    ),
+    GinIndex(
+        SearchVector('product_item_name', config='russian'),
+        condition=models.Q(is_last=True, is_active=True),
+        name='stockentry_name_fts_idx'
+    ),
+]
+
+CURRENT_STOCK_SEARCH_INDEXES = [
+    GinIndex(OpClass(Upper(Cast('product_item_name', models.TextField())), name='gin_trgm_ops'), name='currentstock_name_trgm_idx'),
+    GinIndex(SearchVector('product_item_name', config='russian'), name='currentstock_name_fts_idx'),
+]
+
+
+def move_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index in STOCK_ENTRY_SEARCH_INDEXES:
+        schema_editor.remove_index(apps.get_model('vetis_api', 'StockEntry'), index)
+    for index in CURRENT_STOCK_SEARCH_INDEXES:
+        schema_editor.add_index(apps.get_model('vetis_api', 'CurrentStockEntry'), index)
+
+
+def move_search_indexes_back(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index in CURRENT_STOCK_SEARCH_INDEXES:
+        schema_editor.remove_index(apps.get_model('vetis_api', 'CurrentStockEntry'), index)
+    for index in STOCK_ENTRY_SEARCH_INDEXES:
+        schema_editor.add_index(apps.get_model('vetis_api', 'StockEntry'), index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0034_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentStockEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guid', models.UUIDField(unique=True)),
+                ('entry_number', models.BigIntegerField(verbose_name='номер записи')),
+                ('product_type', models.IntegerField(choices=[(1, 'Мясо и мясопродукты'), (2, 'Корма и кормовые добавки'), (3, 'Живые животные'), (4, 'Лекарственные средства'), (5, 'Пищевые продукты'), (6, 'Непищевые продукты и другое'), (7, 'Рыба и морепродукты'), (8, 'Продукция, не требующая разрешения')], verbose_name='тип продукции')),
+                ('product_item_name', models.CharField(max_length=255, verbose_name='наименование продукции')),
+                ('volume', models.DecimalField(decimal_places=6, max_digits=15, verbose_name='объем')),
+                ('date_produced_1', models.CharField(max_length=16, verbose_name='дата производства 1')),
+                ('date_produced_2', models.CharField(blank=True, max_length=16, verbose_name='дата производства 2')),
+                ('date_produced', models.DateTimeField(verbose_name='дата производства')),
+                ('date_expiry_1', models.CharField(max_length=16, verbose_name='срок годности 1')),
+                ('date_expiry_2', models.CharField(blank=True, max_length=16, verbose_name='срок годности 2')),
+                ('date_expiry', models.DateTimeField(verbose_name='срок годности')),
+                ('date_created', models.DateTimeField(verbose_name='дата создания')),
+                ('date_updated', models.DateTimeField(verbose_name='дата обновления')),
+                ('is_perishable', models.BooleanField(verbose_name='скоропорт')),
+                ('origin_country', models.CharField(blank=True, max_length=255, null=True, verbose_name='страна происхождения')),
+                ('producer_name', models.CharField(blank=True, max_length=255, null=True, verbose_name='наименование производителя')),
+                ('is_populated', models.BooleanField(default=False, verbose_name='данные заполнены')),
+                ('initial_status', models.IntegerField(blank=True, choices=[(100, 'Запись создана'), (101, 'Гашение ВС (импорт)'), (102, 'Гашение ВСД'), (103, 'Производство'), (104, 'Справка о здоровье дойных животных'), (105, 'Аннулирование ВСД или транзакции'), (106, 'Гашение бумажного ВСД'), (110, 'Объединение'), (120, 'Разделение'), (200, 'Внесены изменения'), (201, 'Запись аннулирована'), (202, 'Списание'), (203, 'Редактирование производства'), (204, 'Заключение по результатам ВСЭ'), (230, 'Обновление в результате присоединения'), (231, 'Обновление в результате присоединения'), (240, 'Обновление в результате отделения'), (250, 'Восстановление после удаления'), (260, 'Пометка на удаление'), (300, 'Перемещение в другую группу'), (400, 'Запись удалена'), (410, 'Удаление в результате объединения'), (420, 'Удаление в результате разделения'), (430, 'Удаление в результате присоединения')], null=True, verbose_name='статус версии')),
+                ('initial_volume', models.DecimalField(blank=True, decimal_places=6, max_digits=15, null=True, verbose_name='объем')),
+                ('source_be_name', models.TextField(blank=True, max_length=255, verbose_name='хозяйствующий субъект - источник')),
+                ('source_ent_name', models.TextField(blank=True, max_length=255, verbose_name='предприятие - источник')),
+                ('comment_important', models.BooleanField(default=False, verbose_name='комментарий важен')),
+                ('comment_text', models.TextField(blank=True, max_length=255, verbose_name='текст комментария')),
+            ],
+            options={
+                'verbose_name': 'текущая запись складского журнала',
+                'verbose_name_plural': 'текущие записи складского журнала',
+                'ordering': ['date_expiry', '-entry_number'],
+            },
+            bases=(vetis_api.models.StockEntryDatesMixin, models.Model),
+        ),
+        migrations.RemoveIndex(
+            model_name='stockentry',
+            name='stockentry_current_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='stockentry',
+            name='stockentry_expiry_idx',
+        ),
+        migrations.AddField(
+            model_name='currentstockentry',
+            name='enterprise',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='vetis_api.enterprise', verbose_name='предприятие'),
+        ),
+        migrations.AddField(
+            model_name='currentstockentry',
+            name='main',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vetis_api.stockentrymain', verbose_name='головная запись'),
+        ),
+        migrations.AddField(
+            model_name='currentstockentry',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='vetis_api.product', verbose_name='продукция'),
+        ),
+        migrations.AddField(
+            model_name='currentstockentry',
+            name='stock_entry',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='current', to='vetis_api.stockentry', verbose_name='версия'),
+        ),
+        migrations.AddField(
+            model_name='currentstockentry',
+            name='unit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='vetis_api.unit', verbose_name='ЕИ'),
+        ),
+        migrations.AddIndex(
+            model_name='currentstockentry',
+            index=models.Index(fields=['enterprise', 'date_expiry', '-entry_number'], name='currentstock_ent_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='currentstockentry',
+            index=models.Index(condition=models.Q(('volume__gt', 0)), fields=['date_expiry'], name='currentstock_expiry_idx'),
+        ),
+        migrations.RunPython(fill_current_stock, migrations.RunPython.noop),
+        migrations.RunPython(move_search_indexes, move_search_indexes_back),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0035_currentstockentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(choices=[('reload_enterprises', 'предприятия хозяйствующего субъекта'), ('reload_product_items', 'наименования продукции хозяйствующего субъекта'), ('update_stock_entries', 'складской журнал предприятия'), ('update_stock_entry_history', 'история записи журнала')], max_length=30, verbose_name='задача')),
+                ('object_guid', models.UUIDField(verbose_name='GUID объекта')),
+                ('mode', models.CharField(blank=True, max_length=10, verbose_name='режим')),
+                ('begin_date', models.DateTimeField(blank=True, null=True, verbose_name='начало периода')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='конец периода')),
+                ('list_offset', models.IntegerField(default=0, verbose_name='смещение')),
+                ('total', models.IntegerField(blank=True, null=True, verbose_name='всего')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='дата обновления')),
+            ],
+            options={
+                'verbose_name': 'контрольная точка синхронизации',
+                'verbose_name_plural': 'контрольные точки синхронизации',
+                'constraints': [models.UniqueConstraint(fields=('task', 'object_guid'), name='synccheckpoint_task_object_unique')],
+            },
+        ),
+    ]
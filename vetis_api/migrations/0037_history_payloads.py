@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0036_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='payload_storage',
+            field=models.CharField(default='zlib', max_length=10, verbose_name='хранение текстов'),
+        ),
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='request_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='request_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256 запроса'),
+        ),
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='request_size',
+            field=models.IntegerField(blank=True, null=True, verbose_name='размер запроса'),
+        ),
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='response_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='response_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256 ответа'),
+        ),
+        migrations.AddField(
+            model_name='apirequestshistoryrecord',
+            name='response_size',
+            field=models.IntegerField(blank=True, null=True, verbose_name='размер ответа'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+import hashlib
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, transaction
+
+
+# Helpers of vetis_api.payloads as of this migration: texts are moved to zlib storage.
+# Rows are converted in batches by id, each batch committed on its own, so a large
+# history table is not locked for the whole migration. A failed migration resumes
+# from the start, rows converted before are converted again to the same values.
+
+BATCH_SIZE = 500
+ZLIB_LEVEL = 6
+PAYLOAD_FIELDS = ['payload_storage', 'request_size', 'request_hash', 'request_data', 'response_size', 'response_hash', 'response_data']
+
+
+def save_text(text: str | None) -> tuple[int | None, str, bytes | None]:
+    if text is None:
+        return None, '', None
+
+    data = text.encode('utf-8')
+    return len(data), hashlib.sha256(data).hexdigest(), zlib.compress(data, ZLIB_LEVEL)
+
+
+def load_text(storage: str, size: int | None, digest: str, stored: bytes | None) -> str | None:
+    if not storage or size is None:
+        return None
+
+    if storage == 'zlib':
+        data = zlib.decompress(stored)
+    elif storage == 'zstd':
+        import zstandard
+        data = zstandard.ZstdDecompressor().decompress(stored)
+    elif storage == 'file':
+        payload_dir = Path(getattr(settings, 'VETIS_HISTORY_PAYLOAD_DIR', settings.BASE_DIR / 'history'))
+        data = zlib.decompress((payload_dir / digest[:2] / f'{digest}.zz').read_bytes())
+    else:
+        raise RuntimeError(f'Неизвестный способ хранения истории запросов: {storage}')
+
+    return data.decode('utf-8')
+
+
+def iter_batches(queryset):
+    """Yields batches of queryset rows in id order, each in a transaction of its own"""
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            records = list(queryset.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+            if not records:
+                return
+            yield records
+        last_id = records[-1].id
+
+
+def compress_payloads(apps, schema_editor):
+    ApiRequestsHistoryRecord = apps.get_model('vetis_api', 'ApiRequestsHistoryRecord')
+
+    for records in iter_batches(ApiRequestsHistoryRecord.objects.only('soap_request', 'response_body')):
+        for record in records:
+            record.payload_storage = 'zlib'
+            record.request_size, record.request_hash, record.request_data = save_text(record.soap_request)
+            record.response_size, record.response_hash, record.response_data = save_text(record.response_body)
+        ApiRequestsHistoryRecord.objects.bulk_update(records, PAYLOAD_FIELDS)
+
+
+def decompress_payloads(apps, schema_editor):
+    ApiRequestsHistoryRecord = apps.get_model('vetis_api', 'ApiRequestsHistoryRecord')
+
+    for records in iter_batches(ApiRequestsHistoryRecord.objects.only(*PAYLOAD_FIELDS)):
+        for record in records:
+            record.soap_request = load_text(record.payload_storage, record.request_size, record.request_hash, record.request_data)
+            record.response_body = load_text(record.payload_storage, record.response_size, record.response_hash, record.response_data)
+        ApiRequestsHistoryRecord.objects.bulk_update(records, ['soap_request', 'response_body'])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('vetis_api', '0037_history_payloads'),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_payloads, decompress_payloads),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0038_history_payloads_compress'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='apirequestshistoryrecord',
+            name='response_body',
+        ),
+        migrations.RemoveField(
+            model_name='apirequestshistoryrecord',
+            name='soap_request',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0039_history_payloads_remove_texts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apirequestshistoryrecord',
+            name='datetime',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='метка времени'),
+        ),
+    ]
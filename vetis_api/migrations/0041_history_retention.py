@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0040_history_datetime_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apirequestshistoryrecord',
+            name='payload_storage',
+            field=models.CharField(blank=True, default='zlib', max_length=10, verbose_name='хранение текстов'),
+        ),
+        migrations.AddIndex(
+            model_name='apirequestshistoryrecord',
+            index=models.Index(fields=['datetime', 'soap_action'], name='history_datetime_action_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0041_history_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synccheckpoint',
+            name='seen_guids',
+            field=models.JSONField(blank=True, default=list, verbose_name='полученные GUID'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vetis_api', '0042_synccheckpoint_seen_guids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='ключ')),
+                ('tokens', models.FloatField(verbose_name='токены')),
+                ('updated', models.FloatField(verbose_name='время обновления')),
+            ],
+            options={
+                'verbose_name': 'лимит запросов',
+                'verbose_name_plural': 'лимиты запросов',
+            },
+        ),
+    ]
@@ -1,10 +1,15 @@
 from datetime import datetime, timezone, timedelta
 
 from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils.functional import cached_property
+from django.utils.timezone import now as timezone_now
 
 from main.models import User
 
+from .dictionary_cache import dictionary_cache
+from .payloads import get_payload_storage, load_payload, save_payload
+from .upsert import KEEP_STORED, upsert_one
+
 
 PRODUCT_TYPES = (
     (1, 'Мясо и мясопродукты'),
@@ -21,13 +26,45 @@ TZ_MOSCOW = timezone(timedelta(hours=3))
 
 
 class ApiRequestsHistoryRecord(models.Model):
-    datetime = models.DateTimeField(auto_now_add=True, verbose_name='метка времени')
+    datetime = models.DateTimeField(default=timezone_now, verbose_name='метка времени')  # time of the call, the record may be written later
     soap_action = models.CharField(null=True, max_length=30, verbose_name='SOAP action')
-    soap_request = models.TextField(null=True, verbose_name='текст запроса')
     response_status_code = models.IntegerField(null=True, verbose_name='статус ответа')
-    response_body = models.TextField(null=True, verbose_name='текст ответа')
     comment = models.CharField(null=True, max_length=255, verbose_name='комментарий')
     user = models.ForeignKey(User, null=True, on_delete=models.PROTECT, verbose_name='пользователь')
+    # request and response texts, see vetis_api.payloads
+    payload_storage = models.CharField(max_length=10, blank=True, default='zlib', verbose_name='хранение текстов')  # blank: purged
+    request_size = models.IntegerField(null=True, blank=True, verbose_name='размер запроса')
+    request_hash = models.CharField(max_length=64, blank=True, verbose_name='SHA-256 запроса')
+    request_data = models.BinaryField(null=True, blank=True)
+    response_size = models.IntegerField(null=True, blank=True, verbose_name='размер ответа')
+    response_hash = models.CharField(max_length=64, blank=True, verbose_name='SHA-256 ответа')
+    response_data = models.BinaryField(null=True, blank=True)
+
+    def set_payloads(self, soap_request: str | bytes | None, response_body: str | bytes | None):
+        storage = get_payload_storage()
+        self.payload_storage = storage.name
+        self.request_size, self.request_hash, self.request_data = save_payload(storage, soap_request)
+        self.response_size, self.response_hash, self.response_data = save_payload(storage, response_body)
+        # bytes are decoded only if the text is read
+        for name, value in (('soap_request', soap_request), ('response_body', response_body)):
+            if isinstance(value, bytes):
+                self.__dict__.pop(name, None)
+            else:
+                self.__dict__[name] = value
+
+    # decompressed on first access
+
+    @cached_property
+    def soap_request(self) -> str | None:
+        if not self.payload_storage:
+            return None
+        return load_payload(get_payload_storage(self.payload_storage), self.request_size, self.request_hash, self.request_data)
+
+    @cached_property
+    def response_body(self) -> str | None:
+        if not self.payload_storage:
+            return None
+        return load_payload(get_payload_storage(self.payload_storage), self.response_size, self.response_hash, self.response_data)
 
     def __str__(self):
         return f'{self.soap_action} ({self.response_status_code})'
@@ -36,6 +73,10 @@ class ApiRequestsHistoryRecord(models.Model):
         verbose_name = 'запись истории запросов'
         verbose_name_plural = 'записи истории запросов'
         ordering = ['-datetime']
+        indexes = [
+            # history pages, admin filters and retention purge (vetis_api.retention)
+            models.Index(fields=['datetime', 'soap_action'], name='history_datetime_action_idx'),
+        ]
 
 
 class VetisCredentials(models.Model):
@@ -108,6 +149,52 @@ class Enterprise(models.Model):
         ordering = ['name']
 
 
+class SyncCheckpoint(models.Model):
+    """Position of a multi-page sync: pages before list_offset are committed, see vetis_api.checkpoints"""
+
+    TASK_CHOICES = (
+        ('reload_enterprises', 'предприятия хозяйствующего субъекта'),
+        ('reload_product_items', 'наименования продукции хозяйствующего субъекта'),
+        ('update_stock_entries', 'складской журнал предприятия'),
+        ('update_stock_entry_history', 'история записи журнала'),
+    )
+    task = models.CharField(max_length=30, choices=TASK_CHOICES, verbose_name='задача')
+    object_guid = models.UUIDField(verbose_name='GUID объекта')  # business entity, enterprise or stock entry
+    mode = models.CharField(max_length=10, blank=True, verbose_name='режим')
+    begin_date = models.DateTimeField(null=True, blank=True, verbose_name='начало периода')
+    end_date = models.DateTimeField(null=True, blank=True, verbose_name='конец периода')
+    list_offset = models.IntegerField(default=0, verbose_name='смещение')
+    total = models.IntegerField(null=True, blank=True, verbose_name='всего')
+    seen_guids = models.JSONField(default=list, blank=True, verbose_name='полученные GUID')  # of committed pages, see checkpoints.deactivate_unseen
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name='дата создания')
+    date_updated = models.DateTimeField(auto_now=True, verbose_name='дата обновления')
+
+    def __str__(self):
+        return f'{self.task} {self.object_guid}: {self.list_offset} из {self.total}'
+
+    class Meta:
+        verbose_name = 'контрольная точка синхронизации'
+        verbose_name_plural = 'контрольные точки синхронизации'
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'object_guid'], name='synccheckpoint_task_object_unique'),
+        ]
+
+
+class RateLimitBucket(models.Model):
+    """Token bucket of a rate limit shared by worker processes through DB, see vetis_api.ratelimit"""
+
+    key = models.CharField(max_length=255, unique=True, verbose_name='ключ')
+    tokens = models.FloatField(verbose_name='токены')
+    updated = models.FloatField(verbose_name='время обновления')  # unix time
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = 'лимит запросов'
+        verbose_name_plural = 'лимиты запросов'
+
+
 class BusinessEntityInfo(models.Model):
     guid = models.UUIDField(primary_key=True)
     uuid = models.UUIDField()
@@ -202,13 +289,13 @@ class Unit(models.Model):
     guid = models.UUIDField(unique=True)
     name = models.CharField(max_length=255, verbose_name='название')
 
-    # TODO implement native get_or_create logic https://docs.djangoproject.com/en/5.2/ref/models/querysets/#get-or-create
     @classmethod
     def get_or_create(cls, guid: str, name: str):
-        try:
-            unit = cls.objects.get(guid=guid)
-        except ObjectDoesNotExist:
-            unit = cls.objects.create(guid=guid, name=name)
+        unit = dictionary_cache.get(cls, guid)
+        if unit is not None:
+            return unit
+        unit = upsert_one(cls(guid=guid, name=name), KEEP_STORED)
+        dictionary_cache.put(unit)
         return unit
 
     def __str__(self):
@@ -465,48 +552,8 @@ class StockEntryMain(models.Model):
         ordering = ['-date_created']
     
 
-class StockEntry(models.Model):
-    '''Версии записей складского журнала'''
-    main = models.ForeignKey(StockEntryMain, on_delete=models.PROTECT, verbose_name='головная запись')
-    enterprise = models.ForeignKey(Enterprise, on_delete=models.PROTECT, verbose_name='предприятие')
-    guid = models.UUIDField(db_index=True)
-    uuid = models.UUIDField(unique=True, db_index=True)
-    is_active = models.BooleanField(verbose_name='активная')
-    is_last = models.BooleanField(verbose_name='последняя')
-    status = models.IntegerField(choices=STOCK_ENTRY_STATUS_CHOICES, verbose_name='статус версии')
-    date_created = models.DateTimeField(verbose_name='дата создания')
-    date_updated = models.DateTimeField(verbose_name='дата обновления')
-    previous_uuid = models.UUIDField(null=True, blank=True, verbose_name='UUID предыдущей версии')
-    next_uuid = models.UUIDField(null=True, blank=True, verbose_name='UUID следующей версии')
-    entry_number = models.BigIntegerField(verbose_name='номер записи')
-
-    product_type = models.IntegerField(choices=PRODUCT_TYPES, verbose_name='тип продукции')
-    product_guid = models.UUIDField(null=True, blank=True, verbose_name='продукция (GUID)')
-    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.PROTECT, verbose_name='продукция')
-    subproduct_guid = models.UUIDField(null=True, blank=True, verbose_name='вид продукции (GUID)')
-    subproduct = models.ForeignKey(SubProduct, null=True, blank=True, on_delete=models.PROTECT, verbose_name='вид продукции')
-    
-    product_item_guid = models.UUIDField(null=True, blank=True, verbose_name='наименование продукции (GUID)')
-    product_item_name = models.CharField(max_length=255, verbose_name='наименование продукции')
-    product_item = models.ForeignKey(ProductItem, null=True, blank=True, on_delete=models.PROTECT, verbose_name='наименование продукции (справочник)')
-
-    volume = models.DecimalField(decimal_places=6, max_digits=15, verbose_name='объем')
-    unit = models.ForeignKey(Unit, on_delete=models.PROTECT, verbose_name='ЕИ')
-
-    date_produced_1 = models.CharField(max_length=16, verbose_name='дата производства 1')
-    date_produced_2 = models.CharField(max_length=16, blank=True, verbose_name='дата производства 2')
-    date_produced = models.DateTimeField(verbose_name='дата производства')  # минимальная дата в интервале
-
-    date_expiry_1 = models.CharField(max_length=16, verbose_name='срок годности 1')
-    date_expiry_2 = models.CharField(max_length=16, blank=True, verbose_name='срок годности 2')
-    date_expiry = models.DateTimeField(verbose_name='срок годности')  # минимальная дата в интервале
-
-    is_perishable = models.BooleanField(verbose_name='скоропорт')
-
-    origin_country = models.CharField(max_length=255, null=True, blank=True, verbose_name='страна происхождения')
-    producer_name = models.CharField(max_length=255, null=True, blank=True, verbose_name='наименование производителя')
-    producer_guid = models.UUIDField(null=True, blank=True, verbose_name='предприятие-производитель (GUID)')
-    producer = models.ForeignKey(Enterprise, null=True, blank=True, on_delete=models.PROTECT, related_name='produced_entries_set', verbose_name='предприятие-производитель')
+class StockEntryDatesMixin:
+    '''Отображение дат и сроков годности (StockEntry, CurrentStockEntry)'''
 
     @property
     def date_produced_display(self):
@@ -545,7 +592,51 @@ class StockEntry(models.Model):
         for val, class_name in CLASS_VALUES:
             if days_to_expiry <= val:
                 return class_name
-        return ''   
+        return ''
+
+
+class StockEntry(StockEntryDatesMixin, models.Model):
+    '''Версии записей складского журнала'''
+    main = models.ForeignKey(StockEntryMain, on_delete=models.PROTECT, db_index=False, verbose_name='головная запись')  # see Meta.indexes
+    enterprise = models.ForeignKey(Enterprise, on_delete=models.PROTECT, db_index=False, verbose_name='предприятие')
+    guid = models.UUIDField()
+    uuid = models.UUIDField(unique=True, db_index=True)
+    is_active = models.BooleanField(verbose_name='активная')
+    is_last = models.BooleanField(verbose_name='последняя')
+    status = models.IntegerField(choices=STOCK_ENTRY_STATUS_CHOICES, verbose_name='статус версии')
+    date_created = models.DateTimeField(verbose_name='дата создания')
+    date_updated = models.DateTimeField(verbose_name='дата обновления')
+    previous_uuid = models.UUIDField(null=True, blank=True, verbose_name='UUID предыдущей версии')
+    next_uuid = models.UUIDField(null=True, blank=True, verbose_name='UUID следующей версии')
+    entry_number = models.BigIntegerField(verbose_name='номер записи')
+
+    product_type = models.IntegerField(choices=PRODUCT_TYPES, verbose_name='тип продукции')
+    product_guid = models.UUIDField(null=True, blank=True, verbose_name='продукция (GUID)')
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.PROTECT, verbose_name='продукция')
+    subproduct_guid = models.UUIDField(null=True, blank=True, verbose_name='вид продукции (GUID)')
+    subproduct = models.ForeignKey(SubProduct, null=True, blank=True, on_delete=models.PROTECT, verbose_name='вид продукции')
+    
+    product_item_guid = models.UUIDField(null=True, blank=True, verbose_name='наименование продукции (GUID)')
+    product_item_name = models.CharField(max_length=255, verbose_name='наименование продукции')
+    product_item = models.ForeignKey(ProductItem, null=True, blank=True, on_delete=models.PROTECT, verbose_name='наименование продукции (справочник)')
+
+    volume = models.DecimalField(decimal_places=6, max_digits=15, verbose_name='объем')
+    unit = models.ForeignKey(Unit, on_delete=models.PROTECT, verbose_name='ЕИ')
+
+    date_produced_1 = models.CharField(max_length=16, verbose_name='дата производства 1')
+    date_produced_2 = models.CharField(max_length=16, blank=True, verbose_name='дата производства 2')
+    date_produced = models.DateTimeField(verbose_name='дата производства')  # минимальная дата в интервале
+
+    date_expiry_1 = models.CharField(max_length=16, verbose_name='срок годности 1')
+    date_expiry_2 = models.CharField(max_length=16, blank=True, verbose_name='срок годности 2')
+    date_expiry = models.DateTimeField(verbose_name='срок годности')  # минимальная дата в интервале
+
+    is_perishable = models.BooleanField(verbose_name='скоропорт')
+
+    origin_country = models.CharField(max_length=255, null=True, blank=True, verbose_name='страна происхождения')
+    producer_name = models.CharField(max_length=255, null=True, blank=True, verbose_name='наименование производителя')
+    producer_guid = models.UUIDField(null=True, blank=True, verbose_name='предприятие-производитель (GUID)')
+    producer = models.ForeignKey(Enterprise, null=True, blank=True, on_delete=models.PROTECT, related_name='produced_entries_set', verbose_name='предприятие-производитель')
 
     def __str__(self):
         return f'{self.entry_number} {self.product_item_name} - {self.volume}'
@@ -554,6 +645,65 @@ class StockEntry(models.Model):
         verbose_name = 'запись складского журнала'
         verbose_name_plural = 'записи складского журнала'
         ordering = ['-date_updated']
+        indexes = [
+            # versions of an entry: history by guid, first version by main record
+            models.Index(fields=['guid', 'date_created'], name='stockentry_guid_created_idx'),
+            models.Index(fields=['main', 'date_created'], name='stockentry_main_created_idx'),
+            # last update of an enterprise's journal
+            models.Index(fields=['enterprise', '-date_updated'], name='stockentry_ent_updated_idx'),
+        ]
+
+
+class CurrentStockEntry(StockEntryDatesMixin, models.Model):
+    '''
+    Текущие остатки: последняя активная версия каждой записи журнала вместе с данными головной записи.
+    Поддерживается синхронизацией (см. current_stock.py), журнал в интерфейсе читается отсюда.
+    '''
+    guid = models.UUIDField(unique=True)
+    stock_entry = models.OneToOneField(StockEntry, on_delete=models.CASCADE, related_name='current', verbose_name='версия')
+    main = models.ForeignKey(StockEntryMain, on_delete=models.CASCADE, verbose_name='головная запись')
+    enterprise = models.ForeignKey(Enterprise, on_delete=models.PROTECT, db_index=False, verbose_name='предприятие')  # see Meta.indexes
+
+    entry_number = models.BigIntegerField(verbose_name='номер записи')
+    product_type = models.IntegerField(choices=PRODUCT_TYPES, verbose_name='тип продукции')
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.PROTECT, related_name='+', verbose_name='продукция')
+    product_item_name = models.CharField(max_length=255, verbose_name='наименование продукции')
+    volume = models.DecimalField(decimal_places=6, max_digits=15, verbose_name='объем')
+    unit = models.ForeignKey(Unit, on_delete=models.PROTECT, related_name='+', verbose_name='ЕИ')
+    date_produced_1 = models.CharField(max_length=16, verbose_name='дата производства 1')
+    date_produced_2 = models.CharField(max_length=16, blank=True, verbose_name='дата производства 2')
+    date_produced = models.DateTimeField(verbose_name='дата производства')
+    date_expiry_1 = models.CharField(max_length=16, verbose_name='срок годности 1')
+    date_expiry_2 = models.CharField(max_length=16, blank=True, verbose_name='срок годности 2')
+    date_expiry = models.DateTimeField(verbose_name='срок годности')
+    date_created = models.DateTimeField(verbose_name='дата создания')
+    date_updated = models.DateTimeField(verbose_name='дата обновления')
+    is_perishable = models.BooleanField(verbose_name='скоропорт')
+    origin_country = models.CharField(max_length=255, null=True, blank=True, verbose_name='страна происхождения')
+    producer_name = models.CharField(max_length=255, null=True, blank=True, verbose_name='наименование производителя')
+
+    # StockEntryMain
+    is_populated = models.BooleanField(default=False, verbose_name='данные заполнены')
+    initial_status = models.IntegerField(null=True, blank=True, choices=STOCK_ENTRY_STATUS_CHOICES, verbose_name='статус версии')
+    initial_volume = models.DecimalField(decimal_places=6, max_digits=15, null=True, blank=True, verbose_name='объем')
+    source_be_name = models.TextField(max_length=255, blank=True, verbose_name='хозяйствующий субъект - источник')
+    source_ent_name = models.TextField(max_length=255, blank=True, verbose_name='предприятие - источник')
+    comment_important = models.BooleanField(default=False, verbose_name='комментарий важен')
+    comment_text = models.TextField(max_length=255, blank=True, verbose_name='текст комментария')
+
+    def __str__(self):
+        return f'{self.entry_number} {self.product_item_name} - {self.volume}'
+
+    class Meta:
+        verbose_name = 'текущая запись складского журнала'
+        verbose_name_plural = 'текущие записи складского журнала'
+        ordering = ['date_expiry', '-entry_number']
+        indexes = [
+            # journal of an enterprise in display order (stock_entries view)
+            models.Index(fields=['enterprise', 'date_expiry', '-entry_number'], name='currentstock_ent_expiry_idx'),
+            # non-empty entries by expiry date (index view)
+            models.Index(fields=['date_expiry'], condition=models.Q(volume__gt=0), name='currentstock_expiry_idx'),
+        ]
 
 
 class PackingType(models.Model):
@@ -562,18 +712,18 @@ class PackingType(models.Model):
     name = models.CharField(max_length=255, verbose_name='название')
     global_id = models.CharField(max_length=2, verbose_name='идентификатор')
 
-    # TODO implement native get_or_create logic https://docs.djangoproject.com/en/5.2/ref/models/querysets/#get-or-create
     @classmethod
     def get_or_create(cls, guid: str, uuid: str, name: str, global_id: str):
-        try:
-            packing_type = cls.objects.get(guid=guid)
-        except ObjectDoesNotExist:
-            packing_type = cls.objects.create(
-                guid=guid,
-                uuid=uuid,
-                name=name,
-                global_id=global_id
-                )
+        packing_type = dictionary_cache.get(cls, guid)
+        if packing_type is not None:
+            return packing_type
+        packing_type = upsert_one(cls(
+            guid=guid,
+            uuid=uuid,
+            name=name,
+            global_id=global_id
+            ), KEEP_STORED)
+        dictionary_cache.put(packing_type)
         return packing_type
 
     def __str__(self):
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import zlib
+from datetime import datetime
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+
+
+# Storages of request and response texts of ApiRequestsHistoryRecord.
+#
+# A history row keeps size and SHA-256 of each text and whatever the storage returns
+# for its data column: compressed text, or nothing if the text is kept elsewhere.
+# The storage name is saved in the row, so rows written before VETIS_HISTORY_PAYLOAD_STORAGE
+# was changed stay readable. Rows with texts purged by retention (vetis_api.retention) have no storage.
+
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def get_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class PayloadStorage:
+    name = None
+
+    def save(self, data: bytes, digest: str) -> bytes | None:
+        """Stores data, returns value of the data column"""
+        raise NotImplementedError
+
+    def load(self, stored: bytes | None, digest: str) -> bytes:
+        raise NotImplementedError
+
+
+class ZlibPayloadStorage(PayloadStorage):
+    """zlib-compressed text in the history row"""
+
+    name = 'zlib'
+
+    def save(self, data: bytes, digest: str) -> bytes:
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    def load(self, stored: bytes, digest: str) -> bytes:
+        return zlib.decompress(stored)
+
+
+class ZstdPayloadStorage(PayloadStorage):
+    """zstd-compressed text in the history row, requires zstandard package"""
+
+    name = 'zstd'
+
+    def _get_zstandard(self):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError('Для хранения истории запросов в формате zstd требуется пакет zstandard') from e
+        return zstandard
+
+    def save(self, data: bytes, digest: str) -> bytes:
+        return self._get_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+    def load(self, stored: bytes, digest: str) -> bytes:
+        return self._get_zstandard().ZstdDecompressor().decompress(stored)
+
+
+class FilePayloadStorage(PayloadStorage):
+    """
+    zlib-compressed files named by SHA-256 of the text in VETIS_HISTORY_PAYLOAD_DIR,
+    identical texts (repeated requests, empty pages, polls of pending applications) are stored once.
+    """
+
+    name = 'file'
+
+    def get_root(self) -> Path:
+        return Path(getattr(settings, 'VETIS_HISTORY_PAYLOAD_DIR', settings.BASE_DIR / 'history'))
+
+    def get_path(self, digest: str) -> Path:
+        return self.get_root() / digest[:2] / f'{digest}.zz'
+
+    def save(self, data: bytes, digest: str) -> None:
+        path = self.get_path(digest)
+        try:
+            # modification time is the time of the latest record referencing the file, see purge()
+            os.utime(path)
+            return None
+        except FileNotFoundError:
+            pass
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # written under a temporary name, so readers never see a partial file
+        with NamedTemporaryFile(dir=path.parent, prefix=f'.{digest}.', delete=False) as file:
+            file.write(zlib.compress(data, ZLIB_LEVEL))
+        os.replace(file.name, path)
+
+        return None
+
+    def load(self, stored: None, digest: str) -> bytes:
+        return zlib.decompress(self.get_path(digest).read_bytes())
+
+    def purge(self, cutoff: datetime) -> int:
+        """Deletes files not referenced by records since cutoff, returns number of deleted files"""
+
+        deleted = 0
+        for path in self.get_root().glob('*/*.zz'):
+            if path.stat().st_mtime < cutoff.timestamp():
+                path.unlink(missing_ok=True)
+                deleted += 1
+        return deleted
+
+
+PAYLOAD_STORAGES = {
+    storage.name: storage
+    for storage in (ZlibPayloadStorage(), ZstdPayloadStorage(), FilePayloadStorage())
+}
+
+
+def get_payload_storage(name: str = None) -> PayloadStorage:
+    """Storage by name, the one set with VETIS_HISTORY_PAYLOAD_STORAGE by default"""
+
+    if name is None:
+        name = getattr(settings, 'VETIS_HISTORY_PAYLOAD_STORAGE', 'zlib')
+
+    try:
+        return PAYLOAD_STORAGES[name]
+    except KeyError:
+        raise RuntimeError(f'Неизвестный способ хранения истории запросов: {name}')
+
+
+def save_payload(storage: PayloadStorage, text: str | bytes | None) -> tuple[int | None, str, bytes | None]:
+    """Returns (size, digest, data column value) of the text, bytes are stored as they are (UTF-8 of Vetis)"""
+
+    if text is None:
+        return None, '', None
+
+    data = text.encode('utf-8') if isinstance(text, str) else bytes(text)
+    digest = get_digest(data)
+
+    return len(data), digest, storage.save(data, digest)
+
+
+def load_payload(storage: PayloadStorage, size: int | None, digest: str, stored: bytes | None) -> str | None:
+    if size is None:
+        return None
+
+    # response bytes are saved undecoded, e.g. an error page of a proxy in another encoding
+    return storage.load(bytes(stored) if stored is not None else None, digest).decode('utf-8', errors='replace')
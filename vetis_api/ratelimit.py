@@ -0,0 +1,125 @@
+from time import sleep, time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .locks import CacheLock, get_lock_cache, is_lock_cache_shared
+from .models import RateLimitBucket
+
+
+DEFAULT_RATE_LIMIT = {
+    'rate': 5.0,  # requests per second
+    'burst': 10,  # requests allowed without waiting after idle period
+}
+
+LOCK_TIMEOUT = 5  # seconds, stale lock expires by itself if worker dies holding it
+
+# Connection of DatabaseTokenBucket to the same database as default, see settings.DATABASES.
+# Reservations are committed at once on it instead of keeping the bucket row locked
+# until the end of the caller's transaction.
+RATE_LIMIT_DATABASE = 'vetis-ratelimit'
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every worker process using the same storage.
+
+    Tokens are reserved before waiting: a caller that finds the bucket empty
+    takes a token "in debt" and sleeps until it is refilled. Concurrent callers
+    therefore queue up instead of all waking at the same moment.
+    """
+
+    def __init__(self, key: str, rate: float, burst: int):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def take(self, tokens: float, updated: float, now: float) -> float:
+        """Refills tokens stored at `updated` and takes one, returns tokens left"""
+        return min(self.burst, tokens + (now - updated) * self.rate) - 1
+
+    def get_wait(self, tokens: float) -> float:
+        return -tokens / self.rate if tokens < 0 else 0.0
+
+    def reserve(self) -> float:
+        """Takes one token and returns number of seconds to wait before using it"""
+        raise NotImplementedError()
+
+    def acquire(self) -> float:
+        """Waits until request is allowed. Returns waited time."""
+
+        wait = self.reserve()
+        if wait:
+            sleep(wait)
+        return wait
+
+
+class CacheTokenBucket(TokenBucket):
+    """
+    Token bucket stored in the lock cache (see vetis_api.locks), which must be shared
+    by the worker processes: Redis or memcached. The bucket is read and written under
+    a lock; reserve() waits for it and never updates the bucket unlocked.
+    """
+
+    def __init__(self, key: str, rate: float, burst: int):
+        super().__init__(key, rate, burst)
+        self.cache = get_lock_cache()
+
+    def reserve(self) -> float:
+        """Raises LockTimeout if the bucket stays locked"""
+
+        with CacheLock(f'{self.key}:lock', LOCK_TIMEOUT):
+            now = time()
+            tokens, updated = self.cache.get(self.key, (self.burst, now))
+            tokens = self.take(tokens, updated, now)
+            # keep state at least until the bucket is full again
+            self.cache.set(self.key, (tokens, now), timeout=int((self.burst - tokens) / self.rate) + 60)
+
+        return self.get_wait(tokens)
+
+
+class DatabaseTokenBucket(TokenBucket):
+    """
+    Token bucket stored in a RateLimitBucket row, for worker processes without a shared cache.
+    The row is locked with SELECT ... FOR UPDATE while the bucket is updated.
+    """
+
+    def reserve(self) -> float:
+        using = get_rate_limit_database()
+
+        with transaction.atomic(using=using):
+            # the row is created once, the insert takes the write lock first on SQLite
+            RateLimitBucket.objects.using(using).bulk_create([RateLimitBucket(key=self.key, tokens=self.burst, updated=time())], ignore_conflicts=True)
+            bucket = RateLimitBucket.objects.using(using).select_for_update().get(key=self.key)
+            now = time()
+            tokens = self.take(bucket.tokens, bucket.updated, now)
+            RateLimitBucket.objects.using(using).filter(id=bucket.id).update(tokens=tokens, updated=now)
+
+        return self.get_wait(tokens)
+
+
+def get_rate_limit_database() -> str:
+    # without the alias (e.g. SQLite, where writers are serialized anyway) the caller's connection is used
+    return RATE_LIMIT_DATABASE if RATE_LIMIT_DATABASE in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def get_rate_limit(endpoint_name: str) -> dict:
+    rate_limits = getattr(settings, 'VETIS_RATE_LIMITS', {})
+    return rate_limits.get(endpoint_name, rate_limits.get('default', DEFAULT_RATE_LIMIT))
+
+
+def get_bucket(credentials_id: int, endpoint_name: str) -> TokenBucket | None:
+    """
+    Returns shared bucket for credentials and endpoint or None if endpoint is not limited.
+    Buckets are kept in the lock cache if it is shared by worker processes, in DB otherwise.
+    """
+
+    rate_limit = get_rate_limit(endpoint_name)
+    if rate_limit is None:
+        return None
+    bucket_class = CacheTokenBucket if is_lock_cache_shared() else DatabaseTokenBucket
+    return bucket_class(
+        key=f'vetis-rate-limit:{credentials_id}:{endpoint_name}',
+        rate=rate_limit['rate'],
+        burst=rate_limit['burst'],
+    )
@@ -0,0 +1,107 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple
+
+from .models import ComplexDate
+
+
+# Records extracted from Vetis responses (see xml/schemas.py).
+# They are what parsing hands over to persistence: model instances are
+# built from them only for rows that have to be written.
+
+
+class ProductRecord(NamedTuple):
+    guid: str
+    uuid: str
+    name: str
+    code: str | None
+    product_type: int
+
+
+class SubProductRecord(NamedTuple):
+    guid: str
+    uuid: str
+    name: str
+    code: str | None
+    product_guid: str
+
+
+class ProductItemRecord(NamedTuple):
+    guid: str
+    uuid: str
+    is_active: bool
+    name: str | None
+    gtin: str | None
+    product_type: int
+    product_guid: str
+    subproduct_guid: str
+    is_gost: bool
+    gost: str | None
+    producer_guid: str | None
+
+
+class BusinessEntityRecord(NamedTuple):
+    guid: str
+    uuid: str
+    name: str | None
+    full_name: str | None
+    fio: str | None
+    inn: str | None
+
+
+class EnterpriseRecord(NamedTuple):
+    guid: str
+    uuid: str
+    is_active: bool
+    type: int
+    name: str
+    address: str | None
+    numbers: list[str]
+
+
+class PackageRecord(NamedTuple):
+    level: int
+    packing_type_guid: str
+    packing_type_uuid: str
+    packing_type_name: str
+    packing_type_global_id: str | None
+    quantity: int
+    product_marks: list[str]
+
+
+class StockEntryRecord(NamedTuple):
+    guid: str
+    uuid: str
+    is_active: bool
+    is_last: bool
+    status: int
+    date_created: datetime
+    date_updated: datetime
+    previous_uuid: str | None
+    next_uuid: str | None
+    entry_number: str
+    product_type: int
+    product_guid: str
+    subproduct_guid: str
+    product_item_guid: str | None
+    product_item_name: str
+    volume: Decimal | None
+    unit_guid: str
+    unit_name: str
+    date_produced_1: ComplexDate
+    date_produced_2: ComplexDate | None
+    date_expiry_1: ComplexDate
+    date_expiry_2: ComplexDate | None
+    is_perishable: bool
+    origin_country: str | None
+    producer_guid: str | None
+    producer_name: str | None
+    packages: list[PackageRecord]
+    vet_document_uuids: list[str]
+
+
+class VetDocumentRecord(NamedTuple):
+    uuid: str
+    vetd_type: str
+    consignor_be_guid: str | None
+    consignor_ent_guid: str | None
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import TZ_MOSCOW, ApiRequestsHistoryRecord
+from .payloads import get_payload_storage
+
+
+# Retention of API request history, see VETIS_HISTORY_RETENTION.
+#
+# Texts of requests are kept for less time than history records, texts and records
+# of failed requests longer than of successful ones. Rows are purged in batches read in datetime order through the
+# (datetime, soap_action) index, each batch a short statement of its own,
+# instead of one DELETE locking the table for the whole purge.
+
+
+BATCH_SIZE = 1000
+
+DEFAULT_RETENTION = {
+    'payloads': 7,
+    'failed_payloads': 30,
+    'records': 180,
+    'failed_records': 365,
+}
+
+SUCCEEDED = Q(response_status_code=200)
+FAILED = ~Q(response_status_code=200)  # NULL included
+
+
+def get_retention() -> dict:
+    return DEFAULT_RETENTION | getattr(settings, 'VETIS_HISTORY_RETENTION', {})
+
+
+def get_cutoff(days: int | None, now: datetime) -> datetime | None:
+    return now - timedelta(days=days) if days is not None else None
+
+
+def iter_batches(queryset, cutoff: datetime, batch_size: int = BATCH_SIZE):
+    """
+    Yields ids of queryset rows older than cutoff, batch_size at a time in datetime order.
+    Rows of a batch must stop matching the queryset (deleted, updated) before the next one.
+    """
+
+    since = None
+    while True:
+        rows = queryset.filter(datetime__lt=cutoff)
+        if since is not None:
+            # rows before the last batch are either processed or do not match
+            rows = rows.filter(datetime__gte=since)
+        rows = list(rows.order_by('datetime').values_list('id', 'datetime')[:batch_size])
+
+        if not rows:
+            return
+
+        yield [id for id, _ in rows]
+
+        since = rows[-1][1]
+
+
+def purge_payloads(condition: Q, cutoff: datetime) -> int:
+    queryset = ApiRequestsHistoryRecord.objects.filter(condition).exclude(payload_storage='')
+
+    purged = 0
+    for ids in iter_batches(queryset, cutoff):
+        purged += ApiRequestsHistoryRecord.objects.filter(id__in=ids).update(
+            payload_storage='',
+            request_data=None,
+            response_data=None
+        )
+    return purged
+
+
+def purge_records(condition: Q, cutoff: datetime) -> int:
+    queryset = ApiRequestsHistoryRecord.objects.filter(condition)
+
+    purged = 0
+    for ids in iter_batches(queryset, cutoff):
+        purged += ApiRequestsHistoryRecord.objects.filter(id__in=ids).delete()[0]
+    return purged
+
+
+def purge_history(now: datetime = None) -> dict:
+    """Applies VETIS_HISTORY_RETENTION, returns numbers of purged payloads, records and files"""
+
+    if now is None:
+        now = datetime.now(tz=TZ_MOSCOW)
+
+    retention = get_retention()
+    result = {}
+
+    for key, purge, condition in (
+        ('records', purge_records, SUCCEEDED),
+        ('failed_records', purge_records, FAILED),
+        ('payloads', purge_payloads, SUCCEEDED),
+        ('failed_payloads', purge_payloads, FAILED),
+    ):
+        cutoff = get_cutoff(retention[key], now)
+        if cutoff is not None:
+            result[key] = purge(condition, cutoff)
+
+    # files are shared between records, a file is kept while any record may still reference it
+    cutoffs = [get_cutoff(retention[key], now) for key in ('payloads', 'failed_payloads')]
+    if None not in cutoffs:
+        result['files'] = get_payload_storage('file').purge(min(cutoffs))
+
+    return result
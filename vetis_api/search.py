@@ -0,0 +1,66 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Q, QuerySet
+
+
+SEARCH_CONFIG = 'russian'
+
+
+def parse_search_query(text: str) -> tuple[list[str], list[str]]:
+    """Splits 'word -word' into words to include and words to exclude"""
+
+    include = []
+    exclude = []
+    for word in text.split():
+        if word.startswith('-'):
+            if len(word) > 1:
+                exclude.append(word[1:])
+        else:
+            include.append(word)
+    return include, exclude
+
+
+def is_full_text_search_available(queryset: QuerySet) -> bool:
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def search(queryset: QuerySet, text: str, fields: list[str], vector_field: str, rank: bool = True) -> QuerySet:
+    """
+    Filters queryset with search text: each word must be contained in one of the fields,
+    words starting with '-' must not be.
+
+    On PostgreSQL a word also matches vector_field by Russian stem ("молока" finds "молоко"),
+    substring lookups are served by trigram indexes and full-text ones by tsvector indexes
+    (migration 0034), results are ordered by rank first if rank == True.
+    Elsewhere it is plain icontains in the original order.
+    """
+
+    include, exclude = parse_search_query(text)
+    full_text = is_full_text_search_available(queryset)
+
+    if full_text:
+        queryset = queryset.alias(search_vector=SearchVector(vector_field, config=SEARCH_CONFIG))
+
+    def word_filter(word: str) -> Q:
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__icontains': word})
+        if full_text:
+            condition |= Q(search_vector=SearchQuery(word, config=SEARCH_CONFIG))
+        return condition
+
+    for word in include:
+        queryset = queryset.filter(word_filter(word))
+    for word in exclude:
+        queryset = queryset.exclude(word_filter(word))
+
+    if full_text and rank and include:
+        query = SearchQuery(include[0], config=SEARCH_CONFIG)
+        for word in include[1:]:
+            query |= SearchQuery(word, config=SEARCH_CONFIG)
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        queryset = queryset.annotate(
+            search_rank=SearchRank(SearchVector(vector_field, config=SEARCH_CONFIG), query)
+        ).order_by('-search_rank', *ordering)
+
+    return queryset
@@ -0,0 +1,150 @@
+from random import random
+from threading import Event, Lock, local
+
+from django.db import transaction
+
+from .locks import CacheLock, LockTimeout
+
+
+LOCK_TIMEOUT = 120  # seconds, longer than a request with all its retries
+WAIT_TIMEOUT = LOCK_TIMEOUT + 10  # lock of a holder that died expires before waiting gives up
+PENDING_WAIT = 30  # seconds to wait for a lock while holding locks of own uncommitted loads
+LOCK_WAIT = 0.1
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent loads.
+
+    Within a process callers with the same key wait for the first caller and
+    receive its result. Between processes the first caller holds a lock in the
+    lock cache (see vetis_api.locks) until its transaction is committed, others
+    wait for it, then run their function, which is expected to find the record
+    in DB instead of requesting Vetis again.
+
+    Two transactions may each wait for a record the other has not committed yet,
+    so a caller holding locks of its own uncommitted loads waits for another lock
+    at most PENDING_WAIT seconds, then releases its locks and raises LockTimeout.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._calls = {}
+        self._lock = Lock()
+        self._local = local()
+
+    def _lock_key(self, key: tuple) -> str:
+        return f'vetis-single-flight:{self.namespace}:' + ':'.join(str(part) for part in key)
+
+    def _get_pending(self) -> list[CacheLock]:
+        """Locks of loads made in the current transaction of this thread"""
+
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = []
+        return self._local.pending
+
+    def _is_pending(self, lock: CacheLock) -> bool:
+        return any(pending.key == lock.key for pending in self._get_pending())
+
+    def claim(self, key: tuple) -> CacheLock | None:
+        """
+        Takes cross-process lock for key without waiting. Returns None if key is being loaded elsewhere.
+        A key loaded earlier in the current transaction is claimed again: its lock is released on commit,
+        the lock returned is not held and its release does nothing.
+        """
+
+        self._release_rolled_back()
+        lock = CacheLock(self._lock_key(key), LOCK_TIMEOUT)
+        if self._is_pending(lock):
+            return lock
+        return lock if lock.claim() else None
+
+    def acquire(self, key: tuple) -> CacheLock:
+        """Waits for cross-process lock for key, raises LockTimeout. Same as claim for a key loaded in the current transaction."""
+
+        self._release_rolled_back()
+        lock = CacheLock(self._lock_key(key), LOCK_TIMEOUT)
+
+        if self._is_pending(lock):
+            # waiting for own lock would last until the timeout
+            return lock
+
+        if not self._get_pending():
+            lock.acquire(WAIT_TIMEOUT, LOCK_WAIT)
+            return lock
+
+        try:
+            # random, so two transactions waiting for each other do not give up at the same moment
+            lock.acquire(PENDING_WAIT * (1 + random()), LOCK_WAIT)
+        except LockTimeout:
+            # the transaction is rolled back by the error, the other one may go on meanwhile
+            self.release_pending()
+            raise
+        return lock
+
+    def release_on_commit(self, locks: list[CacheLock]):
+        """
+        Releases locks of loaded keys when the current transaction is committed:
+        until then other processes would find neither the lock nor the record.
+        Outside of a transaction locks are released at once.
+        """
+
+        if not transaction.get_connection().in_atomic_block:
+            for lock in locks:
+                lock.release()
+            return
+
+        self._get_pending().extend(locks)
+        transaction.on_commit(self.release_pending)
+
+    def release_pending(self):
+        pending = self._get_pending()
+        while pending:
+            pending.pop().release()
+
+    def _release_rolled_back(self):
+        # on_commit callbacks of a rolled back transaction are discarded, its locks are left pending
+        if not transaction.get_connection().in_atomic_block:
+            self.release_pending()
+
+    def do(self, key: tuple, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            lock = self.acquire(key)
+            try:
+                call.result = fn()
+            except Exception:
+                lock.release()
+                raise
+            self.release_on_commit([lock])
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+dictionary_loads = SingleFlight('dictionary')
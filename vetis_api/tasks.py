@@ -1,128 +1,118 @@
-import requests
-from time import sleep
+from collections import deque
+from time import sleep, time
 from datetime import datetime, timedelta
-from decimal import Decimal
 import xml.etree.ElementTree as ET
 
 from celery import shared_task, states
 
-from django.core.exceptions import ObjectDoesNotExist, BadRequest
-from django.db import transaction
-
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models, transaction
+
+from .applications import (
+    application_handler,
+    check_application_timeout,
+    get_application_handler,
+    get_poll_delay,
+    get_request_type,
+    receive_application_result,
+    record_processing_time,
+    submit_application,
+    wait_application_result
+    )
+from .checkpoints import advance_checkpoint, deactivate_unseen, finish_checkpoint, is_checkpoint_done, start_checkpoint
+from .copy_import import StockEntryCopyImport, use_copy_import
+from .current_stock import refresh_current_stock, refresh_current_stock_main
+from .dictionary_cache import dictionary_cache
 from .models import *
+from .records import *
+from .retention import purge_history
+from .singleflight import dictionary_loads
+from .transport import send_soap_request, send_soap_requests
+from .upsert import KEEP_STORED, upsert
 from .xml.build_xml import *
+from .xml.schemas import BUSINESS_ENTITY, ENTERPRISE, PRODUCT, PRODUCT_ITEM, STOCK_ENTRY, SUBPRODUCT, VET_DOCUMENT
 from .xml.settings import NAMESPACES
+from .xml.stream import ElementStream
 
 
 
-# PROD
-ENDPOINTS_PROD = {
-    'ProductService': 'https://api.vetrf.ru/platform/services/2.1/ProductService',
-    'EnterpriseService': 'https://api.vetrf.ru/platform/services/2.1/EnterpriseService',
-    'ApplicationManagementService': 'https://api.vetrf.ru/platform/services/2.1/ApplicationManagementService',
-}
-
-# TEST
-ENDPOINTS_TEST = {
-    'ProductService': 'https://api2.vetrf.ru:8002/platform/services/2.1/ProductService',
-    'EnterpriseService': 'https://api2.vetrf.ru:8002/platform/services/2.1/EnterpriseService',
-    'ApplicationManagementService': 'https://api2.vetrf.ru:8002/platform/services/2.1/ApplicationManagementService',
-}
-
-
-def send_soap_request(soap_request: AbstractRequest, credentials: VetisCredentials):
-    headers = {
-        'Content-Type': 'text/html;charset=UTF-8',
-        'SOAPAction': soap_request.soap_action,
-    }
-    body = soap_request.get_xml()
-
-    endpoint_url = ENDPOINTS_PROD[soap_request.endpoint_name] if credentials.is_productive else ENDPOINTS_TEST[soap_request.endpoint_name]
-
-    for try_num in range(3):
-
-        if try_num:
-            sleep(5*try_num)
-
-        try:
-            response = requests.post(
-                    url=endpoint_url,
-                    auth=(credentials.login, credentials.password),
-                    headers=headers,
-                    data=body
-                )
-        except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout) as e:
-            response = None
-        
-        if response is not None:
-            break
-        else:
-            print(f'Connection error on try #{try_num+1}')
-
-    if response is None:
-        raise RuntimeError('Не удалось установить соединение для отправки soap запроса')
-
-    record = ApiRequestsHistoryRecord()
-    record.soap_action = soap_request.soap_action
-    record.soap_request = soap_request.get_xml()
-    record.comment = f'{credentials.name} {endpoint_url}'
-    record.response_status_code = response.status_code
-    record.response_body = response.text
-    record.save()
-    
-    return response
-
-
 def send_2step_soap_request(soap_request: AbstractRequest, credentials: VetisCredentials):
+    """Submits application and blocks until its result is received"""
 
     print('Sending two-step request. Step 1.')
 
-    response = send_soap_request(soap_request, credentials)
+    submitted_at = time()
 
-    if response.status_code != 200:
-        raise RuntimeError(f'Ошибка запроса ({response.status_code}): {response.reason}')
+    application_id = submit_application(soap_request, credentials)
 
-    result_xml = ET.fromstring(response.text)
+    return wait_application_result(application_id, get_request_type(soap_request), credentials, submitted_at)
 
-    response_xml = result_xml.find('./soapenv:Body/apldef:submitApplicationResponse', NAMESPACES)
 
-    status = response_xml.find('apl:application/apl:status', NAMESPACES).text
+def schedule_application(handler_name: str, soap_request: AbstractRequest, credentials: VetisCredentials, state: dict) -> str:
+    """
+    Submits application and schedules collect_application_result at the time
+    Vetis usually needs to process this type of request. Worker is free meanwhile.
+    Result is passed to the handler registered with @application_handler(handler_name).
+    """
 
-    print(f'Status: {status}')
+    submitted_at = time()
 
-    if status != 'ACCEPTED':
-        raise RuntimeError(f'Ошибка обработки запроса ({status})')
-    
-    application_id = response_xml.find('apl:application/apl:applicationId', NAMESPACES).text
+    application_id = submit_application(soap_request, credentials)
 
-    application_result_request = ReceiveApplicationResultRequest(api_key=credentials.api_key, issuer_id=credentials.issuer_id, application_id=application_id)
+    request_type = get_request_type(soap_request)
 
-    status = '---'
+    collect_application_result.apply_async(
+        kwargs={
+            'handler_name': handler_name,
+            'credentials_id': credentials.id,
+            'application_id': application_id,
+            'request_type': request_type,
+            'state': state,
+            'submitted_at': submitted_at,
+        },
+        countdown=get_poll_delay(request_type, 0, 0)
+    )
 
-    for try_num in range(4):
-        sleep(3 + try_num*10)
+    return application_id
 
-        print(f'Receiving result... Try #{try_num}')
-        
-        response = send_soap_request(application_result_request, credentials)
 
-        if response.status_code != 200:
-            raise RuntimeError(f'Ошибка запроса при ожидании двухэтапного ответа ({response.status_code}): {response.reason}')
-        
-        result_xml = ET.fromstring(response.text)
+@shared_task
+def collect_application_result(handler_name: str, credentials_id: int, application_id: str, request_type: str, state: dict, submitted_at: float, last_poll_at: float = None, try_num: int = 0):
+    """Polls application once and re-arms itself until the application is completed"""
 
-        response_xml = result_xml.find('./soapenv:Body/apldef:receiveApplicationResultResponse', NAMESPACES)
+    try:
+        credentials = VetisCredentials.objects.get(id=credentials_id)
+    except ObjectDoesNotExist:
+        raise RuntimeError('Не обнаружены параметры подключения')
 
-        status = response_xml.find('apl:application/apl:status', NAMESPACES).text
+    print(f'Receiving result... Try #{try_num}')
+
+    status, response = receive_application_result(application_id, credentials)
+
+    if status != 'COMPLETED':
+        check_application_timeout(status, submitted_at)
+        now = time()
+        collect_application_result.apply_async(
+            kwargs={
+                'handler_name': handler_name,
+                'credentials_id': credentials_id,
+                'application_id': application_id,
+                'request_type': request_type,
+                'state': state,
+                'submitted_at': submitted_at,
+                'last_poll_at': now,
+                'try_num': try_num + 1,
+            },
+            countdown=get_poll_delay(request_type, now - submitted_at, try_num + 1)
+        )
+        return f'Ожидание результата обработки запроса (статус {status})'
 
-        print(f'Status: {status}')
+    record_processing_time(request_type, submitted_at, last_poll_at)
 
-        if status == 'COMPLETED':
-            return response
-        elif status == 'REJECTED':
-            raise RuntimeError('Запрос отклонен (REJECTED)')
+    handler = get_application_handler(handler_name)
 
-    raise RuntimeError(f'Таймаут ожидания результата обработки. Последний полученный статус запроса: {status}')
+    return handler(response, credentials, state)
 
 
 @shared_task(bind=True)
@@ -136,6 +126,9 @@ def test_task(this_task):
     return 'Тестовая задача завершена успешно'
 
 
+ENTERPRISE_FIELDS = ['business_entity', 'uuid', 'type', 'name', 'address', 'is_active', 'number_list']
+
+
 @shared_task
 def reload_enterprises(credentials_id: int, business_entity_id: int):
     try:
@@ -149,125 +142,217 @@ def reload_enterprises(credentials_id: int, business_entity_id: int):
         raise RuntimeError('Не обнаружены параметры подключения')
     
     list_count = 1000
-    list_offset = 0
 
-    with transaction.atomic():
+    # each page is committed with the checkpoint, a failed task resumes after the last committed page
+    checkpoint = start_checkpoint('reload_enterprises', business_entity.guid)
 
-        business_entity.enterprise_set.update(is_active=False)
+    while not is_checkpoint_done(checkpoint): # repeat if has pages
 
-        while True: # repeat if has pages
+        soap_request = ActivityLocationListRequest(business_entity.guid, list_count, checkpoint.list_offset)
 
-            soap_request = ActivityLocationListRequest(business_entity.guid, list_count, list_offset)
+        response = send_soap_request(soap_request, credentials)
 
-            response = send_soap_request(soap_request, credentials)
+        result_xml = ET.fromstring(response.content)
 
-            if response.status_code != 200:
-                raise RuntimeError(f'Ошибка запроса ({response.status_code}): {response.reason}')
-            
-            result_xml = ET.fromstring(response.text)
+        response_xml = result_xml.find('./soapenv:Body/ws:getActivityLocationListResponse/dt:activityLocationList', NAMESPACES)
 
-            response_xml = result_xml.find('./soapenv:Body/ws:getActivityLocationListResponse/dt:activityLocationList', NAMESPACES)
+        enterprises = []
 
-            for enterprise_xml in response_xml.findall('dt:location/dt:enterprise', NAMESPACES):
-                try:
-                    enterprise = Enterprise.objects.get(guid=enterprise_xml.find('bs:guid', NAMESPACES).text)
-                except:
-                    enterprise = Enterprise()
-                
-                enterprise.business_entity = business_entity
-                enterprise.guid = enterprise_xml.find('bs:guid', NAMESPACES).text
-                enterprise.uuid = enterprise_xml.find('bs:uuid', NAMESPACES).text
-                enterprise.type = int(enterprise_xml.find('dt:type', NAMESPACES).text)
-                enterprise.name = enterprise_xml.find('dt:name', NAMESPACES).text
-                enterprise.address = enterprise_xml.find('dt:address/dt:addressView', NAMESPACES).text
-                enterprise.is_active = enterprise_xml.find('bs:active', NAMESPACES).text == 'true'
+        for enterprise_xml in response_xml.findall('dt:location/dt:enterprise', NAMESPACES):
+            record = ENTERPRISE.extract(enterprise_xml)
 
-                enterprise_numbers = []
+            enterprise = Enterprise()
 
-                for enterprise_number in enterprise_xml.findall('dt:numberList/dt:enterpriseNumber', NAMESPACES):
-                    enterprise_numbers.append(enterprise_number.text)
+            enterprise.business_entity = business_entity
+            enterprise.guid = record.guid
+            enterprise.uuid = record.uuid
+            enterprise.type = record.type
+            enterprise.name = record.name
+            enterprise.address = record.address
+            enterprise.is_active = record.is_active
+            enterprise.number_list = ', '.join(record.numbers)
 
-                enterprise.number_list = ', '.join(enterprise_numbers)
+            enterprises.append(enterprise)
 
-                enterprise.save()
+        with transaction.atomic():
 
-            total = int(response_xml.get('total'))
-            
-            if total > list_offset + list_count:
-                list_offset += list_count
-            else:
-                break
+            # is_allowed and stock_entries_last_updated are ours, not Vetis data
+            upsert(enterprises, update_fields=ENTERPRISE_FIELDS)
+
+            dictionary_cache.invalidate(Enterprise)
+
+            advance_checkpoint(checkpoint, list_count, int(response_xml.get('total')), [enterprise.guid for enterprise in enterprises])
+
+        # /transaction.atomic
 
-        # /while
-    # /transaction.atomic
+    # /while
+
+    with transaction.atomic():
+        # enterprises missing from the list become inactive once the whole list is saved
+        deactivate_unseen(business_entity.enterprise_set.all(), checkpoint)
+        finish_checkpoint(checkpoint)
+
+    dictionary_cache.invalidate(Enterprise)
     
     return 'Предприятия хозяйствующего субъекта успешно обновлены.'
 
 
-def get_or_load_product_by_guid(credentials: VetisCredentials, product_guid: str, update: bool = False) -> Product:
+def fill_product_from_record(product: Product, record: ProductRecord):
+    product.guid = record.guid
+    product.uuid = record.uuid
+    product.name = record.name
+    if record.code is not None:
+        product.code = record.code
+    product.product_type = record.product_type
+
+
+def fill_product_from_xml(product: Product, product_xml: ET.Element):
+    fill_product_from_record(product, PRODUCT.extract(product_xml))
+
+
+def fill_subproduct_from_record(subproduct: SubProduct, record: SubProductRecord, credentials: VetisCredentials):
+    subproduct.guid = record.guid
+    subproduct.uuid = record.uuid
+    subproduct.name = record.name
+    if record.code is not None:
+        subproduct.code = record.code
+    subproduct.product_guid = record.product_guid
+
+    product = get_or_load_product_by_guid(credentials=credentials, product_guid=subproduct.product_guid)
+
+    subproduct.product = product
+
+
+def fill_subproduct_from_xml(subproduct: SubProduct, subproduct_xml: ET.Element, credentials: VetisCredentials):
+    fill_subproduct_from_record(subproduct, SUBPRODUCT.extract(subproduct_xml), credentials)
+
+
+def fill_product_item_from_record(product_item: ProductItem, record: ProductItemRecord, credentials: VetisCredentials, producer: BusinessEntity = None):
     """
-    Retrieves product from DB and loads from Vetis if not found.
-    If update == True updates existing record from Vetis.
+    Fills product item from PRODUCT_ITEM record. Producer is looked up by producer_guid unless given.
     """
 
-    try:
-        product = Product.objects.get(guid=product_guid)
-    except ObjectDoesNotExist:
-        product = None
+    product_item.guid = record.guid
+    product_item.uuid = record.uuid
+    product_item.is_active = record.is_active
+    if record.name is not None:
+        product_item.name = record.name
+    if record.gtin is not None:
+        product_item.gtin = record.gtin
+    product_item.product_type = record.product_type
+    product_item.product_guid = record.product_guid
+    product_item.product = get_or_load_product_by_guid(credentials=credentials, product_guid=product_item.product_guid)
+    product_item.subproduct_guid = record.subproduct_guid
+    product_item.subproduct = get_or_load_subproduct_by_guid(credentials=credentials, subproduct_guid=product_item.subproduct_guid)
+    if record.name is None:
+        product_item.name = product_item.subproduct.name
+    product_item.is_gost = record.is_gost
+    if product_item.is_gost:
+        product_item.gost = record.gost
+    if record.producer_guid is not None:
+        product_item.producer_guid = record.producer_guid
+    if producer is None:
+        producer = BusinessEntity.objects.filter(guid=product_item.producer_guid).first()
+    if producer is not None:
+        product_item.producer = producer
+
+
+def fill_product_item_from_xml(product_item: ProductItem, product_item_xml: ET.Element, credentials: VetisCredentials):
+    fill_product_item_from_record(product_item, PRODUCT_ITEM.extract(product_item_xml), credentials)
+
+
+def get_product_xml(response) -> ET.Element:
+    result_xml = ET.fromstring(response.content)
+    return result_xml.find('./soapenv:Body/ws:getProductByGuidResponse/dt:product', NAMESPACES)
+
+
+def get_subproduct_xml(response) -> ET.Element:
+    result_xml = ET.fromstring(response.content)
+    return result_xml.find('./soapenv:Body/ws:getSubProductByGuidResponse/dt:subProduct', NAMESPACES)
+
+
+def get_product_item_xml(response) -> ET.Element:
+    result_xml = ET.fromstring(response.content)
+    return result_xml.find('./soapenv:Body/ws:getProductItemByGuidResponse/dt:productItem', NAMESPACES)
+
+
+def save_dictionary_records(records: list[models.Model], update: bool = False) -> list[models.Model]:
+    """
+    Upserts dictionary records loaded from Vetis, the same record written concurrently
+    by another worker is overwritten instead of failing (see upsert).
+    update == True means the records are expected to be stored already: cached ones are invalidated.
+    """
+
+    records = upsert(records)
+
+    if update and records:
+        dictionary_cache.invalidate(records[0].__class__)
+
+    for record in records:
+        dictionary_cache.put(record)
+
+    return records
+
+
+def save_dictionary_record(record: models.Model, update: bool = False) -> models.Model:
+    return save_dictionary_records([record], update)[0]
+
+
+def coalesced_load(model: type[models.Model], request_class: type[AbstractRequest], guid: str, update: bool, load):
+    """
+    Returns stored record or runs load() once for all concurrent callers
+    asking for the same (request class, GUID), see SingleFlight.
+    Stored records are looked up in dictionary_cache first.
+    """
 
+    if not update:
+        record = dictionary_cache.get(model, guid)
+        if record is not None:
+            return record
+        record = model.objects.filter(guid=guid).first()
+        if record is not None:
+            dictionary_cache.put(record)
+            return record
+
+    record = dictionary_loads.do((request_class.__name__, str(guid).lower()), load)
+    if not update:
+        dictionary_cache.put(record)
+    return record
+
+
+def load_product_by_guid(credentials: VetisCredentials, product_guid: str, update: bool = False) -> Product:
+    # a stored record keeps values of elements Vetis leaves out, see fill_product_from_record
+    product = Product.objects.filter(guid=product_guid).first()
     if product is not None and not update:
         return product
 
     if product is None:
-        product = Product()        
+        product = Product()
 
     print(f'Loading product: {product_guid}')
 
     soap_request = ProductByGuidRequest(product_guid)
     response = send_soap_request(soap_request, credentials)
 
-    if response is None:
-        raise BadRequest()
-    
-    sleep(0.5)
-    
-    if response.status_code != 200:
-        raise BadRequest()
-    
-    result_xml = ET.fromstring(response.text)
-
-    product_xml = result_xml.find('./soapenv:Body/ws:getProductByGuidResponse/dt:product', NAMESPACES)
-
-    # guid
-    # uuid
-    # name
-    # code
-    # product_type
-
-    product.guid = product_xml.find('bs:guid', NAMESPACES).text
-    product.uuid = product_xml.find('bs:uuid', NAMESPACES).text
-    product.name = product_xml.find('dt:name', NAMESPACES).text
-    code_xml = product_xml.find('dt:code', NAMESPACES)
-    if code_xml is not None:
-        product.code = code_xml.text
-    product.product_type = int(product_xml.find('dt:productType', NAMESPACES).text)
+    fill_product_from_xml(product, get_product_xml(response))
 
-    product.save()
+    product = save_dictionary_record(product, update)
 
     return product
 
 
-def get_or_load_subproduct_by_guid(credentials: VetisCredentials, subproduct_guid: str, update: bool = False) -> SubProduct:
+def get_or_load_product_by_guid(credentials: VetisCredentials, product_guid: str, update: bool = False) -> Product:
     """
-    Retrieves subproduct from DB and loads from Vetis if not found.
+    Retrieves product from DB and loads from Vetis if not found.
     If update == True updates existing record from Vetis.
     """
 
-    try:
-        subproduct = SubProduct.objects.get(guid=subproduct_guid)
-    except ObjectDoesNotExist:
-        subproduct = None  
+    return coalesced_load(Product, ProductByGuidRequest, product_guid, update, lambda: load_product_by_guid(credentials, product_guid, update))
+
 
+def load_subproduct_by_guid(credentials: VetisCredentials, subproduct_guid: str, update: bool = False) -> SubProduct:
+    # a stored record keeps values of elements Vetis leaves out, see fill_subproduct_from_record
+    subproduct = SubProduct.objects.filter(guid=subproduct_guid).first()
     if subproduct is not None and not update:
         return subproduct
 
@@ -279,199 +364,231 @@ def get_or_load_subproduct_by_guid(credentials: VetisCredentials, subproduct_gui
     soap_request = SubproductByGuidRequest(subproduct_guid)
     response = send_soap_request(soap_request, credentials)
 
-    if response is None:
-        raise BadRequest()
-    
-    sleep(0.5)
-    
-    if response.status_code != 200:
-        raise BadRequest()
-    
-    result_xml = ET.fromstring(response.text)
+    fill_subproduct_from_xml(subproduct, get_subproduct_xml(response), credentials)
 
-    subproduct_xml = result_xml.find('./soapenv:Body/ws:getSubProductByGuidResponse/dt:subProduct', NAMESPACES)
-
-    # guid
-    # uuid
-    # name
-    # code
-    # product_guid
-    # product
-
-    subproduct.guid = subproduct_xml.find('bs:guid', NAMESPACES).text
-    subproduct.uuid = subproduct_xml.find('bs:uuid', NAMESPACES).text
-    subproduct.name = subproduct_xml.find('dt:name', NAMESPACES).text
-    code_xml = subproduct_xml.find('dt:code', NAMESPACES)
-    if code_xml is not None:
-        subproduct.code = code_xml.text
-    subproduct.product_guid = subproduct_xml.find('dt:productGuid', NAMESPACES).text
-
-    product = get_or_load_product_by_guid(credentials=credentials, product_guid=subproduct.product_guid)
-
-    subproduct.product = product
-
-    subproduct.save()
+    subproduct = save_dictionary_record(subproduct, update)
 
     return subproduct
 
 
-def get_or_load_product_item_by_guid(credentials: VetisCredentials, product_item_guid: str, update: bool = False) -> ProductItem:
+def get_or_load_subproduct_by_guid(credentials: VetisCredentials, subproduct_guid: str, update: bool = False) -> SubProduct:
     """
-    Retrieves product item from DB and loads from Vetis if not found.
+    Retrieves subproduct from DB and loads from Vetis if not found.
     If update == True updates existing record from Vetis.
     """
 
-    try:
-        product_item = ProductItem.objects.get(guid=product_item_guid)
-    except ObjectDoesNotExist:
-        product_item = None
+    return coalesced_load(SubProduct, SubproductByGuidRequest, subproduct_guid, update, lambda: load_subproduct_by_guid(credentials, subproduct_guid, update))
+
 
+def load_product_item_by_guid(credentials: VetisCredentials, product_item_guid: str, update: bool = False) -> ProductItem:
+    # a stored record keeps values of elements Vetis leaves out, see fill_product_item_from_record
+    product_item = ProductItem.objects.filter(guid=product_item_guid).first()
     if product_item is not None and not update:
         return product_item
 
     if product_item is None:
-        product_item = ProductItem()        
+        product_item = ProductItem()
 
     print(f'Loading product item: {product_item_guid}')
 
     soap_request = ProductItemByGuidRequest(product_item_guid)
     response = send_soap_request(soap_request, credentials)
 
-    if response is None:
-        raise BadRequest()
-    
-    sleep(0.5)
-    
-    if response.status_code != 200:
-        raise BadRequest()
-    
-    result_xml = ET.fromstring(response.text)
+    fill_product_item_from_xml(product_item, get_product_item_xml(response), credentials)
 
-    product_item_xml = result_xml.find('./soapenv:Body/ws:getProductItemByGuidResponse/dt:productItem', NAMESPACES)
+    product_item = save_dictionary_record(product_item, update)
 
-    # guid
-    # uuid
-    # is_active
-    # name
-    # gtin
-    # product_type
-    # product_guid
-    # product
-    # subproduct_guid
-    # subproduct
-    # is_gost
-    # gost
-    # producer_guid
-    # producer
-
-    product_item.guid = product_item_xml.find('bs:guid', NAMESPACES).text
-    product_item.uuid = product_item_xml.find('bs:uuid', NAMESPACES).text
-    product_item.is_active = product_item_xml.find('bs:active', NAMESPACES).text == 'true'
-    name_xml = product_item_xml.find('dt:name', NAMESPACES)
-    if name_xml is not None:
-        product_item.name = name_xml.text
-    globalID_xml = product_item_xml.find('dt:globalID', NAMESPACES)
-    if globalID_xml is not None:
-        product_item.gtin = globalID_xml.text
-    product_item.product_type = int(product_item_xml.find('dt:productType', NAMESPACES).text)
-    product_item.product_guid = product_item_xml.find('dt:product/bs:guid', NAMESPACES).text
-    product_item.product = get_or_load_product_by_guid(credentials=credentials, product_guid=product_item.product_guid)
-    product_item.subproduct_guid = product_item_xml.find('dt:subProduct/bs:guid', NAMESPACES).text
-    product_item.subproduct = get_or_load_subproduct_by_guid(credentials=credentials, subproduct_guid=product_item.subproduct_guid)
-    if name_xml is None:
-        product_item.name = product_item.subproduct.name
-    product_item.is_gost = product_item_xml.find('dt:correspondsToGost', NAMESPACES).text == 'true'
-    if product_item.is_gost:
-        product_item.gost = product_item_xml.find('dt:gost', NAMESPACES).text
-    producer_guid_xml = product_item_xml.find('dt:producer/bs:guid', NAMESPACES)
-    if producer_guid_xml is not None:
-        product_item.producer_guid = producer_guid_xml.text
-    producer = BusinessEntity.objects.filter(guid=product_item.producer_guid).first()
-    if producer is not None:
-        product_item.producer = producer
+    return product_item
 
-    product_item.save()
 
-    return product_item
+def get_or_load_product_item_by_guid(credentials: VetisCredentials, product_item_guid: str, update: bool = False) -> ProductItem:
+    """
+    Retrieves product item from DB and loads from Vetis if not found.
+    If update == True updates existing record from Vetis.
+    """
 
+    return coalesced_load(ProductItem, ProductItemByGuidRequest, product_item_guid, update, lambda: load_product_item_by_guid(credentials, product_item_guid, update))
 
-def get_or_load_business_entity_info_by_guid(credentials: VetisCredentials, business_entity_guid: str, update: bool = False) -> BusinessEntityInfo:
-    try:
-        be_info = BusinessEntityInfo.objects.get(guid=business_entity_guid)
-    except ObjectDoesNotExist:
-        be_info = None
 
-    if be_info is not None and not update:
-        return be_info
+def load_dictionaries_by_guids(credentials: VetisCredentials, product_guids=(), subproduct_guids=(), product_item_guids=(), concurrency: int = None):
+    """
+    Loads missing products, subproducts and product items from Vetis.
+    Requests for records that are not in DB yet run concurrently (see send_soap_requests),
+    already stored records are not requested at all.
+    Records being loaded by another worker at the same time are not requested again:
+    they are waited for after the batch is saved.
+    """
+
+    claimed_locks = []
+    deferred_loads = []
+
+    def missing(model, request_class, guids, get_or_load) -> list[str]:
+        guids = {str(guid).lower() for guid in guids if guid}
+        existing = get_by_guids(model, guids).keys()
+        result = []
+        for guid in sorted(guids - existing):
+            lock = dictionary_loads.claim((request_class.__name__, guid))
+            if lock is not None:
+                claimed_locks.append(lock)
+                result.append(guid)
+            else:
+                deferred_loads.append((get_or_load, guid))
+        return result
+
+    product_guids = set(product_guids)
+    subproduct_guids = set(subproduct_guids)
 
-    if be_info is None:
-        be_info = BusinessEntityInfo()
+    try:
+        # product items first: they reference products and subproducts
+
+        product_item_records = []
+        missing_product_item_guids = missing(ProductItem, ProductItemByGuidRequest, product_item_guids, get_or_load_product_item_by_guid)
+        if missing_product_item_guids:
+            print(f'Loading product items: {len(missing_product_item_guids)}')
+            responses = send_soap_requests([ProductItemByGuidRequest(guid) for guid in missing_product_item_guids], credentials, concurrency)
+            for response in responses:
+                record = PRODUCT_ITEM.extract(get_product_item_xml(response))
+                product_item_records.append(record)
+                product_guids.add(record.product_guid)
+                subproduct_guids.add(record.subproduct_guid)
+
+        # subproducts and products in one batch
+
+        missing_subproduct_guids = missing(SubProduct, SubproductByGuidRequest, subproduct_guids, get_or_load_subproduct_by_guid)
+        missing_product_guids = missing(Product, ProductByGuidRequest, product_guids, get_or_load_product_by_guid)
+        soap_requests = [SubproductByGuidRequest(guid) for guid in missing_subproduct_guids] + [ProductByGuidRequest(guid) for guid in missing_product_guids]
+        if soap_requests:
+            print(f'Loading subproducts: {len(missing_subproduct_guids)}, products: {len(missing_product_guids)}')
+        responses = send_soap_requests(soap_requests, credentials, concurrency)
+        subproduct_records = [SUBPRODUCT.extract(get_subproduct_xml(response)) for response in responses[:len(missing_subproduct_guids)]]
+        product_records = [PRODUCT.extract(get_product_xml(response)) for response in responses[len(missing_subproduct_guids):]]
+
+        # products referenced only by loaded subproducts
+
+        loaded_product_guids = {str(guid).lower() for guid in product_guids}
+        missing_product_guids = missing(Product, ProductByGuidRequest, {record.product_guid for record in subproduct_records} - loaded_product_guids, get_or_load_product_by_guid)
+        responses = send_soap_requests([ProductByGuidRequest(guid) for guid in missing_product_guids], credentials, concurrency)
+        product_records += [PRODUCT.extract(get_product_xml(response)) for response in responses]
+
+        # save in dependency order
+
+        products = []
+        for record in product_records:
+            product = Product()
+            fill_product_from_record(product, record)
+            products.append(product)
+        save_dictionary_records(products)
+
+        subproducts = []
+        for record in subproduct_records:
+            subproduct = SubProduct()
+            fill_subproduct_from_record(subproduct, record, credentials)
+            subproducts.append(subproduct)
+        save_dictionary_records(subproducts)
+
+        product_items = []
+        for record in product_item_records:
+            product_item = ProductItem()
+            fill_product_item_from_record(product_item, record, credentials)
+            product_items.append(product_item)
+        save_dictionary_records(product_items)
+    except Exception:
+        for lock in claimed_locks:
+            lock.release()
+        raise
+
+    # other workers find the records in DB once they are committed with the page
+    dictionary_loads.release_on_commit(claimed_locks)
+
+    # loaded by other workers meanwhile, found in DB after their pages are committed
+    for get_or_load, guid in deferred_loads:
+        get_or_load(credentials, guid)
+
+
+def preload_stock_entries_dictionaries(credentials: VetisCredentials, stock_entry_records: list[StockEntryRecord]):
+    """Loads dictionaries referenced by a page of stock entries before the entries are filled."""
+
+    load_dictionaries_by_guids(
+        credentials=credentials,
+        product_guids={record.product_guid for record in stock_entry_records},
+        subproduct_guids={record.subproduct_guid for record in stock_entry_records},
+        product_item_guids={record.product_item_guid for record in stock_entry_records if record.product_item_guid is not None}
+    )
+
+
+def load_business_entity_info_by_guid(credentials: VetisCredentials, business_entity_guid: str, update: bool = False) -> BusinessEntityInfo:
+    if not update:
+        be_info = BusinessEntityInfo.objects.filter(guid=business_entity_guid).first()
+        if be_info is not None:
+            return be_info
+
+    be_info = BusinessEntityInfo()
 
     print(f'Loading business entity info: {business_entity_guid}')
     
     soap_request = BusinessEntityByGuidRequest(business_entity_guid)
     response = send_soap_request(soap_request, credentials)
 
-    result_xml = ET.fromstring(response.text)
+    result_xml = ET.fromstring(response.content)
 
     business_entity_xml = result_xml.find('./soapenv:Body/ws:getBusinessEntityByGuidResponse/dt:businessEntity', NAMESPACES)
 
+    record = BUSINESS_ENTITY.extract(business_entity_xml)
+
     be_info.guid = business_entity_guid
-    be_info.uuid = business_entity_xml.find('bs:uuid', NAMESPACES).text
-
-    name_xml = business_entity_xml.find('dt:name', NAMESPACES)
-    if name_xml is None:
-        name_xml = business_entity_xml.find('dt:fullName', NAMESPACES)
-    if name_xml is None:
-        name_xml = business_entity_xml.find('dt:fio', NAMESPACES)
-    if name_xml is None:
-        be_info.name = str(business_entity_guid)
-    else:
-        be_info.name = name_xml.text
+    be_info.uuid = record.uuid
+
+    for name in (record.name, record.full_name, record.fio, str(business_entity_guid)):
+        if name is not None:
+            be_info.name = name
+            break
 
-    inn_xml = business_entity_xml.find('dt:inn', NAMESPACES)
-    if inn_xml is not None:
-        be_info.inn = inn_xml.text
+    if record.inn is not None:
+        be_info.inn = record.inn
     
-    be_info.save()
+    be_info = save_dictionary_record(be_info, update)
 
     return be_info
 
 
-def get_or_load_enterprise_info_by_guid(credentials: VetisCredentials, enterprise_guid: str, update: bool = False) -> EnterpriseInfo:
-    try:
-        ent_info = EnterpriseInfo.objects.get(guid=enterprise_guid)
-    except ObjectDoesNotExist:
-        ent_info = None
+def get_or_load_business_entity_info_by_guid(credentials: VetisCredentials, business_entity_guid: str, update: bool = False) -> BusinessEntityInfo:
+    return coalesced_load(BusinessEntityInfo, BusinessEntityByGuidRequest, business_entity_guid, update, lambda: load_business_entity_info_by_guid(credentials, business_entity_guid, update))
+
 
-    if ent_info is not None and not update:
-        return ent_info
+def load_enterprise_info_by_guid(credentials: VetisCredentials, enterprise_guid: str, update: bool = False) -> EnterpriseInfo:
+    if not update:
+        ent_info = EnterpriseInfo.objects.filter(guid=enterprise_guid).first()
+        if ent_info is not None:
+            return ent_info
 
-    if ent_info is None:
-        ent_info = EnterpriseInfo()
+    ent_info = EnterpriseInfo()
     
     print(f'Loading enterprise info: {enterprise_guid}')
 
     soap_request = EnterpriseByGuidRequest(enterprise_guid)
     response = send_soap_request(soap_request, credentials)
 
-    result_xml = ET.fromstring(response.text)
+    result_xml = ET.fromstring(response.content)
 
     enterprise_xml = result_xml.find('./soapenv:Body/ws:getEnterpriseByGuidResponse/dt:enterprise', NAMESPACES)
 
+    record = ENTERPRISE.extract(enterprise_xml)
+
     ent_info.guid = enterprise_guid
-    ent_info.uuid = enterprise_xml.find('bs:uuid', NAMESPACES).text
-    name_xml = enterprise_xml.find('dt:name', NAMESPACES)
-    ent_info.name = name_xml.text
-    address_xml = enterprise_xml.find('dt:address/dt:addressView', NAMESPACES)
-    if address_xml is not None:
-        ent_info.address = address_xml.text
+    ent_info.uuid = record.uuid
+    ent_info.name = record.name
+    if record.address is not None:
+        ent_info.address = record.address
     
-    ent_info.save()
+    ent_info = save_dictionary_record(ent_info, update)
 
     return ent_info
 
 
+def get_or_load_enterprise_info_by_guid(credentials: VetisCredentials, enterprise_guid: str, update: bool = False) -> EnterpriseInfo:
+    return coalesced_load(EnterpriseInfo, EnterpriseByGuidRequest, enterprise_guid, update, lambda: load_enterprise_info_by_guid(credentials, enterprise_guid, update))
+
+
 @shared_task
 def reload_product_subproduct(credentials_id: int):
     """Update existing product and subproduct records form Vetis"""
@@ -490,6 +607,18 @@ def reload_product_subproduct(credentials_id: int):
     return 'Списки продукция и вид продукции обновлены.'
 
 
+def is_product_item_unchanged(product_item: ProductItem | None, producer: BusinessEntity, record: ProductItemRecord) -> bool:
+    """Stored version is the same as received one and its references are resolved"""
+
+    return (
+        product_item is not None
+        and str(product_item.uuid) == record.uuid.lower()
+        and product_item.producer_id == producer.id
+        and product_item.product_id is not None
+        and product_item.subproduct_id is not None
+    )
+
+
 @shared_task
 def reload_product_items(credentials_id: int, business_entity_id: int):
     try:
@@ -503,100 +632,187 @@ def reload_product_items(credentials_id: int, business_entity_id: int):
         raise RuntimeError('Не обнаружены параметры подключения')
     
     list_count = 1000
-    list_offset = 0
 
-    with transaction.atomic():
+    # each page is committed with the checkpoint, a failed task resumes after the last committed page
+    checkpoint = start_checkpoint('reload_product_items', business_entity.guid)
 
-        ProductItem.objects.filter(producer_guid=business_entity.guid).update(is_active=False)
+    while not is_checkpoint_done(checkpoint): # repeat if has pages
 
-        while True: # repeat if has pages
+        print(f'reload_product_items: list_offset={checkpoint.list_offset}')
 
-            print(f'reload_product_items: list_offset={list_offset}')
+        soap_request = ProductItemListRequest(business_entity.guid, list_count, checkpoint.list_offset)
 
-            soap_request = ProductItemListRequest(business_entity.guid, list_count, list_offset)
+        response = send_soap_request(soap_request, credentials)
 
-            response = send_soap_request(soap_request, credentials)
+        result_xml = ET.fromstring(response.content)
 
-            if response.status_code != 200:
-                raise RuntimeError(f'Ошибка запроса ({response.status_code}): {response.reason}')
-            
-            result_xml = ET.fromstring(response.text)
+        response_xml = result_xml.find('./soapenv:Body/ws:getProductItemListResponse/dt:productItemList', NAMESPACES)
 
-            response_xml = result_xml.find('./soapenv:Body/ws:getProductItemListResponse/dt:productItemList', NAMESPACES)
+        product_item_records = PRODUCT_ITEM.extract_all(response_xml.findall('dt:productItem', NAMESPACES))
 
-            for product_item_xml in response_xml.findall('dt:productItem', NAMESPACES):
-                try:
-                    product_item = ProductItem.objects.get(guid=product_item_xml.find('bs:guid', NAMESPACES).text)
-                except:
+        with transaction.atomic():
+
+            product_items = {
+                str(product_item.guid): product_item
+                for product_item in ProductItem.objects.filter(guid__in=[record.guid for record in product_item_records])
+            }
+
+            active_guids = []
+            changed_product_items = []
+
+            for record in product_item_records:
+                product_item = product_items.get(record.guid.lower())
+
+                if is_product_item_unchanged(product_item, business_entity, record):
+                    if record.is_active and not product_item.is_active:
+                        active_guids.append(product_item.guid)
+                    continue
+
+                if product_item is None:
                     product_item = ProductItem()
 
-                # guid
-                # uuid
-                # is_active
-                # name
-                # gtin
-                # product_type
-                # product_guid
-                # product
-                # subproduct_guid
-                # subproduct
-                # is_gost
-                # gost
-                # producer_guid
-                # producer
-
-                product_item.guid = product_item_xml.find('bs:guid', NAMESPACES).text
-                product_item.uuid = product_item_xml.find('bs:uuid', NAMESPACES).text
-                product_item.is_active = product_item_xml.find('bs:active', NAMESPACES).text == 'true'
-                name_xml = product_item_xml.find('dt:name', NAMESPACES)
-                if name_xml is not None:
-                    product_item.name = name_xml.text
-                globalID_xml = product_item_xml.find('dt:globalID', NAMESPACES)
-                if globalID_xml is not None:
-                    product_item.gtin = globalID_xml.text
-                product_item.product_type = int(product_item_xml.find('dt:productType', NAMESPACES).text)
-                product_item.product_guid = product_item_xml.find('dt:product/bs:guid', NAMESPACES).text
-                product_item.product = get_or_load_product_by_guid(credentials=credentials, product_guid=product_item.product_guid)
-                product_item.subproduct_guid = product_item_xml.find('dt:subProduct/bs:guid', NAMESPACES).text
-                product_item.subproduct = get_or_load_subproduct_by_guid(credentials=credentials, subproduct_guid=product_item.subproduct_guid)
-                if name_xml is None:
-                    product_item.name = product_item.subproduct.name
-                product_item.is_gost = product_item_xml.find('dt:correspondsToGost', NAMESPACES).text == 'true'
-                if product_item.is_gost:
-                    product_item.gost = product_item_xml.find('dt:gost', NAMESPACES).text
-                producer_guid_xml = product_item_xml.find('dt:producer/bs:guid', NAMESPACES)
-                if producer_guid_xml is not None:
-                    product_item.producer_guid = producer_guid_xml.text
-                product_item.producer = business_entity
-
-                product_item.save()
-
-            total = int(response_xml.get('total'))
-            
-            if total > list_offset + list_count:
-                list_offset += list_count
-                sleep(1.0)
-            else:
-                break
-        # /while
-    # /transaction.atomic
+                fill_product_item_from_record(product_item, record, credentials, producer=business_entity)
+
+                changed_product_items.append(product_item)
+
+            upsert(changed_product_items)
+
+            # unchanged items deactivated by an earlier sync they were missing from
+            ProductItem.objects.filter(guid__in=active_guids).update(is_active=True)
+
+            dictionary_cache.invalidate(ProductItem)
+
+            advance_checkpoint(checkpoint, list_count, int(response_xml.get('total')), [record.guid for record in product_item_records])
+
+        # /transaction.atomic
+
+    # /while
+
 
     # fill product ids
-    for product_item in ProductItem.objects.filter(product__isnull=True):
+    product_items = list(ProductItem.objects.filter(product__isnull=True))
+    for product_item in product_items:
         product = get_or_load_product_by_guid(credentials=credentials, product_guid=product_item.product_guid)
         product_item.product = product
-        product_item.save()
+    ProductItem.objects.bulk_update(product_items, ['product'], batch_size=BULK_BATCH_SIZE)
 
     # fill subproduct ids
-    for product_item in ProductItem.objects.filter(subproduct__isnull=True):
+    product_items = list(ProductItem.objects.filter(subproduct__isnull=True))
+    for product_item in product_items:
         subproduct = get_or_load_subproduct_by_guid(credentials=credentials, subproduct_guid=product_item.subproduct_guid)
         product_item.subproduct = subproduct
-        product_item.save()
+    ProductItem.objects.bulk_update(product_items, ['subproduct'], batch_size=BULK_BATCH_SIZE)
 
-    return f'Список продукции обновлен. Всего: {total}'
+    # a task failed above resumes here, all pages are committed
+    with transaction.atomic():
+        # items missing from the list become inactive once the whole list is saved
+        deactivate_unseen(ProductItem.objects.filter(producer_guid=business_entity.guid), checkpoint)
+        finish_checkpoint(checkpoint)
 
+    dictionary_cache.invalidate(ProductItem)
+
+    return f'Список продукции обновлен. Всего: {checkpoint.total}'
 
-def fill_stock_entry_from_xml(stock_entry: StockEntry, enterprise: Enterprise, stock_entry_xml: ET.Element, credentials: VetisCredentials):
+
+STOCK_ENTRY_FIELDS = [
+    'main', 'enterprise', 'guid', 'is_active', 'is_last', 'status', 'date_created', 'date_updated',
+    'previous_uuid', 'next_uuid', 'entry_number', 'product_type', 'product_guid', 'product',
+    'subproduct_guid', 'subproduct', 'product_item_guid', 'product_item_name', 'product_item',
+    'volume', 'unit', 'date_produced_1', 'date_produced_2', 'date_produced', 'date_expiry_1',
+    'date_expiry_2', 'date_expiry', 'is_perishable', 'origin_country', 'producer_name',
+    'producer_guid', 'producer',
+]
+
+BULK_BATCH_SIZE = 500
+
+
+def get_by_guids(model: type[models.Model], guids) -> dict[str, models.Model]:
+    """
+    Returns records with given GUIDs, keyed by lowercase GUID string.
+    Dictionary records are taken from dictionary_cache, the rest are fetched in one query.
+    """
+
+    guids = {str(guid).lower() for guid in guids if guid}
+    result = dictionary_cache.get_many(model, guids)
+    missing_guids = guids - result.keys()
+    if missing_guids:
+        for record in model.objects.filter(guid__in=missing_guids):
+            dictionary_cache.put(record)
+            result[str(record.guid)] = record
+    return result
+
+
+class StockEntryReferences:
+    """
+    Records referenced by a batch of stock entries, loaded with one query per model.
+    Missing StockEntryMain, Unit and PackingType rows are created in bulk. Dictionaries are expected
+    to be preloaded (see preload_stock_entries_dictionaries), the rare ones missing
+    are loaded from Vetis one by one.
+    """
+
+    def __init__(self, records: list[StockEntryRecord], credentials: VetisCredentials):
+        self.credentials = credentials
+
+        self.mains = get_by_guids(StockEntryMain, {record.guid.lower() for record in records})
+        missing_mains = {record.guid.lower() for record in records} - self.mains.keys()
+        if missing_mains:
+            # ignore_conflicts: the same main record may be created by a concurrent worker
+            StockEntryMain.objects.bulk_create([StockEntryMain(guid=guid) for guid in missing_mains], ignore_conflicts=True, batch_size=BULK_BATCH_SIZE)
+            self.mains.update(get_by_guids(StockEntryMain, missing_mains))
+
+        self.units = get_by_guids(Unit, {record.unit_guid.lower() for record in records})
+        missing_units = {record.unit_guid.lower(): record.unit_name for record in records if record.unit_guid.lower() not in self.units}
+        if missing_units:
+            for unit in upsert([Unit(guid=guid, name=name) for guid, name in missing_units.items()], KEEP_STORED):
+                dictionary_cache.put(unit)
+                self.units[str(unit.guid).lower()] = unit
+
+        package_records = [package_record for record in records for package_record in record.packages]
+        self.packing_types = get_by_guids(PackingType, {package_record.packing_type_guid.lower() for package_record in package_records})
+        missing_packing_types = {
+            package_record.packing_type_guid.lower(): package_record
+            for package_record in package_records
+            if package_record.packing_type_guid.lower() not in self.packing_types
+        }
+        if missing_packing_types:
+            for packing_type in upsert([
+                PackingType(
+                    guid=guid,
+                    uuid=package_record.packing_type_uuid,
+                    name=package_record.packing_type_name,
+                    global_id=package_record.packing_type_global_id
+                )
+                for guid, package_record in missing_packing_types.items()
+            ], KEEP_STORED):
+                dictionary_cache.put(packing_type)
+                self.packing_types[str(packing_type.guid).lower()] = packing_type
+
+        self.products = get_by_guids(Product, {record.product_guid for record in records})
+        self.subproducts = get_by_guids(SubProduct, {record.subproduct_guid for record in records})
+        self.product_items = get_by_guids(ProductItem, {record.product_item_guid for record in records if record.product_item_guid is not None})
+        self.producers = get_by_guids(Enterprise, {record.producer_guid for record in records if record.producer_guid is not None})
+
+    def product(self, guid: str) -> Product:
+        product = self.products.get(guid.lower())
+        if product is None:
+            product = self.products[guid.lower()] = get_or_load_product_by_guid(credentials=self.credentials, product_guid=guid)
+        return product
+
+    def subproduct(self, guid: str) -> SubProduct:
+        subproduct = self.subproducts.get(guid.lower())
+        if subproduct is None:
+            subproduct = self.subproducts[guid.lower()] = get_or_load_subproduct_by_guid(credentials=self.credentials, subproduct_guid=guid)
+        return subproduct
+
+    def product_item(self, guid: str) -> ProductItem:
+        product_item = self.product_items.get(guid.lower())
+        if product_item is None:
+            product_item = self.product_items[guid.lower()] = get_or_load_product_item_by_guid(credentials=self.credentials, product_item_guid=guid)
+        return product_item
+
+
+def set_stock_entry_fields(stock_entry: StockEntry, enterprise: Enterprise, record: StockEntryRecord, references: StockEntryReferences):
+    """Fills stock entry from record without queries, references are taken from the batch"""
 
     # main
     # enterprise
@@ -604,9 +820,9 @@ def fill_stock_entry_from_xml(stock_entry: StockEntry, enterprise: Enterprise, s
     # uuid
 
     stock_entry.enterprise = enterprise
-    stock_entry.guid = stock_entry_xml.find('bs:guid', NAMESPACES).text
-    stock_entry.uuid = stock_entry_xml.find('bs:uuid', NAMESPACES).text
-    stock_entry.main, main_created = StockEntryMain.objects.get_or_create(guid=stock_entry.guid)
+    stock_entry.guid = record.guid
+    stock_entry.uuid = record.uuid
+    stock_entry.main = references.mains[record.guid.lower()]
 
     # is_active
     # is_last
@@ -617,187 +833,381 @@ def fill_stock_entry_from_xml(stock_entry: StockEntry, enterprise: Enterprise, s
     # next_uuid
     # entry_number
 
-    stock_entry.is_active = stock_entry_xml.find('bs:active', NAMESPACES).text == 'true'
-    stock_entry.is_last = stock_entry_xml.find('bs:last', NAMESPACES).text == 'true'
-    stock_entry.status = int(stock_entry_xml.find('bs:status', NAMESPACES).text)
-    stock_entry.date_created = datetime.fromisoformat(stock_entry_xml.find('bs:createDate', NAMESPACES).text)
-    stock_entry.date_updated = datetime.fromisoformat(stock_entry_xml.find('bs:updateDate', NAMESPACES).text)
-    previous_uuid_xml = stock_entry_xml.find('bs:previous', NAMESPACES)
-    if previous_uuid_xml is not None:
-        stock_entry.previous_uuid = previous_uuid_xml.text
-    next_uuid_xml = stock_entry_xml.find('bs:next', NAMESPACES)
-    if next_uuid_xml is not None:
-        stock_entry.next_uuid = next_uuid_xml.text
-    stock_entry.entry_number = stock_entry_xml.find('vd:entryNumber', NAMESPACES).text
-
-    batch_xml = stock_entry_xml.find('vd:batch', NAMESPACES)
-    
+    stock_entry.is_active = record.is_active
+    stock_entry.is_last = record.is_last
+    stock_entry.status = record.status
+    stock_entry.date_created = record.date_created
+    stock_entry.date_updated = record.date_updated
+    if record.previous_uuid is not None:
+        stock_entry.previous_uuid = record.previous_uuid
+    if record.next_uuid is not None:
+        stock_entry.next_uuid = record.next_uuid
+    stock_entry.entry_number = record.entry_number
+
     # product_type
     # product_guid
     # product
     # subproduct_guid
     # subproduct
 
-    stock_entry.product_type = int(batch_xml.find('vd:productType', NAMESPACES).text)
-    stock_entry.product_guid = batch_xml.find('vd:product/bs:guid', NAMESPACES).text
-    stock_entry.product = get_or_load_product_by_guid(credentials=credentials, product_guid=stock_entry.product_guid)
-    stock_entry.subproduct_guid = batch_xml.find('vd:subProduct/bs:guid', NAMESPACES).text
-    stock_entry.subproduct = get_or_load_subproduct_by_guid(credentials=credentials, subproduct_guid=stock_entry.subproduct_guid)
-    
+    stock_entry.product_type = record.product_type
+    stock_entry.product_guid = record.product_guid
+    stock_entry.product = references.product(record.product_guid)
+    stock_entry.subproduct_guid = record.subproduct_guid
+    stock_entry.subproduct = references.subproduct(record.subproduct_guid)
+
     # product_item_guid
     # product_item_name
     # product_item
 
-    stock_entry.product_item_name = batch_xml.find('vd:productItem/dt:name', NAMESPACES).text
-    product_item_guid_xml = batch_xml.find('vd:productItem/bs:guid', NAMESPACES)
-    if product_item_guid_xml is not None:
-        stock_entry.product_item_guid = product_item_guid_xml.text
-        stock_entry.product_item = get_or_load_product_item_by_guid(credentials=credentials, product_item_guid=stock_entry.product_item_guid)
+    stock_entry.product_item_name = record.product_item_name
+    if record.product_item_guid is not None:
+        stock_entry.product_item_guid = record.product_item_guid
+        stock_entry.product_item = references.product_item(record.product_item_guid)
 
     # volume
 
     if stock_entry.status in [201]:  # запись аннулирована
         stock_entry.volume = 0
     else:
-        stock_entry.volume = Decimal(batch_xml.find('vd:volume', NAMESPACES).text)
+        stock_entry.volume = record.volume
 
     # unit
-    
-    unit_guid = batch_xml.find('vd:unit/bs:guid', NAMESPACES).text
-    unit_name = batch_xml.find('vd:unit/dt:name', NAMESPACES).text
 
-    stock_entry.unit = Unit.get_or_create(guid=unit_guid, name=unit_name)
-    
+    stock_entry.unit = references.units[record.unit_guid.lower()]
+
     # date_produced_1
     # date_produced_2
     # date_produced
-
-    date_produced_1_xml = batch_xml.find('vd:dateOfProduction/vd:firstDate', NAMESPACES)
-    year = int(date_produced_1_xml.find('dt:year', NAMESPACES).text)
-    month = int(date_produced_1_xml.find('dt:month', NAMESPACES).text)
-    date_produced_1 = ComplexDate(year=year, month=month)
-    day_xml = date_produced_1_xml.find('dt:day', NAMESPACES)
-    if day_xml is not None:
-        date_produced_1.update('day', int(day_xml.text))
-        hour_xml = date_produced_1_xml.find('dt:hour', NAMESPACES)
-        if hour_xml is not None:
-            date_produced_1.update('hour', int(hour_xml.text))
-    stock_entry.date_produced_1 = date_produced_1.to_string()
-
-    stock_entry.date_produced = date_produced_1.to_datetime()
-
-    date_produced_2_xml = batch_xml.find('vd:dateOfProduction/vd:secondDate', NAMESPACES)
-    if date_produced_2_xml is not None:
-        year = int(date_produced_2_xml.find('dt:year', NAMESPACES).text)
-        month = int(date_produced_2_xml.find('dt:month', NAMESPACES).text)
-        date_produced_2 = ComplexDate(year=year, month=month)
-        day_xml = date_produced_2_xml.find('dt:day', NAMESPACES)
-        if day_xml is not None:
-            date_produced_2.update('day', int(day_xml.text))
-            hour_xml = date_produced_2_xml.find('dt:hour', NAMESPACES)
-            if hour_xml is not None:
-                date_produced_2.update('hour', int(hour_xml.text))
-        stock_entry.date_produced_2 = date_produced_2.to_string()
-
     # date_expiry_1
     # date_expiry_2
     # date_expiry
 
-    date_expiry_1_xml = batch_xml.find('vd:expiryDate/vd:firstDate', NAMESPACES)
-    year = int(date_expiry_1_xml.find('dt:year', NAMESPACES).text)
-    month = int(date_expiry_1_xml.find('dt:month', NAMESPACES).text)
-    date_expiry_1 = ComplexDate(year=year, month=month)
-    day_xml = date_expiry_1_xml.find('dt:day', NAMESPACES)
-    if day_xml is not None:
-        date_expiry_1.update('day', int(day_xml.text))
-        hour_xml = date_expiry_1_xml.find('dt:hour', NAMESPACES)
-        if hour_xml is not None:
-            date_expiry_1.update('hour', int(hour_xml.text))
-    stock_entry.date_expiry_1 = date_expiry_1.to_string()
-
-    stock_entry.date_expiry = date_expiry_1.to_datetime()
-
-    date_expiry_2_xml = batch_xml.find('vd:expiryDate/vd:secondDate', NAMESPACES)
-    if date_expiry_2_xml is not None:
-        year = int(date_expiry_2_xml.find('dt:year', NAMESPACES).text)
-        month = int(date_expiry_2_xml.find('dt:month', NAMESPACES).text)
-        date_expiry_2 = ComplexDate(year=year, month=month)
-        day_xml = date_expiry_2_xml.find('dt:day', NAMESPACES)
-        if day_xml is not None:
-            date_expiry_2.update('day', int(day_xml.text))
-            hour_xml = date_expiry_2_xml.find('dt:hour', NAMESPACES)
-            if hour_xml is not None:
-                date_expiry_2.update('hour', int(hour_xml.text))
-        stock_entry.date_expiry_2 = date_expiry_2.to_string()
+    stock_entry.date_produced_1 = record.date_produced_1.to_string()
+    stock_entry.date_produced = record.date_produced_1.to_datetime()
+    if record.date_produced_2 is not None:
+        stock_entry.date_produced_2 = record.date_produced_2.to_string()
+
+    stock_entry.date_expiry_1 = record.date_expiry_1.to_string()
+    stock_entry.date_expiry = record.date_expiry_1.to_datetime()
+    if record.date_expiry_2 is not None:
+        stock_entry.date_expiry_2 = record.date_expiry_2.to_string()
 
     # is_perishable
 
-    stock_entry.is_perishable = batch_xml.find('vd:perishable', NAMESPACES).text == 'true'
+    stock_entry.is_perishable = record.is_perishable
 
     # origin_country
     # producer_name
-    
-    origin_country_xml = batch_xml.find('vd:origin/vd:country/dt:name', NAMESPACES)
-    if origin_country_xml is not None:
-        stock_entry.origin_country = origin_country_xml.text
-
-    producer_name_xml = batch_xml.find('vd:origin/vd:producer/dt:enterprise/dt:name', NAMESPACES)
-    if producer_name_xml is not None:
-        stock_entry.producer_name = producer_name_xml.text
-
-    producer_guid_xml = batch_xml.find('vd:origin/vd:producer/dt:enterprise/bs:guid', NAMESPACES)
-    if producer_guid_xml is not None:
-        stock_entry.producer_guid = producer_guid_xml.text
-        try:
-            producer = Enterprise.objects.get(guid=stock_entry.producer_guid)
+
+    if record.origin_country is not None:
+        stock_entry.origin_country = record.origin_country
+
+    if record.producer_name is not None:
+        stock_entry.producer_name = record.producer_name
+
+    if record.producer_guid is not None:
+        stock_entry.producer_guid = record.producer_guid
+        producer = references.producers.get(record.producer_guid.lower())
+        if producer is not None:
             stock_entry.producer = producer
-        except ObjectDoesNotExist:
-            pass
 
-    stock_entry.save()
 
-    # packages
+def diff_rows(stored_rows: list[models.Model], new_rows: list[models.Model], key) -> tuple[list[models.Model], list[models.Model]]:
+    """
+    Matches new rows with stored ones by key(row), duplicates included.
+    Returns (rows to insert, stored rows to delete).
+    """
+
+    stored_by_key = {}
+    for row in stored_rows:
+        stored_by_key.setdefault(key(row), []).append(row)
+
+    inserted = []
+    for row in new_rows:
+        same_rows = stored_by_key.get(key(row))
+        if same_rows:
+            same_rows.pop()
+        else:
+            inserted.append(row)
 
-    stock_entry.package_set.all().delete()
+    deleted = [row for rows in stored_by_key.values() for row in rows]
 
-    for package_xml in batch_xml.findall('vd:packageList/dt:package', NAMESPACES):
+    return inserted, deleted
 
-        package = Package()
-        package.stock_entry = stock_entry
-        package.level = int(package_xml.find('dt:level', NAMESPACES).text)
-        packing_type_guid = package_xml.find('dt:packingType/bs:guid', NAMESPACES).text
-        packing_type_uuid = package_xml.find('dt:packingType/bs:uuid', NAMESPACES).text
-        packing_type_name = package_xml.find('dt:packingType/dt:name', NAMESPACES).text
-        packing_type_glodal_id = package_xml.find('dt:packingType/dt:globalID', NAMESPACES).text
-        package.packing_type = PackingType.get_or_create(
-            guid=packing_type_guid,
-            uuid=packing_type_uuid,
-            name=packing_type_name,
-            global_id=packing_type_glodal_id
-        )
-        quantity_xml = package_xml.find('dt:quantity', NAMESPACES)
-        if quantity_xml is not None:
-            package.quantity = int(quantity_xml.text)
+
+def package_key(package: Package) -> tuple:
+    return (package.level, package.packing_type_id, package.quantity, package.product_marks)
+
+
+def vet_document_key(vet_document: StockEntryVetDocument) -> str:
+    return str(vet_document.uuid).lower()
+
+
+def save_stock_entry_packages(stock_entries: list[StockEntry], records: list[StockEntryRecord], references: StockEntryReferences):
+    """
+    Brings packages and vet documents of saved stock entries in line with records.
+    Stored rows of the whole batch are read with one query per table and only
+    the differences are inserted and deleted, so unchanged rows are not rewritten.
+    """
+
+    stored_packages = {}
+    for package in Package.objects.filter(stock_entry__in=stock_entries):
+        stored_packages.setdefault(package.stock_entry_id, []).append(package)
+
+    stored_vet_documents = {}
+    for vet_document in StockEntryVetDocument.objects.filter(stock_entry__in=stock_entries):
+        stored_vet_documents.setdefault(vet_document.stock_entry_id, []).append(vet_document)
+
+    inserted_packages = []
+    deleted_packages = []
+    inserted_vet_documents = []
+    deleted_vet_documents = []
+
+    for stock_entry, record in zip(stock_entries, records):
+        packages = [
+            Package(
+                stock_entry=stock_entry,
+                level=package_record.level,
+                packing_type=references.packing_types[package_record.packing_type_guid.lower()],
+                quantity=package_record.quantity,
+                product_marks=' '.join(package_record.product_marks),
+            )
+            for package_record in record.packages
+        ]
+        inserted, deleted = diff_rows(stored_packages.get(stock_entry.pk, []), packages, package_key)
+        inserted_packages += inserted
+        deleted_packages += deleted
+
+        vet_documents = [
+            StockEntryVetDocument(stock_entry=stock_entry, uuid=vet_document_uuid)
+            for vet_document_uuid in record.vet_document_uuids
+        ]
+        inserted, deleted = diff_rows(stored_vet_documents.get(stock_entry.pk, []), vet_documents, vet_document_key)
+        inserted_vet_documents += inserted
+        deleted_vet_documents += deleted
+
+    if deleted_packages:
+        Package.objects.filter(id__in=[package.id for package in deleted_packages]).delete()
+    if deleted_vet_documents:
+        StockEntryVetDocument.objects.filter(id__in=[vet_document.id for vet_document in deleted_vet_documents]).delete()
+
+    Package.objects.bulk_create(inserted_packages, batch_size=BULK_BATCH_SIZE)
+    StockEntryVetDocument.objects.bulk_create(inserted_vet_documents, batch_size=BULK_BATCH_SIZE)
+
+
+def write_stock_entries(stock_entries: list[StockEntry], records: list[StockEntryRecord], enterprise: Enterprise, credentials: VetisCredentials):
+    """
+    Writes a batch of stock entries filled from records: stored ones are updated with one
+    bulk UPDATE, new ones are inserted with INSERT ... ON CONFLICT (uuid) DO UPDATE,
+    so a version inserted meanwhile by another worker is updated instead of failing the batch.
+    """
+
+    references = StockEntryReferences(records, credentials)
+
+    created = []
+    updated = []
+
+    for stock_entry, record in zip(stock_entries, records):
+        set_stock_entry_fields(stock_entry, enterprise, record, references)
+        if stock_entry.pk is None:
+            created.append(stock_entry)
         else:
-            package.quantity = 0
-        
-        marks = []
-        for marks_xml in package_xml.findall('dt:productMarks', NAMESPACES):
-            marks.append(marks_xml.text)
-        if marks:
-            package.product_marks = ' '.join(marks)
+            updated.append(stock_entry)
+
+    if created:
+        StockEntry.objects.bulk_create(
+            created,
+            update_conflicts=True,
+            unique_fields=['uuid'],
+            update_fields=STOCK_ENTRY_FIELDS,
+            batch_size=BULK_BATCH_SIZE
+        )
+        without_pk = {str(stock_entry.uuid).lower(): stock_entry for stock_entry in created if stock_entry.pk is None}
+        if without_pk:
+            # backends that do not return ids for upserted rows
+            for uuid, pk in StockEntry.objects.filter(uuid__in=without_pk.keys()).values_list('uuid', 'pk'):
+                without_pk[str(uuid)].pk = pk
+
+    if updated:
+        StockEntry.objects.bulk_update(updated, STOCK_ENTRY_FIELDS, batch_size=BULK_BATCH_SIZE)
+
+    save_stock_entry_packages(stock_entries, records, references)
+
+    refresh_current_stock(record.guid for record in records)
+
+
+def fill_stock_entry_from_record(stock_entry: StockEntry, enterprise: Enterprise, record: StockEntryRecord, credentials: VetisCredentials):
+    write_stock_entries([stock_entry], [record], enterprise, credentials)
+
+
+def fill_stock_entry_from_xml(stock_entry: StockEntry, enterprise: Enterprise, stock_entry_xml: ET.Element, credentials: VetisCredentials):
+    fill_stock_entry_from_record(stock_entry, enterprise, STOCK_ENTRY.extract(stock_entry_xml), credentials)
+
+
+def get_stock_entries_request(enterprise: Enterprise, credentials: VetisCredentials, initiator_login: str, update_mode: str, begin_date: datetime | None, end_date: datetime, list_count: int, list_offset: int) -> AbstractRequest:
+    if update_mode == 'INITIAL':
+        return GetStockEntryListRequest(
+            enterprise_guid=enterprise.guid,
+            api_key=credentials.api_key,
+            service_id=credentials.service_id,
+            issuer_id=credentials.issuer_id,
+            initiator_login=initiator_login,
+            list_count=list_count,
+            list_offset=list_offset
+        )
+    else:
+        return GetStockEntryChangesListRequest(
+            enterprise_guid=enterprise.guid,
+            begin_date=begin_date,
+            end_date=end_date,
+            api_key=credentials.api_key,
+            service_id=credentials.service_id,
+            issuer_id=credentials.issuer_id,
+            initiator_login=initiator_login,
+            list_count=list_count,
+            list_offset=list_offset
+        )
+
+
+def get_stock_entries_update_window(enterprise: Enterprise) -> tuple[str, datetime | None, datetime]:
+    """Returns (update_mode, begin_date, end_date)"""
+
+    # last_updated_entry = StockEntry.objects.filter(enterprise=enterprise).order_by('-date_updated').first()
+
+    if enterprise.stock_entries_last_updated is not None:
+        update_mode = 'CHANGES'
+        begin_date = enterprise.stock_entries_last_updated - timedelta(minutes=5) # rolloff slightly just in case
+    else:
+        update_mode = 'INITIAL'
+        begin_date = None
+
+    end_date = datetime.now(tz=TZ_MOSCOW)
+
+    return update_mode, begin_date, end_date
+
+
+def start_stock_entries_checkpoint(enterprise: Enterprise) -> SyncCheckpoint:
+    """Checkpoint of an interrupted journal update or a new one for the next update window"""
+
+    def start() -> dict:
+        update_mode, begin_date, end_date = get_stock_entries_update_window(enterprise)
+        return {'mode': update_mode, 'begin_date': begin_date, 'end_date': end_date}
+
+    return start_checkpoint('update_stock_entries', enterprise.guid, start)
 
-        package.save()
-    
-    stock_entry.stockentryvetdocument_set.all().delete()
 
-    for vet_document_uuid_xml in stock_entry_xml.findall('vd:vetDocument/bs:uuid', NAMESPACES):
-        vet_document = StockEntryVetDocument()
-        vet_document.stock_entry = stock_entry
-        vet_document.uuid = vet_document_uuid_xml.text
-        vet_document.save()
+def save_stock_entries_checkpointed(stream: ElementStream, enterprise: Enterprise, credentials: VetisCredentials, checkpoint: SyncCheckpoint, list_count: int):
+    """Saves a journal page and moves the checkpoint past it in one transaction"""
 
-    # / for package
+    with transaction.atomic():
+        # INITIAL import on PostgreSQL: the page is staged with COPY and merged at once
+        importer = StockEntryCopyImport(enterprise) if use_copy_import(checkpoint.mode) else None
+
+        save_stock_entries_stream(stream, enterprise, credentials, importer)
+
+        if importer is not None:
+            print(f'update_stock_entries: merging {importer.staged} staged entries')
+            importer.merge()
+
+        advance_checkpoint(checkpoint, list_count, int(stream.container.get('total')))
+
+
+def finish_stock_entries_checkpoint(enterprise: Enterprise, checkpoint: SyncCheckpoint):
+    """Journal is updated up to the end of the window only when all its pages are saved"""
+
+    with transaction.atomic():
+        enterprise.stock_entries_last_updated = checkpoint.end_date
+        enterprise.save(update_fields=['stock_entries_last_updated'])
+        finish_checkpoint(checkpoint)
+
+
+def get_stock_entries_stream(response) -> ElementStream:
+    """
+    Returns incremental parser of vd:stockEntryList in completed application result.
+    Raises RuntimeError if there is no list in the response.
+    """
+
+    stream = ElementStream(response.content, 'vd:stockEntryList', 'vd:stockEntry')
+
+    if stream.read_container() is None:
+        raise RuntimeError('Ошибка парсинга ответа: не найден список записей журнала')
+
+    return stream
+
+
+def get_stock_list_count() -> int:
+    return getattr(settings, 'VETIS_STOCK_LIST_COUNT', 1000)
+
+
+def is_stock_entry_unchanged(stock_entry: StockEntry | None, enterprise: Enterprise, record: StockEntryRecord) -> bool:
+    """Stored version is the same as received one, so there is nothing to write"""
+
+    return (
+        stock_entry is not None
+        and stock_entry.enterprise_id == enterprise.id
+        and stock_entry.date_updated == record.date_updated
+        and stock_entry.is_active == record.is_active
+        and stock_entry.is_last == record.is_last
+        and stock_entry.status == record.status
+        and str(stock_entry.next_uuid or '') == (record.next_uuid or '').lower()
+    )
+
+
+def save_stock_entries(stock_entry_xmls: list[ET.Element], enterprise: Enterprise, credentials: VetisCredentials, importer: StockEntryCopyImport = None):
+    """
+    Saves new and changed versions from a batch of stock entries. Model instances are built only for them.
+    With importer the batch is staged for StockEntryCopyImport.merge() instead.
+    """
+
+    # the last occurrence wins if a version is repeated, as it did when entries were saved one by one
+    stock_entry_records = list({record.uuid.lower(): record for record in STOCK_ENTRY.extract_all(stock_entry_xmls)}.values())
+
+    if importer is not None:
+        preload_stock_entries_dictionaries(credentials, stock_entry_records)
+        importer.add(stock_entry_records)
+        return
+
+    stock_entries = {
+        str(stock_entry.uuid): stock_entry
+        for stock_entry in StockEntry.objects.filter(uuid__in=[record.uuid for record in stock_entry_records])
+    }
+
+    stock_entry_records = [
+        record for record in stock_entry_records
+        if not is_stock_entry_unchanged(stock_entries.get(record.uuid.lower()), enterprise, record)
+    ]
+
+    if not stock_entry_records:
+        return
+
+    preload_stock_entries_dictionaries(credentials, stock_entry_records)
+
+    write_stock_entries(
+        stock_entries=[stock_entries.get(record.uuid.lower()) or StockEntry() for record in stock_entry_records],
+        records=stock_entry_records,
+        enterprise=enterprise,
+        credentials=credentials
+        )
+
+
+def save_stock_entries_stream(stream: ElementStream, enterprise: Enterprise, credentials: VetisCredentials, importer: StockEntryCopyImport = None):
+    """Saves stock entries batch by batch while the page is being parsed"""
+
+    batch_size = getattr(settings, 'VETIS_STREAM_BATCH_SIZE', 100)
+
+    for stock_entry_xmls in stream.iter_batches(batch_size):
+        save_stock_entries(stock_entry_xmls, enterprise, credentials, importer)
+
+
+def save_stock_entries_page(response, enterprise: Enterprise, credentials: VetisCredentials, importer: StockEntryCopyImport = None) -> int:
+    """Saves stock entries from completed application result, returns total number of entries"""
+
+    stream = get_stock_entries_stream(response)
+
+    save_stock_entries_stream(stream, enterprise, credentials, importer)
+
+    return int(stream.container.get('total'))
 
 
 @shared_task
@@ -813,91 +1223,113 @@ def update_stock_entries(credentials_id: int, initiator_login: str, enterprise_i
     except ObjectDoesNotExist:
         raise RuntimeError('Не обнаружены параметры подключения')
     
-    # last_updated_entry = StockEntry.objects.filter(enterprise=enterprise).order_by('-date_updated').first()
+    # each page is committed with the checkpoint, a failed task resumes after the last committed page
+    checkpoint = start_stock_entries_checkpoint(enterprise)
+    update_mode = checkpoint.mode
 
-    if enterprise.stock_entries_last_updated is not None:
-        update_mode = 'CHANGES'
-        begin_date = enterprise.stock_entries_last_updated - timedelta(minutes=5) # rolloff slightly just in case
-    else:
-        update_mode = 'INITIAL'
+    list_count = get_stock_list_count()
+    window = max(getattr(settings, 'VETIS_PAGE_PIPELINE_WINDOW', 1), 1)
 
-    end_date = datetime.now(tz=TZ_MOSCOW)
+    def submit_page(list_offset: int) -> tuple:
+        print(f'update_stock_entries: mode={update_mode}, submitting list_offset={list_offset}')
+        soap_request = get_stock_entries_request(enterprise, credentials, initiator_login, update_mode, checkpoint.begin_date, checkpoint.end_date, list_count, list_offset)
+        submitted_at = time()
+        application_id = submit_application(soap_request, credentials)
+        return list_offset, application_id, get_request_type(soap_request), submitted_at
 
-    list_count = 1000
-    list_offset = 0
+    # pages are submitted up to `window` ahead, so Vetis prepares next pages while current one is saved
+    pending_pages = deque([submit_page(checkpoint.list_offset)])
+    next_offset = checkpoint.list_offset + list_count
 
-    with transaction.atomic():
+    while pending_pages:
 
-        while True: # repeat if has pages
+        list_offset, application_id, request_type, submitted_at = pending_pages.popleft()
 
-            print(f'update_stock_entries: mode={update_mode}, list_offset={list_offset}')
+        print(f'update_stock_entries: mode={update_mode}, list_offset={list_offset}')
 
-            if update_mode == 'INITIAL':
-                soap_request = GetStockEntryListRequest(
-                    enterprise_guid=enterprise.guid,
-                    api_key=credentials.api_key,
-                    service_id=credentials.service_id,
-                    issuer_id=credentials.issuer_id,
-                    initiator_login=initiator_login,
-                    list_count=list_count,
-                    list_offset=list_offset
-                )
-            else:
-                soap_request = GetStockEntryChangesListRequest(
-                    enterprise_guid=enterprise.guid,
-                    begin_date=begin_date,
-                    end_date=end_date,
-                    api_key=credentials.api_key,
-                    service_id=credentials.service_id,
-                    issuer_id=credentials.issuer_id,
-                    initiator_login=initiator_login,
-                    list_count=list_count,
-                    list_offset=list_offset
-                )
+        response = wait_application_result(application_id, request_type, credentials, submitted_at)
 
-            response = send_2step_soap_request(soap_request, credentials)
+        stream = get_stock_entries_stream(response)
 
-            result_xml = ET.fromstring(response.text)
+        total = int(stream.container.get('total'))
 
-            if update_mode == 'INITIAL':
-                response_xml = result_xml.find('./soapenv:Body/apldef:receiveApplicationResultResponse/apl:application/apl:result/merc:getStockEntryListResponse/vd:stockEntryList', NAMESPACES)
-            else:
-                response_xml = result_xml.find('./soapenv:Body/apldef:receiveApplicationResultResponse/apl:application/apl:result/merc:getStockEntryChangesListResponse/vd:stockEntryList', NAMESPACES)
-
-            for stock_entry_xml in response_xml.findall('vd:stockEntry', NAMESPACES):
-                try:
-                    stock_entry = StockEntry.objects.get(uuid=stock_entry_xml.find('bs:uuid', NAMESPACES).text)
-                except:
-                    stock_entry = StockEntry()
-
-                fill_stock_entry_from_xml(
-                    stock_entry=stock_entry,
-                    enterprise=enterprise,
-                    stock_entry_xml=stock_entry_xml,
-                    credentials=credentials
-                    )
-                
-            # / for main
-
-            total = int(response_xml.get('total'))
-
-            if total > list_offset + list_count:
-                list_offset += list_count
-                sleep(1.0)
-            else:
-                break
-        # /while
+        while next_offset < total and len(pending_pages) < window:
+            pending_pages.append(submit_page(next_offset))
+            next_offset += list_count
 
-        enterprise.stock_entries_last_updated = end_date
-        enterprise.save()
+        save_stock_entries_checkpointed(stream, enterprise, credentials, checkpoint, list_count)
 
-    # /transaction.atomic   
+    # /while
+
+    print(f'update_stock_entries: dictionary cache hits/lookups: {dictionary_cache.format_stats()}')
+
+    finish_stock_entries_checkpoint(enterprise, checkpoint)
 
     update_stock_entry_main_records(credentials_id, initiator_login, enterprise_id)
 
     return f'Складские записи для предприятия успешно обновлены. Всего: {total}'
 
 
+@shared_task
+def update_stock_entries_scheduled(credentials_id: int, initiator_login: str, enterprise_id: int):
+    """
+    Same as update_stock_entries, but the worker is not blocked while Vetis processes applications:
+    each page is collected by collect_application_result and committed with the checkpoint.
+    Enterprise last update date is moved only after the last page.
+    """
+
+    try:
+        enterprise = Enterprise.objects.get(id=enterprise_id)
+    except ObjectDoesNotExist:
+        raise RuntimeError('Предприятие не найдено')
+    
+    try:
+        credentials = VetisCredentials.objects.get(id=credentials_id)
+    except ObjectDoesNotExist:
+        raise RuntimeError('Не обнаружены параметры подключения')
+
+    checkpoint = start_stock_entries_checkpoint(enterprise)
+
+    state = {
+        'initiator_login': initiator_login,
+        'enterprise_id': enterprise.id,
+        'checkpoint_id': checkpoint.id,
+        'list_count': get_stock_list_count(),
+    }
+
+    soap_request = get_stock_entries_request(enterprise, credentials, initiator_login, checkpoint.mode, checkpoint.begin_date, checkpoint.end_date, state['list_count'], checkpoint.list_offset)
+
+    schedule_application('update_stock_entries', soap_request, credentials, state)
+
+    return 'Запрос складского журнала отправлен. Записи будут загружены в фоновом режиме.'
+
+
+@application_handler('update_stock_entries')
+def handle_stock_entries_page(response, credentials: VetisCredentials, state: dict):
+    enterprise = Enterprise.objects.get(id=state['enterprise_id'])
+
+    checkpoint = SyncCheckpoint.objects.filter(id=state['checkpoint_id']).first()
+    if checkpoint is None:
+        raise RuntimeError('Синхронизация выполняется другой задачей')
+
+    print(f'update_stock_entries: mode={checkpoint.mode}, list_offset={checkpoint.list_offset}')
+
+    save_stock_entries_checkpointed(get_stock_entries_stream(response), enterprise, credentials, checkpoint, state['list_count'])
+
+    if not is_checkpoint_done(checkpoint):
+        soap_request = get_stock_entries_request(enterprise, credentials, state['initiator_login'], checkpoint.mode, checkpoint.begin_date, checkpoint.end_date, state['list_count'], checkpoint.list_offset)
+        schedule_application('update_stock_entries', soap_request, credentials, state)
+        return f'Загружено {checkpoint.list_offset} из {checkpoint.total} складских записей'
+
+    print(f'update_stock_entries: dictionary cache hits/lookups: {dictionary_cache.format_stats()}')
+
+    finish_stock_entries_checkpoint(enterprise, checkpoint)
+
+    update_stock_entry_main_records.delay(credentials.id, state['initiator_login'], enterprise.id)
+
+    return f'Складские записи для предприятия успешно обновлены. Всего: {checkpoint.total}'
+
+
 @shared_task
 def update_stock_entry_history(credentials_id: int, initiator_login: str, stock_entry_id: int):
     try:
@@ -919,58 +1351,41 @@ def update_stock_entry_history(credentials_id: int, initiator_login: str, stock_
     if enterprise.business_entity.credentials != credentials:
         raise RuntimeError('Запись журнала не принадлежит текущему хозяйственному субъекту')
     
-    list_count = 1000
-    list_offset = 0
+    list_count = get_stock_list_count()
 
-    with transaction.atomic():
+    # each page is committed with the checkpoint, a failed task resumes after the last committed page
+    checkpoint = start_checkpoint('update_stock_entry_history', stock_entry.guid)
 
-        while True: # repeat if has pages
-            
-            soap_request = GetStockEntryVersionListRequest(
-                enterprise_guid=enterprise.guid,
-                stock_entry_guid=stock_entry.guid,
-                api_key=credentials.api_key,
-                service_id=credentials.service_id,
-                issuer_id=credentials.issuer_id,
-                initiator_login=initiator_login,
-                list_count=list_count,
-                list_offset=list_offset
-            )
+    while not is_checkpoint_done(checkpoint): # repeat if has pages
+        
+        soap_request = GetStockEntryVersionListRequest(
+            enterprise_guid=enterprise.guid,
+            stock_entry_guid=stock_entry.guid,
+            api_key=credentials.api_key,
+            service_id=credentials.service_id,
+            issuer_id=credentials.issuer_id,
+            initiator_login=initiator_login,
+            list_count=list_count,
+            list_offset=checkpoint.list_offset
+        )
 
-            response = send_2step_soap_request(soap_request, credentials)
+        response = send_2step_soap_request(soap_request, credentials)
 
-            result_xml = ET.fromstring(response.text)
+        with transaction.atomic():
 
-            response_xml = result_xml.find('./soapenv:Body/apldef:receiveApplicationResultResponse/apl:application/apl:result/merc:getStockEntryVersionListResponse/vd:stockEntryList', NAMESPACES)
+            total = save_stock_entries_page(response, enterprise, credentials)
 
-            for stock_entry_version_xml in response_xml.findall('vd:stockEntry', NAMESPACES):
-                try:
-                    stock_entry_version = StockEntry.objects.get(uuid=stock_entry_version_xml.find('bs:uuid', NAMESPACES).text)
-                except:
-                    stock_entry_version = StockEntry()
+            advance_checkpoint(checkpoint, list_count, total)
 
-                fill_stock_entry_from_xml(
-                    stock_entry=stock_entry_version,
-                    enterprise=enterprise,
-                    stock_entry_xml=stock_entry_version_xml,
-                    credentials=credentials
-                    )
+        # /transaction.atomic
 
-            # /for main
+        print(f'Stock entry version total: {total}')
 
-            total = int(response_xml.get('total'))
+    # /while
 
-            print(f'Stock entry version total: {total}')
-            
-            if total > list_offset + list_count:
-                list_offset += list_count
-                sleep(1.0)
-            else:
-                break
-        # /while
-    # /transaction.atomic   
+    finish_checkpoint(checkpoint)
 
-    return f'История для записи журнала успешно обновлена. Всего: {total}'
+    return f'История для записи журнала успешно обновлена. Всего: {checkpoint.total}'
 
 
 def update_stock_entry_main(stock_entry_main: StockEntryMain, credentials: VetisCredentials, initiator_login: str):
@@ -1006,14 +1421,16 @@ def update_stock_entry_main(stock_entry_main: StockEntryMain, credentials: Vetis
 
             response = send_2step_soap_request(soap_request, credentials)
 
-            result_xml = ET.fromstring(response.text)
+            result_xml = ET.fromstring(response.content)
 
             response_xml = result_xml.find('./soapenv:Body/apldef:receiveApplicationResultResponse/apl:application/apl:result/merc:getVetDocumentByUuidResponse/vd:vetDocument', NAMESPACES)
 
             if response_xml is None:
                 raise RuntimeError('Ошибка парсинга ответа при загрузке вет. документа: не найден вет. документ')
             
-            vetd_type = response_xml.find('vd:vetDType', NAMESPACES).text
+            vet_document_record = VET_DOCUMENT.extract(response_xml)
+
+            vetd_type = vet_document_record.vetd_type
 
             if vetd_type != 'TRANSPORT':
                 raise RuntimeError(f'Неизвестный тип ветеринарного документа {vetd_type}')
@@ -1021,12 +1438,13 @@ def update_stock_entry_main(stock_entry_main: StockEntryMain, credentials: Vetis
             stock_entry_main.initial_status = first_stock_entry.status
             stock_entry_main.date_created = first_stock_entry.date_created
             stock_entry_main.initial_volume = first_stock_entry.volume
-            stock_entry_main.source_be_guid = response_xml.find('vd:certifiedConsignment/vd:consignor/dt:businessEntity/bs:guid', NAMESPACES).text
+            stock_entry_main.source_be_guid = vet_document_record.consignor_be_guid
             stock_entry_main.source_be_name = str(get_or_load_business_entity_info_by_guid(credentials, stock_entry_main.source_be_guid))
-            stock_entry_main.source_ent_guid = response_xml.find('vd:certifiedConsignment/vd:consignor/dt:enterprise/bs:guid', NAMESPACES).text
+            stock_entry_main.source_ent_guid = vet_document_record.consignor_ent_guid
             stock_entry_main.source_ent_name = str(get_or_load_enterprise_info_by_guid(credentials, stock_entry_main.source_ent_guid))
             stock_entry_main.is_populated = True
             stock_entry_main.save()
+            refresh_current_stock_main(stock_entry_main)
             return True
 
         else:
@@ -1043,6 +1461,7 @@ def update_stock_entry_main(stock_entry_main: StockEntryMain, credentials: Vetis
         stock_entry_main.source_ent_name = str(first_stock_entry.enterprise)
         stock_entry_main.is_populated = True
         stock_entry_main.save()
+        refresh_current_stock_main(stock_entry_main)
     
     return True
 
@@ -1088,4 +1507,13 @@ def update_stock_entry_main_records(credentials_id: int, initiator_login: str, e
         ):
             updated += 1
 
-    return f'Завершено обновление головных записей журнала (обновлено {updated} из {total})'
\ No newline at end of file
+    return f'Завершено обновление головных записей журнала (обновлено {updated} из {total})'
+
+
+@shared_task
+def purge_api_requests_history():
+    """Deletes API request history past VETIS_HISTORY_RETENTION, scheduled with CELERY_BEAT_SCHEDULE"""
+
+    result = purge_history()
+
+    return f'История запросов очищена: {result}'
@@ -1,3 +1,1243 @@
-from django.test import TestCase
+import multiprocessing
+import tempfile
+import time
+import uuid
+from unittest import mock, skipUnless
+from threading import Event, Thread
+from time import monotonic
+from datetime import datetime, timedelta
+from decimal import Decimal
+import xml.etree.ElementTree as ET
 
-# Create your tests here.
+from celery import states
+from celery.result import EagerResult
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template.loader import render_to_string
+from django.urls import reverse
+import requests
+from requests import Response
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from .applications import (
+    DEFAULT_PROCESSING_TIME, MAX_POLL_DELAY, MIN_POLL_DELAY, PROCESSING_TIME_WEIGHT, _handlers, application_handler, get_application_timeout,
+    get_poll_delay, get_processing_time, record_processing_time,
+)
+from .bench.fixtures import get_fake_data, get_stock_page, make_response, seed_dictionaries, seed_workspace
+from .checkpoints import advance_checkpoint, finish_checkpoint, is_checkpoint_done, start_checkpoint
+from .copy_import import StockEntryCopyImport
+from .dictionary_cache import CACHED_MODELS, GENERATION_CHECK_INTERVAL, DictionaryCache, ModelCache, dictionary_cache
+from .current_stock import refresh_current_stock, refresh_current_stock_main
+from .history import HistoryEntry, HistoryWriter, record_history
+from .exceptions import VetisApplicationError, VetisConnectionError, VetisHttpError, VetisSoapFault
+from .fake.data import PACKING_TYPES, UNITS, FakeData
+from .fake.server import ENVELOPE, FakeServerConfig, FakeVetisServer
+from .locks import CacheLock, LockTimeout
+from .models import TZ_MOSCOW, ApiRequestsHistoryRecord, BusinessEntity, ComplexDate, CurrentStockEntry, Enterprise, Package, PackingType, Product, ProductItem, RateLimitBucket, StockEntry, StockEntryMain, SyncCheckpoint, Unit, VetisCredentials
+from .payloads import get_payload_storage
+from .ratelimit import CacheTokenBucket, DatabaseTokenBucket, get_bucket
+from .retention import purge_history
+from .search import parse_search_query, search
+from .singleflight import SingleFlight, dictionary_loads
+from .tasks import (
+    collect_application_result, diff_rows, fill_stock_entry_from_xml, get_or_load_product_by_guid, get_or_load_product_item_by_guid,
+    reload_enterprises, reload_product_items, save_stock_entries, save_stock_entries_checkpointed, schedule_application, submit_application,
+    update_stock_entries, write_stock_entries,
+)
+from .transport import _post_soap_request, get_retry_policy, send_soap_request, send_soap_requests
+from .upsert import KEEP_STORED, upsert, upsert_one
+from .util import get_shared_cache
+from .xml.build_xml import (
+    TEMPLATES_DIR, AbstractRequest, ActivityLocationListRequest, BusinessEntityByGuidRequest, EnterpriseByGuidRequest, GetStockEntryChangesListRequest,
+    GetStockEntryListRequest, GetStockEntryVersionListRequest, GetVetDocumentByUuidRequest, ProductByGuidRequest, ProductItemByGuidRequest,
+    ProductItemListRequest, ReceiveApplicationResultRequest, SubproductByGuidRequest,
+)
+from .xml.schemas import STOCK_ENTRY
+from .xml.settings import NAMESPACES
+
+
+def find_text(element: ET.Element, path: str) -> str | None:
+    found = element.find(path, NAMESPACES)
+    return found.text if found is not None else None
+
+
+def find_complex_date(batch_xml: ET.Element, path: str) -> ComplexDate | None:
+    date_xml = batch_xml.find(path, NAMESPACES)
+    if date_xml is None:
+        return None
+    date = ComplexDate(year=int(find_text(date_xml, 'dt:year')), month=int(find_text(date_xml, 'dt:month')))
+    if find_text(date_xml, 'dt:day') is not None:
+        date.update('day', int(find_text(date_xml, 'dt:day')))
+        if find_text(date_xml, 'dt:hour') is not None:
+            date.update('hour', int(find_text(date_xml, 'dt:hour')))
+    return date
+
+
+def get_baseline_stock_entry(stock_entry_xml: ET.Element) -> dict:
+    """Values fill_stock_entry_from_xml stored before xml.schemas, read with a find() per field as it did"""
+
+    batch_xml = stock_entry_xml.find('vd:batch', NAMESPACES)
+    status = int(find_text(stock_entry_xml, 'bs:status'))
+    date_produced_1 = find_complex_date(batch_xml, 'vd:dateOfProduction/vd:firstDate')
+    date_produced_2 = find_complex_date(batch_xml, 'vd:dateOfProduction/vd:secondDate')
+    date_expiry_1 = find_complex_date(batch_xml, 'vd:expiryDate/vd:firstDate')
+    date_expiry_2 = find_complex_date(batch_xml, 'vd:expiryDate/vd:secondDate')
+
+    return {
+        'guid': find_text(stock_entry_xml, 'bs:guid'),
+        'uuid': find_text(stock_entry_xml, 'bs:uuid'),
+        'is_active': find_text(stock_entry_xml, 'bs:active') == 'true',
+        'is_last': find_text(stock_entry_xml, 'bs:last') == 'true',
+        'status': status,
+        'date_created': datetime.fromisoformat(find_text(stock_entry_xml, 'bs:createDate')),
+        'date_updated': datetime.fromisoformat(find_text(stock_entry_xml, 'bs:updateDate')),
+        'previous_uuid': find_text(stock_entry_xml, 'bs:previous'),
+        'next_uuid': find_text(stock_entry_xml, 'bs:next'),
+        'entry_number': int(find_text(stock_entry_xml, 'vd:entryNumber')),
+        'product_type': int(find_text(batch_xml, 'vd:productType')),
+        'product': find_text(batch_xml, 'vd:product/bs:guid'),
+        'subproduct': find_text(batch_xml, 'vd:subProduct/bs:guid'),
+        'product_item_name': find_text(batch_xml, 'vd:productItem/dt:name'),
+        'product_item': find_text(batch_xml, 'vd:productItem/bs:guid'),
+        'volume': 0 if status == 201 else Decimal(find_text(batch_xml, 'vd:volume')),
+        'unit': find_text(batch_xml, 'vd:unit/bs:guid'),
+        'date_produced_1': date_produced_1.to_string(),
+        'date_produced': date_produced_1.to_datetime(),
+        'date_produced_2': date_produced_2.to_string() if date_produced_2 is not None else '',
+        'date_expiry_1': date_expiry_1.to_string(),
+        'date_expiry': date_expiry_1.to_datetime(),
+        'date_expiry_2': date_expiry_2.to_string() if date_expiry_2 is not None else '',
+        'is_perishable': find_text(batch_xml, 'vd:perishable') == 'true',
+        'origin_country': find_text(batch_xml, 'vd:origin/vd:country/dt:name'),
+        'producer_name': find_text(batch_xml, 'vd:origin/vd:producer/dt:enterprise/dt:name'),
+        'producer_guid': find_text(batch_xml, 'vd:origin/vd:producer/dt:enterprise/bs:guid'),
+        'packages': [
+            (
+                int(find_text(package_xml, 'dt:level')),
+                find_text(package_xml, 'dt:packingType/bs:guid'),
+                int(find_text(package_xml, 'dt:quantity') or 0),
+                ' '.join(marks_xml.text for marks_xml in package_xml.findall('dt:productMarks', NAMESPACES)),
+            )
+            for package_xml in batch_xml.findall('vd:packageList/dt:package', NAMESPACES)
+        ],
+    }
+
+
+class FakeJournalTestCase(TestCase):
+    """Workspace and dictionaries of fake Vetis data, so journal pages are saved without requests"""
+
+    size = 60
+
+    def setUp(self):
+        # test transactions are rolled back, locks of their dictionary loads are never released on commit
+        self.addCleanup(dictionary_loads.release_pending)
+        self.data = get_fake_data(self.size)
+        self.credentials, self.business_entity, self.enterprise = seed_workspace(self.data)
+        seed_dictionaries(self.data, self.credentials)
+        # units are not requested from Vetis, they are loaded beforehand
+        for guid, name in UNITS:
+            Unit.objects.create(guid=guid, name=name)
+
+    def get_stock_entry_xmls(self, count: int, offset: int = 0) -> list[ET.Element]:
+        page = ET.fromstring(get_stock_page(self.data, str(self.enterprise.guid), count, offset))
+        return page.findall('.//vd:stockEntryList/vd:stockEntry', NAMESPACES)
+
+    def get_stored_stock_entry(self, stock_entry: StockEntry) -> dict:
+        def guid(record) -> str | None:
+            return str(record.guid) if record is not None else None
+
+        values = {
+            name: getattr(stock_entry, name)
+            for name in (
+                'entry_number', 'is_active', 'is_last', 'status', 'date_created', 'date_updated', 'product_type',
+                'product_item_name', 'volume', 'date_produced_1', 'date_produced', 'date_produced_2',
+                'date_expiry_1', 'date_expiry', 'date_expiry_2', 'is_perishable', 'origin_country', 'producer_name',
+            )
+        }
+        for name in ('guid', 'uuid', 'previous_uuid', 'next_uuid', 'producer_guid'):
+            values[name] = str(getattr(stock_entry, name)) if getattr(stock_entry, name) is not None else None
+        for name in ('product', 'subproduct', 'product_item', 'unit'):
+            values[name] = guid(getattr(stock_entry, name))
+        values['packages'] = [
+            (package.level, str(package.packing_type.guid), package.quantity, package.product_marks)
+            for package in stock_entry.package_set.order_by('level', 'id')
+        ]
+        return values
+
+
+@override_settings(VETIS_RATE_LIMITS={'default': None})
+class FakeServerTestCase(TestCase):
+    """Requests are sent over HTTP to the fake Vetis server serving `data`"""
+
+    data = FakeData()
+    server_config = FakeServerConfig(processing_delay=0)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeVetisServer(('127.0.0.1', 0), cls.data, cls.server_config)
+        cls.server.start()
+        cls.enterClassContext(override_settings(VETIS_ENDPOINT_BASE_URL=cls.server.base_url))
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.server.stop()
+
+    def setUp(self):
+        self.addCleanup(dictionary_loads.release_pending)  # see FakeJournalTestCase
+        self.credentials = VetisCredentials.objects.create(name='test', login='login', password='password', api_key='key', service_id='service', issuer_id='issuer')
+        self.business_entity = BusinessEntity.objects.create(
+            guid=self.data.make_guid('test-business-entity'),
+            uuid=self.data.make_guid('test-business-entity-version'),
+            type=1,
+            name='Тест',
+            credentials=self.credentials,
+        )
+
+
+class StockEntryExtractTests(FakeJournalTestCase):
+
+    def test_fake_page(self):
+        stock_entry_xmls = self.get_stock_entry_xmls(60)
+        self.assertEqual(len(stock_entry_xmls), 60)
+
+        for stock_entry_xml in stock_entry_xmls:
+            fill_stock_entry_from_xml(StockEntry(), self.enterprise, stock_entry_xml, self.credentials)
+
+            baseline = get_baseline_stock_entry(stock_entry_xml)
+            stock_entry = StockEntry.objects.get(uuid=baseline['uuid'])
+            self.assertEqual(self.get_stored_stock_entry(stock_entry), baseline)
+            self.assertEqual(stock_entry.main.guid, stock_entry.guid)
+
+
+class StockEntryBatchTests(FakeJournalTestCase):
+
+    def test_queries_per_batch(self):
+        with CaptureQueriesContext(connection) as small:
+            save_stock_entries(self.get_stock_entry_xmls(10), self.enterprise, self.credentials)
+        with CaptureQueriesContext(connection) as large:
+            save_stock_entries(self.get_stock_entry_xmls(50, 10), self.enterprise, self.credentials)
+
+        self.assertEqual(StockEntry.objects.count(), 60)
+        # one query per table for the batch, not per entry
+        self.assertLessEqual(len(large), len(small))
+
+    def test_saved_again(self):
+        stock_entry_xmls = self.get_stock_entry_xmls(30)
+        save_stock_entries(stock_entry_xmls, self.enterprise, self.credentials)
+        ids = dict(StockEntry.objects.values_list('uuid', 'id'))
+
+        with CaptureQueriesContext(connection) as queries:
+            save_stock_entries(stock_entry_xmls, self.enterprise, self.credentials)
+        # unchanged versions are only read
+        self.assertEqual(len(queries), 1)
+
+        records = [STOCK_ENTRY.extract(stock_entry_xml)._replace(volume=Decimal('999')) for stock_entry_xml in stock_entry_xmls]
+        stock_entries = StockEntry.objects.in_bulk([record.uuid for record in records], field_name='uuid')
+        # stored versions are updated in place
+        write_stock_entries([stock_entries[uuid.UUID(record.uuid)] for record in records], records, self.enterprise, self.credentials)
+
+        self.assertEqual(dict(StockEntry.objects.values_list('uuid', 'id')), ids)
+        self.assertEqual(set(StockEntry.objects.values_list('volume', flat=True)), {Decimal('999')})
+
+
+class StockEntryPackagesTests(FakeJournalTestCase):
+
+    def test_diff_rows(self):
+        stored = [('a', 1), ('b', 2), ('b', 3), ('c', 4)]
+        new = [('a', 5), ('b', 6), ('d', 7)]
+
+        inserted, deleted = diff_rows(stored, new, key=lambda row: row[0])
+
+        self.assertEqual(inserted, [('d', 7)])
+        # one of the two stored duplicates is matched
+        self.assertEqual(sorted(deleted), [('b', 2), ('c', 4)])
+
+    def get_package_ids(self, record) -> list[int]:
+        return list(Package.objects.filter(stock_entry__uuid=record.uuid).order_by('level').values_list('id', flat=True))
+
+    def test_changed_packages(self):
+        stock_entry_xmls = self.get_stock_entry_xmls(6)
+        save_stock_entries(stock_entry_xmls, self.enterprise, self.credentials)
+
+        records = [STOCK_ENTRY.extract(stock_entry_xml) for stock_entry_xml in stock_entry_xmls]
+        unchanged, changed, removed = [record for record in records if len(record.packages) == 2]
+        package_ids = {record.uuid: self.get_package_ids(record) for record in (unchanged, changed, removed)}
+
+        changed = changed._replace(packages=[changed.packages[0]._replace(quantity=100), changed.packages[1]])
+        removed = removed._replace(packages=removed.packages[:1])
+        records = [unchanged, changed, removed]
+        stock_entries = StockEntry.objects.in_bulk([record.uuid for record in records], field_name='uuid')
+
+        with CaptureQueriesContext(connection) as queries:
+            write_stock_entries([stock_entries[uuid.UUID(record.uuid)] for record in records], records, self.enterprise, self.credentials)
+
+        self.assertEqual(self.get_package_ids(unchanged), package_ids[unchanged.uuid])
+
+        changed_ids = self.get_package_ids(changed)
+        self.assertNotIn(changed_ids[0], package_ids[changed.uuid])
+        self.assertEqual(changed_ids[1], package_ids[changed.uuid][1])
+        self.assertEqual(Package.objects.get(id=changed_ids[0]).quantity, 100)
+
+        self.assertEqual(self.get_package_ids(removed), package_ids[removed.uuid][:1])
+
+        # one DELETE and one INSERT for the whole batch
+        package_writes = [query for query in queries if 'vetis_api_package' in query['sql'] and not query['sql'].startswith('SELECT')]
+        self.assertEqual(len(package_writes), 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+class StockEntryCopyImportTests(FakeJournalTestCase):
+
+    def get_journal(self) -> dict:
+        journal = {}
+        for stock_entry in StockEntry.objects.select_related('main', 'producer', 'current'):
+            values = self.get_stored_stock_entry(stock_entry)
+            values['enterprise'] = stock_entry.enterprise_id
+            values['main'] = str(stock_entry.main.guid)
+            values['producer'] = stock_entry.producer_id
+            values['vet_documents'] = sorted(str(vet_document.uuid) for vet_document in stock_entry.stockentryvetdocument_set.all())
+            current = getattr(stock_entry, 'current', None)
+            values['current'] = {
+                field.attname: getattr(current, field.attname)
+                for field in CurrentStockEntry._meta.concrete_fields
+                if field.attname not in ('id', 'stock_entry_id')
+            } if current is not None else None
+            journal[values['uuid']] = values
+        return journal
+
+    def test_merge(self):
+        stock_entry_xmls = self.get_stock_entry_xmls(60)
+
+        save_stock_entries(stock_entry_xmls, self.enterprise, self.credentials)
+        saved = self.get_journal()
+
+        StockEntry.objects.all().delete()
+
+        with transaction.atomic():
+            importer = StockEntryCopyImport(self.enterprise)
+            save_stock_entries(stock_entry_xmls, self.enterprise, self.credentials, importer)
+            importer.merge()
+
+        self.assertEqual(len(saved), 60)
+        self.assertEqual(self.get_journal(), saved)
+
+
+class UpsertTests(TestCase):
+
+    def test_keep_stored(self):
+        stored = Unit.objects.create(guid=uuid.UUID(int=1), name='кг')
+
+        # stored rows are neither changed nor rewritten
+        with CaptureQueriesContext(connection) as queries:
+            unit = upsert_one(Unit(guid=uuid.UUID(int=1), name='килограмм'), KEEP_STORED)
+        self.assertNotIn('DO UPDATE', ' '.join(query['sql'] for query in queries))
+        self.assertEqual((unit.pk, unit.name), (stored.pk, 'кг'))
+        self.assertEqual(Unit.objects.get(pk=stored.pk).name, 'кг')
+
+        units = upsert([Unit(guid=uuid.UUID(int=2), name='шт'), Unit(guid=uuid.UUID(int=1), name='килограмм')], KEEP_STORED)
+        self.assertEqual([(unit.guid, unit.name) for unit in units], [(uuid.UUID(int=2), 'шт'), (uuid.UUID(int=1), 'кг')])
+        self.assertIsNotNone(units[0].pk)
+
+    def test_update(self):
+        stored = Unit.objects.create(guid=uuid.UUID(int=1), name='кг')
+        unit = upsert_one(Unit(guid=uuid.UUID(int=1), name='килограмм'))
+        self.assertEqual((unit.pk, Unit.objects.get(pk=stored.pk).name), (stored.pk, 'килограмм'))
+
+
+class DictionaryUpdateTests(FakeJournalTestCase):
+
+    def respond(self, response_xml: str):
+        return mock.patch('vetis_api.tasks.send_soap_request', return_value=make_response(ENVELOPE.format(response_xml).encode('utf-8')))
+
+    def test_product(self):
+        guid = self.data.product_guid(0)
+        product_xml = self.data.product_xml(guid).replace('<dt:code>1000</dt:code>', '').replace('Продукция 0', 'Продукция 0 (изм.)')
+
+        with self.respond(f'<ws:getProductByGuidResponse>{product_xml}</ws:getProductByGuidResponse>'):
+            product = get_or_load_product_by_guid(credentials=self.credentials, product_guid=guid, update=True)
+
+        product = Product.objects.get(pk=product.pk)
+        self.assertEqual((product.name, product.code), ('Продукция 0 (изм.)', '1000'))
+
+    def test_product_item(self):
+        guid = self.data.product_item_guid(4)
+        ProductItem.objects.filter(guid=guid).update(producer=self.business_entity, producer_guid=self.business_entity.guid)
+        product_item_xml = self.data.product_item_xml(guid).replace('<dt:globalID>4600000000004</dt:globalID>', '').replace('Наименование 4', 'Наименование 4 (изм.)')
+
+        with self.respond(f'<ws:getProductItemByGuidResponse>{product_item_xml}</ws:getProductItemByGuidResponse>'):
+            product_item = get_or_load_product_item_by_guid(credentials=self.credentials, product_item_guid=guid, update=True)
+
+        product_item = ProductItem.objects.get(pk=product_item.pk)
+        self.assertEqual(product_item.name, 'Наименование 4 (изм.) & Ко')
+        self.assertEqual(product_item.gtin, '4600000000004')
+        self.assertEqual(product_item.gost, 'ГОСТ 31798-2012')
+        self.assertEqual((str(product_item.producer_guid), product_item.producer), (self.business_entity.guid, self.business_entity))
+
+
+@override_settings(VETIS_SHARED_CACHE='default')
+class DictionaryCacheTests(FakeServerTestCase):
+
+    def make_unit(self, index: int) -> Unit:
+        return Unit(pk=index, guid=uuid.uuid4(), name=f'ед. {index}')
+
+    def later(self, checks: int = 1):
+        """Time of the next checks of the generation published by other processes"""
+        return mock.patch('vetis_api.dictionary_cache.monotonic', return_value=monotonic() + GENERATION_CHECK_INTERVAL * checks)
+
+    def test_lru(self):
+        cache = ModelCache('vetis_api.unit', 2)
+        units = [self.make_unit(index) for index in range(4)]
+        cache.put(units[0])
+        cache.put(units[1])
+        cache.get(units[0].guid)
+        cache.put(units[2])
+        self.assertIsNone(cache.get(units[1].guid))  # least recently used
+
+        cache.put(units[3])
+        self.assertIsNone(cache.get(units[0].guid))
+        self.assertEqual([cache.get(unit.guid) for unit in units[2:]], units[2:])
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_stats(self):
+        cache = ModelCache('vetis_api.unit', 10)
+        unit = self.make_unit(1)
+        self.assertIsNone(cache.get(unit.guid))
+        cache.put(unit)
+        self.assertIs(cache.get(str(unit.guid).upper()), unit)
+        self.assertIs(cache.get(unit.guid), unit)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (2, 1, 2 / 3))
+
+        disabled = ModelCache('vetis_api.unit', 0)
+        disabled.put(unit)
+        self.assertIsNone(disabled.get(unit.guid))
+        self.assertEqual((disabled.stats()['size'], disabled.stats()['misses']), (0, 1))
+
+    def test_invalidate(self):
+        # two instances stand for the caches of two worker processes
+        cache, other = ModelCache('vetis_api.unit', 10), ModelCache('vetis_api.unit', 10)
+        unit = self.make_unit(1)
+        cache.put(unit)
+        other.put(unit)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            cache.invalidate()
+        self.assertIsNone(cache.get(unit.guid))
+        # not published until commit, the other process could cache the old row again
+        with self.later():
+            self.assertIs(other.get(unit.guid), unit)
+
+        for callback in callbacks:
+            callback()
+        with self.later(2):
+            self.assertIsNone(other.get(unit.guid))
+
+    def test_reload(self):
+        other = DictionaryCache(CACHED_MODELS)
+        reload_enterprises(self.credentials.id, self.business_entity.id)
+        reload_product_items(self.credentials.id, self.business_entity.id)
+        enterprise = self.business_entity.enterprise_set.first()
+        product_item = ProductItem.objects.filter(producer_guid=self.business_entity.guid).first()
+        for record in (enterprise, product_item):
+            dictionary_cache.put(record)
+            other.put(record)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reload_enterprises(self.credentials.id, self.business_entity.id)
+            reload_product_items(self.credentials.id, self.business_entity.id)
+
+        self.assertIsNone(dictionary_cache.get(Enterprise, enterprise.guid))
+        self.assertIsNone(dictionary_cache.get(ProductItem, product_item.guid))
+        # the stale records are not served by the other process after its next check
+        with self.later():
+            self.assertIsNone(other.get(Enterprise, enterprise.guid))
+            self.assertIsNone(other.get(ProductItem, product_item.guid))
+
+    def test_get_or_create(self):
+        guid, name = UNITS[0]
+        unit = Unit.get_or_create(guid, name)
+        with self.assertNumQueries(0):
+            self.assertEqual(Unit.get_or_create(guid.upper(), name), unit)
+
+        guid, global_id, name = PACKING_TYPES[0]
+        packing_type = PackingType.get_or_create(guid, guid, name, global_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(PackingType.get_or_create(guid, guid, name, global_id), packing_type)
+
+        stats = dictionary_cache.stats()
+        self.assertGreaterEqual(stats['Unit']['hits'], 1)
+        self.assertGreaterEqual(stats['PackingType']['hits'], 1)
+
+
+class StockEntryQueryPlanTests(TestCase):
+    """Hot stock journal queries are served by the indexes declared in StockEntry and CurrentStockEntry Meta.indexes"""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # tables are empty here, a sequential scan would always win
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name: str):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        if connection.vendor == 'sqlite':
+            # ordering is taken from the index, not sorted afterwards
+            self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_stock_entries(self):
+        self.assertUsesIndex(
+            CurrentStockEntry.objects.filter(enterprise_id=1).select_related('unit').order_by('date_expiry', '-entry_number'),
+            'currentstock_ent_expiry_idx'
+        )
+
+    def test_expiring_entries(self):
+        self.assertUsesIndex(
+            CurrentStockEntry.objects.filter(
+                volume__gt=0,
+                date_expiry__lte=(datetime.now(tz=TZ_MOSCOW)+timedelta(days=30))
+                ).select_related('enterprise', 'unit').order_by('date_expiry'),
+            'currentstock_expiry_idx'
+        )
+
+    def test_history(self):
+        self.assertUsesIndex(StockEntry.objects.filter(guid=uuid.uuid4()).order_by('date_created'), 'stockentry_guid_created_idx')
+
+    def test_first_version(self):
+        self.assertUsesIndex(StockEntry.objects.filter(main_id=1).order_by('date_created')[:1], 'stockentry_main_created_idx')
+
+    def test_last_updated(self):
+        self.assertUsesIndex(StockEntry.objects.filter(enterprise_id=1).order_by('-date_updated')[:1], 'stockentry_ent_updated_idx')
+
+    def test_history_purge(self):
+        self.assertUsesIndex(
+            ApiRequestsHistoryRecord.objects.filter(datetime__lt=datetime.now(tz=TZ_MOSCOW), response_status_code=200).order_by('datetime')[:1000],
+            'history_datetime_action_idx'
+        )
+
+
+class SearchTests(TestCase):
+
+    def test_parse_search_query(self):
+        self.assertEqual(parse_search_query(' молоко  -сыр 3,2% - '), (['молоко', '3,2%'], ['сыр']))
+
+    def test_include_exclude(self):
+        for guid, name, gtin in ((1, 'Молоко 3,2%', '4600001'), (2, 'Молоко 2,5% в пленке', '4600002'), (3, 'Сыр', '4600003')):
+            ProductItem.objects.create(
+                guid=uuid.UUID(int=guid), uuid=uuid.UUID(int=guid), name=name, gtin=gtin, product_type=5,
+                product_guid=uuid.UUID(int=0), subproduct_guid=uuid.UUID(int=0)
+            )
+
+        def names(text: str) -> list[str]:
+            return sorted(search(ProductItem.objects.all(), text, fields=['name', 'gtin'], vector_field='name').values_list('name', flat=True))
+
+        self.assertEqual(names('Молоко -пленке'), ['Молоко 3,2%'])
+        self.assertEqual(names('4600003'), ['Сыр'])
+        self.assertEqual(names('-Молоко'), ['Сыр'])
+
+
+class CurrentStockTests(TestCase):
+
+    def setUp(self):
+        business_entity = BusinessEntity.objects.create(guid=uuid.uuid4(), uuid=uuid.uuid4(), type=1, name='ХС')
+        self.enterprise = Enterprise.objects.create(business_entity=business_entity, guid=uuid.uuid4(), uuid=uuid.uuid4(), type=1, name='Предприятие')
+        self.unit = Unit.objects.create(guid=uuid.uuid4(), name='кг')
+        self.main = StockEntryMain.objects.create(guid=uuid.uuid4())
+
+    def add_version(self, volume: int, updated: datetime, is_last: bool = True, is_active: bool = True) -> StockEntry:
+        return StockEntry.objects.create(
+            main=self.main, enterprise=self.enterprise, guid=self.main.guid, uuid=uuid.uuid4(),
+            is_active=is_active, is_last=is_last, status=0, date_created=updated, date_updated=updated,
+            entry_number=1, product_type=1, product_item_name='Молоко', volume=volume, unit=self.unit,
+            date_produced_1='2024-01-01', date_produced=updated, date_expiry_1='2024-02-01', date_expiry=updated,
+            is_perishable=False
+        )
+
+    def test_refresh(self):
+        now = datetime.now(tz=TZ_MOSCOW)
+        first = self.add_version(10, now)
+        refresh_current_stock([self.main.guid])
+        self.assertEqual(CurrentStockEntry.objects.get().stock_entry, first)
+
+        # a stale version still marked last loses to the latest one
+        second = self.add_version(7, now + timedelta(hours=1))
+        refresh_current_stock([self.main.guid])
+        current = CurrentStockEntry.objects.get()
+        self.assertEqual((current.stock_entry, current.volume), (second, 7))
+
+        self.main.comment_text = 'проверить'
+        self.main.save()
+        refresh_current_stock_main(self.main)
+        self.assertEqual(CurrentStockEntry.objects.get().comment_text, 'проверить')
+
+        StockEntry.objects.update(is_active=False)
+        refresh_current_stock([str(self.main.guid).upper()])
+        self.assertFalse(CurrentStockEntry.objects.exists())
+
+
+class SyncCheckpointTests(TestCase):
+
+    def test_resume(self):
+        guid = uuid.uuid4()
+        checkpoint = start_checkpoint('update_stock_entries', guid, lambda: {'mode': 'INITIAL'})
+        advance_checkpoint(checkpoint, 1000, 2500)
+        self.assertFalse(is_checkpoint_done(checkpoint))
+
+        # the window of an interrupted sync is kept
+        resumed = start_checkpoint('update_stock_entries', guid, lambda: {'mode': 'CHANGES'})
+        self.assertEqual((resumed.id, resumed.mode, resumed.list_offset, resumed.total), (checkpoint.id, 'INITIAL', 1000, 2500))
+
+        advance_checkpoint(resumed, 1000, 2500)
+        advance_checkpoint(resumed, 1000, 2500)
+        self.assertTrue(is_checkpoint_done(resumed))
+
+        # another task holding the old position must not save its page
+        with self.assertRaises(RuntimeError):
+            advance_checkpoint(checkpoint, 1000, 2500)
+
+        finish_checkpoint(resumed)
+        self.assertFalse(SyncCheckpoint.objects.exists())
+
+    @override_settings(VETIS_SYNC_CHECKPOINT_MAX_AGE=0)
+    def test_stale(self):
+        guid = uuid.uuid4()
+        checkpoint = start_checkpoint('reload_enterprises', guid)
+        advance_checkpoint(checkpoint, 1000, 2500)
+        self.assertEqual(start_checkpoint('reload_enterprises', guid).list_offset, 0)
+
+
+class DictionarySyncTests(FakeServerTestCase):
+    """Lists longer than a page (1000), interrupted after the first page"""
+
+    data = FakeData(product_items=1200, enterprises=1200)
+
+    def interrupt(self, request_class: type):
+        def send(soap_request, credentials):
+            if isinstance(soap_request, request_class) and soap_request.list_offset > 0:
+                raise VetisConnectionError('interrupted')
+            return send_soap_request(soap_request, credentials)
+        return mock.patch('vetis_api.tasks.send_soap_request', send)
+
+    def test_product_items(self):
+        reload_product_items(self.credentials.id, self.business_entity.id)
+        product_items = ProductItem.objects.filter(producer_guid=self.business_entity.guid)
+        removed = ProductItem.objects.create(
+            guid=uuid.uuid4(), uuid=uuid.uuid4(), name='Снято с производства', product_type=1,
+            product_guid=self.data.product_guid(0), subproduct_guid=self.data.subproduct_guid(0), producer_guid=self.business_entity.guid,
+        )
+        self.assertEqual(product_items.filter(is_active=True).count(), 1201)
+
+        with self.interrupt(ProductItemListRequest), self.assertRaises(VetisConnectionError):
+            reload_product_items(self.credentials.id, self.business_entity.id)
+        # items of the second page and the removed one are deactivated only when the list is complete
+        self.assertEqual(product_items.filter(is_active=True).count(), 1201)
+        self.assertEqual(SyncCheckpoint.objects.get().list_offset, 1000)
+
+        reload_product_items(self.credentials.id, self.business_entity.id)
+        self.assertEqual(product_items.filter(is_active=True).count(), 1200)
+        self.assertFalse(ProductItem.objects.get(pk=removed.pk).is_active)
+        self.assertFalse(SyncCheckpoint.objects.exists())
+
+    def test_enterprises(self):
+        reload_enterprises(self.credentials.id, self.business_entity.id)
+        enterprises = self.business_entity.enterprise_set.all()
+        removed = Enterprise.objects.create(business_entity=self.business_entity, guid=uuid.uuid4(), uuid=uuid.uuid4(), type=1, name='Закрыто', is_active=True)
+        self.assertEqual(enterprises.filter(is_active=True).count(), 1201)
+
+        with self.interrupt(ActivityLocationListRequest), self.assertRaises(VetisConnectionError):
+            reload_enterprises(self.credentials.id, self.business_entity.id)
+        self.assertEqual(enterprises.filter(is_active=True).count(), 1201)
+
+        reload_enterprises(self.credentials.id, self.business_entity.id)
+        self.assertEqual(enterprises.filter(is_active=True).count(), 1200)
+        self.assertFalse(Enterprise.objects.get(pk=removed.pk).is_active)
+
+
+class HistoryPayloadTests(TestCase):
+
+    def assertRoundTrip(self):
+        record = ApiRequestsHistoryRecord(soap_action='getStockEntryListRequest')
+        record.set_payloads('<request>запрос</request>', None)
+        record.save()
+
+        record = ApiRequestsHistoryRecord.objects.get(id=record.id)
+        self.assertEqual(record.request_size, len('<request>запрос</request>'.encode('utf-8')))
+        self.assertEqual((record.soap_request, record.response_body), ('<request>запрос</request>', None))
+        return record
+
+    def test_zlib(self):
+        record = self.assertRoundTrip()
+        self.assertEqual(record.payload_storage, 'zlib')
+        self.assertIsNotNone(record.request_data)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as payload_dir, self.settings(VETIS_HISTORY_PAYLOAD_STORAGE='file', VETIS_HISTORY_PAYLOAD_DIR=payload_dir):
+            record = self.assertRoundTrip()
+            self.assertIsNone(record.request_data)
+
+            # identical texts are stored once
+            self.assertRoundTrip()
+            path = get_payload_storage('file').get_path(record.request_hash)
+            self.assertEqual(list(path.parent.iterdir()), [path])
+
+    def test_bytes(self):
+        body = '<response>ответ</response>'.encode('utf-8')
+        record = ApiRequestsHistoryRecord(soap_action='getStockEntryListRequest')
+        record.set_payloads('<request>запрос</request>', body)
+        self.assertEqual(record.response_body, '<response>ответ</response>')
+        record.save()
+
+        record = ApiRequestsHistoryRecord.objects.get(id=record.id)
+        self.assertEqual((record.response_size, record.response_body), (len(body), '<response>ответ</response>'))
+
+        # not UTF-8, e.g. an error page of a proxy
+        record.set_payloads(None, 'ошибка'.encode('cp1251'))
+        self.assertEqual(record.response_size, 6)
+        self.assertIn('\ufffd', record.response_body)
+
+    def test_list_page(self):
+        record = self.assertRoundTrip()
+
+        # texts are neither read nor decompressed for the list
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('vetis_api:api_requests_history'))
+        self.assertContains(response, reverse('vetis_api:api_requests_history_detail', args=[record.id]))
+        self.assertNotIn('request_data', ' '.join(query['sql'] for query in queries))
+
+
+@override_settings(VETIS_HISTORY_FLUSH_INTERVAL=0.05)
+class HistoryWriterTests(TransactionTestCase):
+
+    def entry(self, soap_action: str) -> HistoryEntry:
+        return HistoryEntry(soap_action, 'test', 200, '<request/>', '<response/>')
+
+    def test_not_rolled_back(self):
+        writer = HistoryWriter()
+        entries = [self.entry(f'action{i}') for i in range(3)]
+
+        # history of a failed sync is kept
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            for entry in entries:
+                writer.put(entry)
+            raise RuntimeError('sync failed')
+
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(writer.written, 3)
+        self.assertEqual(
+            list(ApiRequestsHistoryRecord.objects.order_by('datetime').values_list('soap_action', 'datetime')),
+            [(entry.soap_action, entry.datetime) for entry in entries]
+        )
+        self.assertEqual(ApiRequestsHistoryRecord.objects.first().response_body, '<response/>')
+
+    @override_settings(VETIS_HISTORY_QUEUE_SIZE=1, VETIS_HISTORY_BATCH_SIZE=1)
+    def test_queue_full(self):
+        writer = HistoryWriter()
+
+        # database is stuck, calls must not wait for it
+        is_released = Event()
+        write = writer._write
+        writer._write = lambda batch: is_released.wait() and write(batch)
+
+        for i in range(5):
+            writer.put(self.entry(f'action{i}'))
+        self.assertGreaterEqual(writer.dropped, 3)
+
+        is_released.set()
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(writer.written + writer.dropped, 5)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite(self):
+        # written at once, a writer thread would lock the database for the sync transaction
+        record_history('getStockEntryListRequest', 'test', 200, '<request/>', '<response/>')
+        self.assertEqual(ApiRequestsHistoryRecord.objects.count(), 1)
+
+
+@override_settings(VETIS_HISTORY_RETENTION={'payloads': 7, 'failed_payloads': 30, 'records': 180, 'failed_records': 365})
+class HistoryRetentionTests(TestCase):
+
+    def test_purge(self):
+        now = datetime.now(tz=TZ_MOSCOW)
+        for days in (1, 10, 100, 200, 400):
+            for status in (200, 500, None):
+                record = ApiRequestsHistoryRecord(datetime=now - timedelta(days=days), soap_action=f'{days}', response_status_code=status)
+                record.set_payloads('<request/>', '<response/>')
+                record.save()
+
+        with tempfile.TemporaryDirectory() as payload_dir, self.settings(VETIS_HISTORY_PAYLOAD_DIR=payload_dir):
+            result = purge_history(now)
+        self.assertEqual(result, {'records': 2, 'failed_records': 2, 'payloads': 2, 'failed_payloads': 4, 'files': 0})
+
+        def kept(records) -> list[tuple]:
+            return sorted((int(soap_action), status or 0) for soap_action, status in records.values_list('soap_action', 'response_status_code'))
+
+        records = ApiRequestsHistoryRecord.objects.all()
+        self.assertEqual(kept(records), [(1, 0), (1, 200), (1, 500), (10, 0), (10, 200), (10, 500), (100, 0), (100, 200), (100, 500), (200, 0), (200, 500)])
+        self.assertEqual(kept(records.exclude(payload_storage='')), [(1, 0), (1, 200), (1, 500), (10, 0), (10, 500)])
+        self.assertIsNone(records.get(soap_action='100', response_status_code=200).response_body)
+
+
+@override_settings(VETIS_HISTORY_BUFFERED=False)
+class SendSoapRequestsTests(TestCase):
+
+    def test_failed_request(self):
+        credentials = VetisCredentials.objects.create(name='test', login='login', password='password', api_key='key', service_id='service', issuer_id='issuer')
+        soap_requests = [ProductByGuidRequest(str(uuid.UUID(int=i))) for i in range(3)]
+
+        def post(soap_request, credentials):
+            if soap_request is soap_requests[1]:
+                raise VetisConnectionError('timeout')
+            response = Response()
+            response.status_code = 200
+            response._content = b'<response/>'
+            return response, 'http://vetis/platform/services/2.1/ProductService'
+
+        # responses received before and after the failed request are recorded
+        with mock.patch('vetis_api.transport._post_soap_request', post), self.assertRaises(VetisConnectionError):
+            send_soap_requests(soap_requests, credentials, concurrency=2)
+        self.assertEqual(ApiRequestsHistoryRecord.objects.count(), 2)
+
+
+@override_settings(VETIS_SHARED_CACHE='default', VETIS_STOCK_LIST_COUNT=10, VETIS_STREAM_BATCH_SIZE=5, VETIS_PAGE_PIPELINE_WINDOW=2)
+class StockEntryPipelineTests(FakeServerTestCase):
+    """update_stock_entries against the fake server: 5 pages of 10 entries, 2 pages requested ahead"""
+
+    data = FakeData(stock_entries=50)
+
+    def setUp(self):
+        super().setUp()
+        # the first poll is made at once instead of after the default processing time
+        get_shared_cache().clear()
+        get_shared_cache().set('vetis-application-time:GetStockEntryListRequest', 0.0)
+
+        self.enterprise = Enterprise.objects.create(
+            business_entity=self.business_entity, guid=self.data.make_guid('test-enterprise'), uuid=self.data.make_guid('test-enterprise-version'), type=1, name='Склад',
+        )
+        seed_dictionaries(self.data, self.credentials)
+        for guid, name in UNITS:
+            Unit.objects.create(guid=guid, name=name)
+
+        self.pages = [self.get_page_uuids(offset) for offset in range(0, 50, 10)]
+        self.submitted = []  # list offsets of submitted applications
+        self.saved = []  # (list offset of the page, checkpoint offset after it was saved, offsets submitted by then)
+
+    def get_page_uuids(self, offset: int) -> list[str]:
+        page = ET.fromstring(get_stock_page(self.data, str(self.enterprise.guid), 10, offset))
+        return [find_text(stock_entry_xml, 'bs:uuid') for stock_entry_xml in page.iterfind('.//vd:stockEntry', NAMESPACES)]
+
+    def run_update(self):
+        def submit(soap_request, credentials):
+            if isinstance(soap_request, GetStockEntryListRequest):
+                self.submitted.append(soap_request.list_offset)
+            return submit_application(soap_request, credentials)
+
+        def save(stream, enterprise, credentials, checkpoint, list_count):
+            list_offset = checkpoint.list_offset
+            save_stock_entries_checkpointed(stream, enterprise, credentials, checkpoint, list_count)
+            self.saved.append((list_offset, SyncCheckpoint.objects.get(pk=checkpoint.pk).list_offset, list(self.submitted)))
+
+        # vet documents of the saved entries are loaded after the journal, that is not the pipeline
+        with (
+            mock.patch('vetis_api.tasks.submit_application', submit),
+            mock.patch('vetis_api.tasks.save_stock_entries_checkpointed', save),
+            mock.patch('vetis_api.tasks.update_stock_entry_main_records'),
+        ):
+            return update_stock_entries(self.credentials.id, 'login', self.enterprise.id)
+
+    def fail_on(self, stock_entry_uuid: str):
+        """Fails the batch of the entry, after the batches before it were saved"""
+
+        def save(stock_entry_xmls, *args):
+            if stock_entry_uuid in [find_text(stock_entry_xml, 'bs:uuid') for stock_entry_xml in stock_entry_xmls]:
+                raise VetisConnectionError('interrupted')
+            return save_stock_entries(stock_entry_xmls, *args)
+
+        return mock.patch('vetis_api.tasks.save_stock_entries', save)
+
+    def get_stored_pages(self) -> list[int]:
+        """Number of stored entries of every page"""
+        return [StockEntry.objects.filter(uuid__in=uuids).count() for uuids in self.pages]
+
+    def test_pipeline(self):
+        self.run_update()
+
+        self.assertEqual(self.submitted, [0, 10, 20, 30, 40])
+        # pages are saved in order, each moves the checkpoint once
+        self.assertEqual([(list_offset, checkpoint_offset) for list_offset, checkpoint_offset, _ in self.saved], [(0, 10), (10, 20), (20, 30), (30, 40), (40, 50)])
+        # no more than the window is submitted ahead of the page being saved
+        for list_offset, _, submitted in self.saved:
+            self.assertLessEqual(max(submitted), list_offset + 2 * 10)
+        self.assertEqual(self.get_stored_pages(), [10] * 5)
+        self.assertFalse(SyncCheckpoint.objects.exists())
+        self.assertIsNotNone(Enterprise.objects.get(pk=self.enterprise.pk).stock_entries_last_updated)
+
+    def test_failed_page(self):
+        # the second batch of the third page
+        with self.fail_on(self.pages[2][5]), self.assertRaises(VetisConnectionError):
+            self.run_update()
+
+        self.assertEqual([list_offset for list_offset, _, _ in self.saved], [0, 10])
+        # the first batch of the failed page is rolled back with it
+        self.assertEqual(self.get_stored_pages(), [10, 10, 0, 0, 0])
+        self.assertEqual(SyncCheckpoint.objects.get().list_offset, 20)
+        self.assertIsNone(Enterprise.objects.get(pk=self.enterprise.pk).stock_entries_last_updated)
+
+        # resumed from the failed page
+        self.submitted, self.saved = [], []
+        self.run_update()
+        self.assertEqual(self.submitted, [20, 30, 40])
+        self.assertEqual(self.get_stored_pages(), [10] * 5)
+        self.assertFalse(SyncCheckpoint.objects.exists())
+
+
+@override_settings(VETIS_SHARED_CACHE='default')
+class ApplicationTests(FakeServerTestCase):
+    """Scheduled mode: collect_application_result polls the fake server and re-arms itself"""
+
+    server_config = FakeServerConfig(processing_delay=0.5)
+
+    def setUp(self):
+        super().setUp()
+        get_shared_cache().clear()
+        self.handled = []
+
+        def handler(response, credentials, state):
+            self.handled.append((response, credentials, state))
+            return 'Обработано'
+
+        application_handler('test')(handler)
+        self.addCleanup(_handlers.pop, 'test', None)
+
+    def schedule(self) -> dict:
+        """Submits application, returns arguments of the scheduled collect_application_result"""
+
+        soap_request = GetStockEntryListRequest(self.data.make_guid('test-enterprise'), 'key', 'service', 'issuer', 'login', list_count=10)
+        with mock.patch.object(collect_application_result, 'apply_async') as apply_async:
+            schedule_application('test', soap_request, self.credentials, {'page': 0})
+        return apply_async.call_args.kwargs
+
+    def collect(self, scheduled: dict) -> tuple[EagerResult, dict | None]:
+        """Runs scheduled collect_application_result, returns its result and the next scheduled call"""
+
+        with mock.patch.object(collect_application_result, 'apply_async') as apply_async:
+            result = collect_application_result.apply(kwargs=scheduled['kwargs'])
+        return result, apply_async.call_args.kwargs if apply_async.called else None
+
+    def test_in_process(self):
+        scheduled = self.schedule()
+        self.assertEqual(scheduled['countdown'], DEFAULT_PROCESSING_TIME)
+
+        result, rescheduled = self.collect(scheduled)
+        self.assertEqual(result.get(), 'Ожидание результата обработки запроса (статус IN_PROCESS)')
+        self.assertEqual(self.handled, [])
+        self.assertEqual(rescheduled['kwargs']['try_num'], 1)
+        self.assertEqual(rescheduled['kwargs']['state'], {'page': 0})
+        self.assertIsNotNone(rescheduled['kwargs']['last_poll_at'])
+        self.assertTrue(MIN_POLL_DELAY * 2 <= rescheduled['countdown'] <= MAX_POLL_DELAY)
+
+    def test_completed(self):
+        result, rescheduled = self.collect(self.schedule())
+        time.sleep(self.server_config.processing_delay)
+
+        result, rescheduled = self.collect(rescheduled)
+        self.assertEqual(result.get(), 'Обработано')
+        self.assertIsNone(rescheduled)
+        [(response, credentials, state)] = self.handled
+        self.assertIn(b'stockEntryList', response.content)
+        self.assertEqual((credentials, state), (self.credentials, {'page': 0}))
+        # the average moves towards the observed 0.5-1 seconds
+        self.assertLess(get_processing_time('GetStockEntryListRequest'), DEFAULT_PROCESSING_TIME)
+
+    def test_rejected(self):
+        self.server.config.reject_rate = 1.0
+        self.addCleanup(setattr, self.server.config, 'reject_rate', 0.0)
+        scheduled = self.schedule()
+        time.sleep(self.server_config.processing_delay)
+
+        result, rescheduled = self.collect(scheduled)
+        self.assertEqual(result.state, states.FAILURE)
+        self.assertIsInstance(result.result, VetisApplicationError)
+        self.assertEqual([code for code, text in result.result.errors], ['MERC13001'])
+        self.assertIsNone(rescheduled)
+        self.assertEqual(self.handled, [])
+
+    def test_timeout(self):
+        scheduled = self.schedule()
+        scheduled['kwargs']['submitted_at'] -= get_application_timeout() + 1
+
+        result, rescheduled = self.collect(scheduled)
+        self.assertEqual(result.state, states.FAILURE)
+        self.assertEqual(result.result.status, 'IN_PROCESS')
+        self.assertIsNone(rescheduled)
+
+    def test_poll_delay(self):
+        request_type = 'GetStockEntryListRequest'
+        self.assertEqual(get_poll_delay(request_type, 0, 0), DEFAULT_PROCESSING_TIME)
+        # submitted ahead of time, may be ready already
+        self.assertEqual(get_poll_delay(request_type, 100, 0), 0)
+        self.assertEqual(get_poll_delay(request_type, 100, 1), MIN_POLL_DELAY * 2)
+        self.assertEqual(get_poll_delay(request_type, 0, 10), MAX_POLL_DELAY)
+
+        with mock.patch('vetis_api.applications.time', return_value=1010.0):
+            # completed between the poll at 1008 and now: 9 seconds
+            record_processing_time(request_type, 1000.0, 1008.0)
+            self.assertAlmostEqual(get_processing_time(request_type), DEFAULT_PROCESSING_TIME + PROCESSING_TIME_WEIGHT * (9 - DEFAULT_PROCESSING_TIME))
+
+            # an outlier moves the average by its weight only, polls are still made within MAX_POLL_DELAY
+            record_processing_time(request_type, -10000.0, None)
+            self.assertLess(get_processing_time(request_type), 10000 / 2)
+            self.assertEqual(get_poll_delay(request_type, 0, 0), MAX_POLL_DELAY)
+
+            for _ in range(50):
+                record_processing_time(request_type, 1009.0, None)
+            self.assertAlmostEqual(get_processing_time(request_type), 0.5, places=3)
+            self.assertAlmostEqual(get_poll_delay(request_type, 0, 0), 0.5, places=3)
+            self.assertEqual(get_poll_delay(request_type, 0, 2), MIN_POLL_DELAY * 4)
+
+
+@override_settings(VETIS_LOCK_CACHE='vetis-locks')
+class CacheTokenBucketTests(SimpleTestCase):
+
+    def test_concurrent_reservations(self):
+        # refill is negligible, every reservation must be recorded
+        bucket = CacheTokenBucket(f'test-bucket:{uuid.uuid4()}', rate=0.001, burst=10)
+
+        def reserve():
+            for _ in range(200):
+                bucket.reserve()
+
+        threads = [Thread(target=reserve) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tokens, _ = bucket.cache.get(bucket.key)
+        self.assertEqual(round(tokens), 10 - 1600)
+
+    def test_wait(self):
+        bucket = CacheTokenBucket(f'test-bucket:{uuid.uuid4()}', rate=2.0, burst=1)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.5, delta=0.01)
+
+    @override_settings(VETIS_LOCK_CACHE='vetis')
+    def test_file_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CacheTokenBucket('test-bucket', rate=1.0, burst=1)
+
+
+def reserve_in_process(key: str, count: int):
+    for _ in range(count):
+        DatabaseTokenBucket(key, rate=0.001, burst=10).reserve()
+
+
+class DatabaseTokenBucketTests(TransactionTestCase):
+    databases = '__all__'
+
+    def test_wait(self):
+        bucket = DatabaseTokenBucket(f'test-bucket:{uuid.uuid4()}', rate=2.0, burst=1)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.5, delta=0.01)
+
+    def test_default(self):
+        # LocMemCache is not shared by worker processes
+        self.assertIsInstance(get_bucket(1, 'ProductService'), DatabaseTokenBucket)
+
+    def test_processes(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('worker processes need a database on disk')
+
+        key = f'test-bucket:{uuid.uuid4()}'
+        # forked processes open connections of their own
+        connections.close_all()
+        processes = [multiprocessing.get_context('fork').Process(target=reserve_in_process, args=(key, 50)) for _ in range(2)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertEqual([process.exitcode for process in processes], [0, 0])
+        # refill is negligible, reservations of both processes are taken from one budget
+        self.assertEqual(round(RateLimitBucket.objects.get(key=key).tokens), 10 - 100)
+
+
+class RetryPolicyTests(TestCase):
+
+    def test_can_retry_exception(self):
+        refused = requests.exceptions.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused')))
+        reset = requests.exceptions.ConnectionError('Connection aborted.')
+        read_timeout = requests.exceptions.ReadTimeout()
+        connect_timeout = requests.exceptions.ConnectTimeout()
+
+        policy = get_retry_policy('GetProductItemList')
+        for e in (refused, reset, read_timeout, connect_timeout):
+            self.assertTrue(policy.can_retry_exception(e))
+        self.assertFalse(policy.can_retry_exception(requests.exceptions.InvalidURL()))
+
+        # submitted application may have been created, only requests that were not sent are repeated
+        policy = get_retry_policy('submitApplicationRequest')
+        self.assertTrue(policy.can_retry_exception(refused))
+        self.assertTrue(policy.can_retry_exception(connect_timeout))
+        self.assertFalse(policy.can_retry_exception(reset))
+        self.assertFalse(policy.can_retry_exception(read_timeout))
+
+    def test_can_retry_response(self):
+        policy = get_retry_policy('GetProductItemList')
+        self.assertTrue(policy.can_retry_response(VetisHttpError('Bad Gateway', 502)))
+        self.assertFalse(policy.can_retry_response(VetisHttpError('Internal Server Error', 500)))
+        self.assertTrue(policy.can_retry_response(VetisSoapFault(500, 'soap:Server', 'error', 'internalServiceErrorFault')))
+        self.assertFalse(policy.can_retry_response(VetisSoapFault(500, 'soap:Server', 'error', 'incorrectRequestFault')))
+
+        policy = get_retry_policy('submitApplicationRequest')
+        self.assertFalse(policy.can_retry_response(VetisHttpError('Bad Gateway', 502)))
+
+    def test_submit_read_timeout(self):
+        credentials = VetisCredentials.objects.create(name='test', login='login', password='password', api_key='key', service_id='service', issuer_id='issuer')
+        soap_request = GetStockEntryListRequest(str(uuid.uuid4()), 'key', 'service', 'issuer', 'login')
+        session = mock.Mock()
+
+        with mock.patch('vetis_api.transport.get_session', return_value=session), mock.patch('vetis_api.transport.get_bucket', return_value=None), mock.patch('vetis_api.transport.sleep'):
+            session.post.side_effect = requests.exceptions.ReadTimeout()
+            with self.assertRaises(VetisConnectionError):
+                _post_soap_request(soap_request, credentials)
+            self.assertEqual(session.post.call_count, 1)
+
+            session.post.reset_mock()
+            session.post.side_effect = requests.exceptions.ConnectTimeout()
+            with self.assertRaises(VetisConnectionError):
+                _post_soap_request(soap_request, credentials)
+            self.assertEqual(session.post.call_count, get_retry_policy('submitApplicationRequest').attempts)
+
+
+@override_settings(VETIS_LOCK_CACHE='vetis-locks')
+class SingleFlightTests(TestCase):
+
+    def test_concurrent_calls(self):
+        flight = SingleFlight(f'test-{uuid.uuid4()}')
+        is_released = Event()
+        calls = []
+        results = []
+
+        def load():
+            calls.append(1)
+            is_released.wait(5)
+            return 'record'
+
+        threads = [Thread(target=lambda: results.append(flight.do(('product', 1), load))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        is_released.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['record'] * 4)
+
+    def test_released_on_commit(self):
+        flight = SingleFlight(f'test-{uuid.uuid4()}')
+
+        def claim_elsewhere():
+            claimed = []
+            thread = Thread(target=lambda: claimed.append(flight.claim(('product', 1))))
+            thread.start()
+            thread.join()
+            return claimed[0]
+
+        # the record is not visible to other workers before commit, neither is the lock released
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flight.do(('product', 1), lambda: 'record'), 'record')
+            self.assertIsNone(claim_elsewhere())
+
+        self.assertIsNotNone(claim_elsewhere())
+
+    def test_reentrant(self):
+        flight = SingleFlight(f'test-{uuid.uuid4()}')
+
+        # the same record updated again in the transaction it was loaded in
+        with self.captureOnCommitCallbacks(execute=True):
+            flight.do(('product', 1), lambda: 'record')
+            flight.do(('other', 1), lambda: 'record')
+            self.assertEqual(flight.do(('product', 1), lambda: 'updated'), 'updated')
+            self.assertIsNotNone(flight.claim(('product', 1)))
+
+    def test_released_on_error(self):
+        flight = SingleFlight(f'test-{uuid.uuid4()}')
+
+        def load():
+            raise RuntimeError('Vetis is down')
+
+        with self.captureOnCommitCallbacks():
+            with self.assertRaises(RuntimeError):
+                flight.do(('product', 1), load)
+            self.assertIsNotNone(flight.claim(('product', 1)))
+
+    def test_owner(self):
+        key = f'test-lock:{uuid.uuid4()}'
+        lock = CacheLock(key, timeout=0.05)
+        self.assertTrue(lock.claim())
+
+        # expired and taken by another owner, who must keep it
+        time.sleep(0.1)
+        other_lock = CacheLock(key, timeout=5)
+        self.assertTrue(other_lock.claim())
+        lock.release()
+        self.assertFalse(CacheLock(key, timeout=5).claim())
+
+        with self.assertRaises(LockTimeout):
+            CacheLock(key, timeout=5).acquire(wait=0.05)
+
+
+class EnvelopeTests(SimpleTestCase):
+    """Compiled envelopes render exactly what render_to_string renders with the same templates"""
+
+    guid = '"0e9b2c5a\'-<&>'
+    login = 'O\'Brien & "Склад" <1>'
+    api_key = 'key&<>'
+
+    def get_requests(self) -> list[AbstractRequest]:
+        begin_date = datetime(2024, 1, 31, 23, 59, 59, tzinfo=TZ_MOSCOW)
+        end_date = datetime(2024, 2, 1, 0, 30, tzinfo=TZ_MOSCOW) + timedelta(hours=5)
+        application = {'api_key': self.api_key, 'service_id': 'mercury-g2b.service:2.0', 'issuer_id': self.guid, 'initiator_login': self.login}
+        return [
+            ProductByGuidRequest(self.guid),
+            SubproductByGuidRequest(self.guid),
+            ProductItemByGuidRequest(self.guid),
+            ProductItemListRequest(self.guid, 1000, 2000),
+            BusinessEntityByGuidRequest(self.guid),
+            EnterpriseByGuidRequest(self.guid),
+            ActivityLocationListRequest(self.guid, 1000, 0),
+            GetStockEntryListRequest(self.guid, list_count=1000, list_offset=1000, **application),
+            GetStockEntryChangesListRequest(self.guid, begin_date, end_date, **application),
+            GetStockEntryVersionListRequest(self.guid, self.guid, **application),
+            GetVetDocumentByUuidRequest(self.guid, self.guid, **application),
+            ReceiveApplicationResultRequest(self.api_key, self.guid, self.guid),
+        ]
+
+    def test_parity(self):
+        soap_requests = self.get_requests()
+        # every request class is covered
+        self.assertEqual(len({soap_request.template_name for soap_request in soap_requests}), len(list(TEMPLATES_DIR.iterdir())))
+
+        for soap_request in soap_requests:
+            with self.subTest(soap_request.__class__.__name__):
+                body = soap_request.get_body()
+                expected = render_to_string(f'vetis_api/xml/{soap_request.template_name}', {'vetis_request': soap_request})
+                self.assertEqual(body, expected.encode('utf-8'))
+
+                # escaped values are read back as they were
+                body_xml = ET.fromstring(body)
+                self.assertIn(self.guid, [element.text for element in body_xml.iter()])
+                self.assertNotIn(self.guid.encode('utf-8'), body)
+
+    def test_dates(self):
+        [soap_request] = [soap_request for soap_request in self.get_requests() if isinstance(soap_request, GetStockEntryChangesListRequest)]
+        body_xml = ET.fromstring(soap_request.get_body())
+        self.assertEqual(body_xml.findtext('.//bs:beginDate', namespaces=NAMESPACES), '2024-01-31T23:59:59')
+        self.assertEqual(body_xml.findtext('.//bs:endDate', namespaces=NAMESPACES), '2024-02-01T05:30:00')
+        self.assertEqual(body_xml.findtext('.//vd:login', namespaces=NAMESPACES), self.login)
@@ -0,0 +1,307 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from threading import Lock
+from time import sleep
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .exceptions import VetisConnectionError, VetisHttpError, get_response_error
+from .history import record_history
+from .models import VetisCredentials
+from .ratelimit import get_bucket
+from .xml.build_xml import AbstractRequest
+
+
+# PROD
+ENDPOINTS_PROD = {
+    'ProductService': 'https://api.vetrf.ru/platform/services/2.1/ProductService',
+    'EnterpriseService': 'https://api.vetrf.ru/platform/services/2.1/EnterpriseService',
+    'ApplicationManagementService': 'https://api.vetrf.ru/platform/services/2.1/ApplicationManagementService',
+}
+
+# TEST
+ENDPOINTS_TEST = {
+    'ProductService': 'https://api2.vetrf.ru:8002/platform/services/2.1/ProductService',
+    'EnterpriseService': 'https://api2.vetrf.ru:8002/platform/services/2.1/EnterpriseService',
+    'ApplicationManagementService': 'https://api2.vetrf.ru:8002/platform/services/2.1/ApplicationManagementService',
+}
+
+
+WARM_UP_TIMEOUT = (2, 5)  # seconds to connect, to read; warm up must not hold worker start
+
+_sessions = {}
+_sessions_lock = Lock()
+
+
+def get_endpoint_url(endpoint_name: str, credentials: VetisCredentials) -> str:
+    # e.g. local fake server, see manage.py vetis_fake_server
+    base_url = getattr(settings, 'VETIS_ENDPOINT_BASE_URL', None)
+    if base_url:
+        return f'{base_url.rstrip("/")}/platform/services/2.1/{endpoint_name}'
+
+    endpoints = ENDPOINTS_PROD if credentials.is_productive else ENDPOINTS_TEST
+    return endpoints[endpoint_name]
+
+
+def _create_session() -> requests.Session:
+    pool_size = getattr(settings, 'VETIS_HTTP_POOL_SIZE', 10)
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+
+    # auth is passed with every request: credentials may be edited while worker is running
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_session(credentials: VetisCredentials, endpoint_url: str) -> requests.Session:
+    """
+    Returns keep-alive session for credentials and endpoint host.
+    Sessions live for the whole process and are shared between calls.
+    """
+
+    key = (credentials.id, urlsplit(endpoint_url).netloc)
+
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _create_session()
+            _sessions[key] = session
+
+    return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def warm_up_sessions():
+    """
+    Opens connections to Vetis endpoints for all credentials,
+    so the first real request doesn't pay for TCP+TLS handshake.
+    """
+
+    for credentials in VetisCredentials.objects.all():
+        # the same URLs as requests use, VETIS_ENDPOINT_BASE_URL included
+        hosts = {}
+        for endpoint_name in ENDPOINTS_PROD:
+            endpoint_url = get_endpoint_url(endpoint_name, credentials)
+            hosts.setdefault(urlsplit(endpoint_url).netloc, endpoint_url)
+
+        for endpoint_url in hosts.values():
+            session = get_session(credentials, endpoint_url)
+            try:
+                session.head(endpoint_url, auth=(credentials.login, credentials.password), timeout=WARM_UP_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                print(f'Session warm up failed for {endpoint_url}: {e}')
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How many times and when to repeat a request.
+    Requests that failed to connect are always safe to repeat. Timeouts after
+    the request was sent and server errors are repeated only for idempotent actions.
+    """
+
+    attempts: int = 4
+    idempotent: bool = True
+    backoff_base: float = 1.0  # seconds
+    backoff_max: float = 30.0
+
+    def get_delay(self, try_num: int) -> float:
+        """Exponential backoff with jitter: random value in [delay/2, delay]"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (try_num - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def can_retry_exception(self, e: requests.exceptions.RequestException) -> bool:
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(e, requests.exceptions.ConnectionError):
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if isinstance(reason, NewConnectionError):
+                return True
+            return self.idempotent
+        if isinstance(e, requests.exceptions.Timeout):
+            return self.idempotent
+        return False
+
+    def can_retry_response(self, error: VetisHttpError) -> bool:
+        return self.idempotent and error.is_retryable
+
+
+RETRY_POLICIES = {
+    # each submit creates an application in Vetis
+    'submitApplicationRequest': RetryPolicy(attempts=3, idempotent=False),
+}
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def get_retry_policy(soap_action: str) -> RetryPolicy:
+    return RETRY_POLICIES.get(soap_action, DEFAULT_RETRY_POLICY)
+
+
+def get_timeout() -> tuple[float, float]:
+    return (
+        getattr(settings, 'VETIS_CONNECT_TIMEOUT', 10),
+        getattr(settings, 'VETIS_READ_TIMEOUT', 60),
+    )
+
+
+def _post_soap_request(soap_request: AbstractRequest, credentials: VetisCredentials) -> tuple[requests.Response, str]:
+    """
+    Posts request with retries according to RetryPolicy of soap action.
+    Returns last response even if it is an error, so it can be recorded in history.
+    Raises VetisConnectionError if no response was received.
+    """
+
+    headers = {
+        'Content-Type': 'text/html;charset=UTF-8',
+        'SOAPAction': soap_request.soap_action,
+    }
+
+    endpoint_url = get_endpoint_url(soap_request.endpoint_name, credentials)
+    session = get_session(credentials, endpoint_url)
+    bucket = get_bucket(credentials.id, soap_request.endpoint_name)
+    policy = get_retry_policy(soap_request.soap_action)
+    timeout = get_timeout()
+    body = soap_request.get_body()
+
+    for try_num in range(policy.attempts):
+        is_last_try = try_num == policy.attempts - 1
+
+        if try_num:
+            sleep(policy.get_delay(try_num))
+
+        if bucket is not None:
+            bucket.acquire()
+
+        try:
+            response = session.post(
+                    url=endpoint_url,
+                    auth=(credentials.login, credentials.password),
+                    headers=headers,
+                    data=body,
+                    timeout=timeout
+                )
+        except requests.exceptions.RequestException as e:
+            if is_last_try or not policy.can_retry_exception(e):
+                raise VetisConnectionError(f'Не удалось выполнить soap запрос {soap_request.soap_action}: {e}') from e
+            print(f'Connection error on try #{try_num+1}: {e}')
+            continue
+
+        error = get_response_error(response)
+        if error is not None and not is_last_try and policy.can_retry_response(error):
+            print(f'Retryable error on try #{try_num+1}: {error}')
+            continue
+
+        return response, endpoint_url
+
+
+def _save_history_record(soap_request: AbstractRequest, credentials: VetisCredentials, endpoint_url: str, response: requests.Response):
+    record_history(
+        soap_action=soap_request.soap_action,
+        comment=f'{credentials.name} {endpoint_url}',
+        response_status_code=response.status_code,
+        # bytes as sent and received: a page is neither decoded nor encoded again for history
+        soap_request=soap_request.get_body(),
+        response_body=response.content
+    )
+
+
+def send_soap_request(soap_request: AbstractRequest, credentials: VetisCredentials) -> requests.Response:
+    """
+    Sends request and records it in history.
+    Response body is downloaded whole: callers parse it from response.content
+    and the same bytes are recorded in history.
+    Raises VetisSoapFault or VetisHttpError if response is not successful.
+    """
+
+    response, endpoint_url = _post_soap_request(soap_request, credentials)
+
+    _save_history_record(soap_request, credentials, endpoint_url, response)
+
+    error = get_response_error(response)
+    if error is not None:
+        raise error
+    
+    return response
+
+
+async def async_send_soap_request(soap_request: AbstractRequest, credentials: VetisCredentials) -> requests.Response:
+    """
+    Asyncio counterpart of send_soap_request.
+    HTTP exchange runs in a thread on the pooled session, history is recorded the same way.
+    """
+
+    response, endpoint_url = await asyncio.to_thread(_post_soap_request, soap_request, credentials)
+
+    await sync_to_async(_save_history_record)(soap_request, credentials, endpoint_url, response)
+
+    error = get_response_error(response)
+    if error is not None:
+        raise error
+
+    return response
+
+
+async def _gather_soap_requests(soap_requests: list[AbstractRequest], credentials: VetisCredentials, concurrency: int) -> list[tuple[requests.Response, str]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(soap_request):
+        async with semaphore:
+            return await asyncio.to_thread(_post_soap_request, soap_request, credentials)
+
+    # every request is completed, one failed request does not discard responses of the others
+    return await asyncio.gather(*(post(soap_request) for soap_request in soap_requests), return_exceptions=True)
+
+
+def send_soap_requests(soap_requests: list[AbstractRequest], credentials: VetisCredentials, concurrency: int = None) -> list[requests.Response]:
+    """
+    Sends independent requests concurrently, at most `concurrency` at a time.
+    Responses are returned in the order of requests.
+    History is recorded just like in send_soap_request, for every response received,
+    then the error of the first failed request is raised, if any.
+    """
+
+    if not soap_requests:
+        return []
+
+    if concurrency is None:
+        concurrency = getattr(settings, 'VETIS_ASYNC_CONCURRENCY', 4)
+
+    results = asyncio.run(_gather_soap_requests(soap_requests, credentials, concurrency))
+
+    responses = []
+    first_error = None
+    for soap_request, result in zip(soap_requests, results):
+        if isinstance(result, BaseException):
+            first_error = first_error or result
+            continue
+
+        response, endpoint_url = result
+        _save_history_record(soap_request, credentials, endpoint_url, response)
+        responses.append(response)
+        first_error = first_error or get_response_error(response)
+
+    if first_error is not None:
+        raise first_error
+
+    return responses
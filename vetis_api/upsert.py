@@ -0,0 +1,70 @@
+from django.db import models
+
+
+BATCH_SIZE = 500
+KEEP_STORED = ()  # update_fields value: stored rows are not changed, see upsert()
+
+
+def get_update_fields(model: type[models.Model], unique_field: str) -> list[str]:
+    """All concrete fields but the primary key and the conflict target"""
+
+    return [
+        field.name
+        for field in model._meta.concrete_fields
+        if not field.primary_key and field.name != unique_field
+    ]
+
+
+def upsert(records: list[models.Model], update_fields=None, unique_field: str = 'guid', batch_size: int = BATCH_SIZE) -> list[models.Model]:
+    """
+    Writes records with one INSERT ... ON CONFLICT (guid) DO UPDATE statement per batch,
+    so concurrent workers writing the same dictionary record neither fail nor need a select first.
+
+    update_fields are overwritten in stored rows, all fields by default.
+    KEEP_STORED leaves stored rows as they are (get_or_create without a race):
+    rows are inserted with ON CONFLICT DO NOTHING, so stored rows are not rewritten,
+    and the stored rows are selected and returned instead of the records.
+
+    Primary keys are set on the records. Of records with the same key only the last one
+    is written, the records written are returned.
+    """
+
+    if not records:
+        return []
+
+    model = records[0].__class__
+
+    unique = {}
+    for record in records:
+        unique[str(getattr(record, unique_field)).lower()] = record
+    records = list(unique.values())
+
+    if update_fields is not None and not update_fields:
+        return insert_missing(model, unique, unique_field, batch_size)
+
+    if update_fields is None:
+        update_fields = get_update_fields(model, unique_field)
+
+    model.objects.bulk_create(
+        records,
+        update_conflicts=True,
+        unique_fields=[unique_field],
+        update_fields=update_fields,
+        batch_size=batch_size
+    )
+
+    return records
+
+
+def insert_missing(model: type[models.Model], records: dict[str, models.Model], unique_field: str, batch_size: int) -> list[models.Model]:
+    model.objects.bulk_create(records.values(), ignore_conflicts=True, batch_size=batch_size)
+
+    stored = {
+        str(getattr(record, unique_field)).lower(): record
+        for record in model.objects.filter(**{f'{unique_field}__in': records.keys()})
+    }
+    return [stored[key] for key in records]
+
+
+def upsert_one(record: models.Model, update_fields=None, unique_field: str = 'guid') -> models.Model:
+    return upsert([record], update_fields, unique_field)[0]
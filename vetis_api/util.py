@@ -0,0 +1,7 @@
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+
+
+def get_shared_cache() -> BaseCache:
+    """Cache shared by all worker processes (application statistics, dictionary cache generations)"""
+    return caches[getattr(settings, 'VETIS_SHARED_CACHE', 'default')]
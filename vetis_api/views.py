@@ -7,7 +7,8 @@ from .models import ApiRequestsHistoryRecord
 
 
 def api_requests_history(request):
-    requests_history = ApiRequestsHistoryRecord.objects.all()[:20]
+    # only sizes are shown in the list, texts are loaded on the detail page
+    requests_history = ApiRequestsHistoryRecord.objects.defer('request_data', 'response_data')[:20]
     context = {
         'requests_history': requests_history,
     }
@@ -1,134 +1,155 @@
+import re
 from datetime import datetime
-
-from django.template.loader import render_to_string
+from functools import lru_cache
+from html import escape
+from pathlib import Path
 
 from ..models import TZ_MOSCOW
 
 
 VETIS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / 'templates' / 'vetis_api' / 'xml'
+PLACEHOLDER_RE = re.compile(r'{{\s*vetis_request\.(\w+)\s*}}')
+
+
+class Envelope:
+    """
+    SOAP envelope template compiled into literal parts and names of request attributes.
+    Uses the same template files as render_to_string would, values are escaped
+    the same way as by Django autoescape (quotes included), so the output is identical.
+    """
+
+    def __init__(self, template: str):
+        parts = PLACEHOLDER_RE.split(template)
+        self.literals = parts[0::2]
+        self.fields = parts[1::2]
+
+    def render(self, vetis_request) -> str:
+        chunks = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            chunks.append(escape(str(getattr(vetis_request, field))))
+            chunks.append(literal)
+        return ''.join(chunks)
+
+
+@lru_cache(maxsize=None)
+def get_envelope(template_name: str) -> Envelope:
+    return Envelope((TEMPLATES_DIR / template_name).read_text(encoding='utf-8'))
+
 
 class AbstractRequest:
     endpoint_name = None
     soap_action = None
+    template_name = None
+
+    _xml = None
+    _body = None
 
     def __init__():
         raise NotImplementedError()
 
-    def get_xml(self):
-        raise NotImplementedError()
+    def render(self) -> str:
+        return get_envelope(self.template_name).render(self)
+
+    def get_xml(self) -> str:
+        """Request envelope. Rendered once, so retries and history record get the same request."""
+        if self._xml is None:
+            self._xml = self.render()
+        return self._xml
+
+    def get_body(self) -> bytes:
+        if self._body is None:
+            self._body = self.get_xml().encode('utf-8')
+        return self._body
+
+
+class AbstractApplicationRequest(AbstractRequest):
+    """Two-step request: application data is wrapped in submitApplicationRequest"""
+
+    endpoint_name = 'ApplicationManagementService'
+    soap_action = 'submitApplicationRequest'
+
+    def render(self) -> str:
+        self.issue_date = datetime.now().strftime(VETIS_DATETIME_FORMAT)
+        self.local_transaction_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        return super().render()
 
 
 class ProductByGuidRequest(AbstractRequest):
     endpoint_name = 'ProductService'
     soap_action = 'GetProductByGuid'
+    template_name = 'GetProductByGuid.xml'
 
     def __init__(self, product_guid: str):
         self.product_guid = product_guid
 
-    def get_xml(self) -> str:
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetProductByGuid.xml', context)
-    
 
 class SubproductByGuidRequest(AbstractRequest):
     endpoint_name = 'ProductService'
     soap_action = 'GetSubProductByGuid'
+    template_name = 'GetSubproductByGuid.xml'
 
     def __init__(self, subproduct_guid: str):
         self.subproduct_guid = subproduct_guid
 
-    def get_xml(self) -> str:
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetSubproductByGuid.xml', context)
-
 
 class ProductItemByGuidRequest(AbstractRequest):
     endpoint_name = 'ProductService'
     soap_action = 'GetProductItemByGuid'
+    template_name = 'GetProductItemByGuid.xml'
 
     def __init__(self, product_item_guid: str):
         self.product_item_guid = product_item_guid
 
-    def get_xml(self) -> str:
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetProductItemByGuid.xml', context)
-
 
 class ProductItemListRequest(AbstractRequest):
 
     endpoint_name = 'ProductService'
     soap_action = 'GetProductItemList'
+    template_name = 'GetProductItemList.xml'
 
     def __init__(self, business_entity_guid: str, list_count: int = 1000, list_offset: int = 0):
         self.business_entity_guid = business_entity_guid
         self.list_count = list_count
         self.list_offset = list_offset
 
-    def get_xml(self) -> str:
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetProductItemList.xml', context)
-    
 
 class BusinessEntityByGuidRequest(AbstractRequest):
 
     endpoint_name = 'EnterpriseService'
     soap_action = 'GetBusinessEntityByGuid'
+    template_name = 'GetBusinessEntityByGuid.xml'
 
     def __init__(self, business_entity_guid: str):
         self.business_entity_guid = business_entity_guid
 
-    def get_xml(self):
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetBusinessEntityByGuid.xml', context)
-    
 
 class EnterpriseByGuidRequest(AbstractRequest):
 
     endpoint_name = 'EnterpriseService'
     soap_action = 'GetEnterpriseByGuid'
+    template_name = 'GetEnterpriseByGuid.xml'
 
     def __init__(self, enterprise_guid: str):
         self.enterprise_guid = enterprise_guid
 
-    def get_xml(self):
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetEnterpriseByGuid.xml', context)
-    
 
 class ActivityLocationListRequest(AbstractRequest):
 
     endpoint_name = 'EnterpriseService'
     soap_action = 'GetActivityLocationList'
+    template_name = 'GetActivityLocationList.xml'
 
     def __init__(self, business_entity_guid: str, list_count: int = 1000, list_offset: int = 0):
         self.business_entity_guid = business_entity_guid
         self.list_count = list_count
         self.list_offset = list_offset
 
-    def get_xml(self):
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetActivityLocationList.xml', context)
-
 
-class GetStockEntryListRequest(AbstractRequest):
+class GetStockEntryListRequest(AbstractApplicationRequest):
 
-    endpoint_name = 'ApplicationManagementService'
-    soap_action = 'submitApplicationRequest'
+    template_name = 'GetStockEntryList.xml'
 
     def __init__(self, enterprise_guid: str, api_key: str, service_id: str, issuer_id: str, initiator_login: str, list_count: int = 1000, list_offset: int = 0):
         self.enterprise_guid = enterprise_guid
@@ -138,20 +159,11 @@ class GetStockEntryListRequest(AbstractRequest):
         self.initiator_login = initiator_login
         self.list_count = list_count
         self.list_offset = list_offset
-    
-    def get_xml(self):
-        self.issue_date = datetime.now().strftime(VETIS_DATETIME_FORMAT)
-        self.local_transaction_id = datetime.now().strftime('%Y%m%d-%H%M%S')
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetStockEntryList.xml', context)
-    
 
-class GetStockEntryChangesListRequest(AbstractRequest):
 
-    endpoint_name = 'ApplicationManagementService'
-    soap_action = 'submitApplicationRequest'
+class GetStockEntryChangesListRequest(AbstractApplicationRequest):
+
+    template_name = 'GetStockEntryChangesList.xml'
 
     def __init__(self, enterprise_guid: str, begin_date: datetime, end_date: datetime, api_key: str, service_id: str, issuer_id: str, initiator_login: str, list_count: int = 1000, list_offset: int = 0):
         self.enterprise_guid = enterprise_guid
@@ -163,20 +175,11 @@ class GetStockEntryChangesListRequest(AbstractRequest):
         self.initiator_login = initiator_login
         self.list_count = list_count
         self.list_offset = list_offset
-    
-    def get_xml(self):
-        self.issue_date = datetime.now().strftime(VETIS_DATETIME_FORMAT)
-        self.local_transaction_id = datetime.now().strftime('%Y%m%d-%H%M%S')
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetStockEntryChangesList.xml', context)
-    
 
-class GetStockEntryVersionListRequest(AbstractRequest):
 
-    endpoint_name = 'ApplicationManagementService'
-    soap_action = 'submitApplicationRequest'
+class GetStockEntryVersionListRequest(AbstractApplicationRequest):
+
+    template_name = 'GetStockEntryVersionList.xml'
 
     def __init__(self, enterprise_guid: str, stock_entry_guid: str, api_key: str, service_id: str, issuer_id: str, initiator_login: str, list_count: int = 1000, list_offset: int = 0):
         self.enterprise_guid = enterprise_guid
@@ -187,20 +190,11 @@ class GetStockEntryVersionListRequest(AbstractRequest):
         self.initiator_login = initiator_login
         self.list_count = list_count
         self.list_offset = list_offset
-    
-    def get_xml(self):
-        self.issue_date = datetime.now().strftime(VETIS_DATETIME_FORMAT)
-        self.local_transaction_id = datetime.now().strftime('%Y%m%d-%H%M%S')
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetStockEntryVersionList.xml', context)
-    
 
-class GetVetDocumentByUuidRequest(AbstractRequest):
 
-    endpoint_name = 'ApplicationManagementService'
-    soap_action = 'submitApplicationRequest'
+class GetVetDocumentByUuidRequest(AbstractApplicationRequest):
+
+    template_name = 'GetVetDocumentByUuid.xml'
 
     def __init__(self, enterprise_guid: str, vet_document_uuid: str, api_key: str, service_id: str, issuer_id: str, initiator_login: str):
         self.enterprise_guid = enterprise_guid
@@ -209,28 +203,15 @@ class GetVetDocumentByUuidRequest(AbstractRequest):
         self.service_id = service_id
         self.issuer_id = issuer_id
         self.initiator_login = initiator_login
-    
-    def get_xml(self):
-        self.issue_date = datetime.now().strftime(VETIS_DATETIME_FORMAT)
-        self.local_transaction_id = datetime.now().strftime('%Y%m%d-%H%M%S')
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/GetVetDocumentByUuid.xml', context)
-        
+
 
 class ReceiveApplicationResultRequest(AbstractRequest):
 
     endpoint_name = 'ApplicationManagementService'
     soap_action = 'receiveApplicationResult'
+    template_name = 'ReceiveApplicationResult.xml'
 
     def __init__(self, api_key: str, issuer_id: str, application_id: str):
         self.api_key = api_key
         self.issuer_id = issuer_id
         self.application_id = application_id
-
-    def get_xml(self):
-        context = {
-            'vetis_request': self
-        }
-        return render_to_string('vetis_api/xml/ReceiveApplicationResult.xml', context)
\ No newline at end of file
@@ -0,0 +1,88 @@
+import xml.etree.ElementTree as ET
+
+from .stream import qname
+
+
+class Field:
+    """
+    Value of a record read from an element found by a path relative to the record element.
+
+        Field('vd:batch/vd:volume', Decimal)     # converted text of the first match
+        Field('dt:productMarks', many=True)      # list of texts of all matches
+        Field('vd:batch/vd:expiryDate/vd:firstDate', schema=COMPLEX_DATE)  # nested record
+
+    Missing elements give `default` (empty list for many=True). Text is converted only if present.
+    """
+
+    def __init__(self, path: str, convert=None, schema: 'Schema' = None, many: bool = False, default=None):
+        self.path = tuple(qname(name) for name in path.split('/'))
+        self.convert = convert
+        self.schema = schema
+        self.many = many
+        self.default = default
+
+    def read(self, element: ET.Element):
+        if self.schema is not None:
+            return self.schema.extract(element)
+        text = element.text
+        if text is None or self.convert is None:
+            return text
+        return self.convert(text)
+
+
+class _Node:
+    __slots__ = ('fields', 'children')
+
+    def __init__(self):
+        self.fields = []
+        self.children = {}
+
+
+class Schema:
+    """
+    Declarative map of record fields to element paths, compiled into a tree of tags.
+    extract() walks children of the element once and descends only into branches
+    that lead to some field, instead of running a find() per field.
+    `build` is called with extracted values as keyword arguments and returns the record
+    (a NamedTuple class usually), without it extract() returns a dict.
+    """
+
+    def __init__(self, fields: dict[str, Field], build=None):
+        self.fields = fields
+        self.build = build
+        self._root = _Node()
+        for name, field in fields.items():
+            node = self._root
+            for tag in field.path:
+                node = node.children.setdefault(tag, _Node())
+            node.fields.append((name, field))
+        self._defaults = [(name, field) for name, field in fields.items()]
+
+    def extract(self, element: ET.Element):
+        values = {}
+        self._walk(element, self._root, values)
+
+        for name, field in self._defaults:
+            if name not in values:
+                values[name] = [] if field.many else field.default
+
+        if self.build is not None:
+            return self.build(**values)
+        return values
+
+    def _walk(self, element: ET.Element, node: _Node, values: dict):
+        children = node.children
+        for child in element:
+            child_node = children.get(child.tag)
+            if child_node is None:
+                continue
+            for name, field in child_node.fields:
+                if field.many:
+                    values.setdefault(name, []).append(field.read(child))
+                elif name not in values:  # first match wins, as find() does
+                    values[name] = field.read(child)
+            if child_node.children:
+                self._walk(child, child_node, values)
+
+    def extract_all(self, elements) -> list:
+        return [self.extract(element) for element in elements]
@@ -0,0 +1,130 @@
+from datetime import datetime
+from decimal import Decimal
+
+from ..models import ComplexDate
+from ..records import *
+from .extract import Field, Schema
+
+
+def parse_bool(text: str) -> bool:
+    return text == 'true'
+
+
+def build_complex_date(year: int, month: int, day: int = None, hour: int = None) -> ComplexDate:
+    # hour is meaningful only together with day
+    if day is None:
+        return ComplexDate(year=year, month=month)
+    return ComplexDate(year=year, month=month, day=day, hour=hour)
+
+
+COMPLEX_DATE = Schema({
+    'year': Field('dt:year', int),
+    'month': Field('dt:month', int),
+    'day': Field('dt:day', int),
+    'hour': Field('dt:hour', int),
+}, build=build_complex_date)
+
+
+PRODUCT = Schema({
+    'guid': Field('bs:guid'),
+    'uuid': Field('bs:uuid'),
+    'name': Field('dt:name'),
+    'code': Field('dt:code'),
+    'product_type': Field('dt:productType', int),
+}, build=ProductRecord)
+
+
+SUBPRODUCT = Schema({
+    'guid': Field('bs:guid'),
+    'uuid': Field('bs:uuid'),
+    'name': Field('dt:name'),
+    'code': Field('dt:code'),
+    'product_guid': Field('dt:productGuid'),
+}, build=SubProductRecord)
+
+
+PRODUCT_ITEM = Schema({
+    'guid': Field('bs:guid'),
+    'uuid': Field('bs:uuid'),
+    'is_active': Field('bs:active', parse_bool),
+    'name': Field('dt:name'),
+    'gtin': Field('dt:globalID'),
+    'product_type': Field('dt:productType', int),
+    'product_guid': Field('dt:product/bs:guid'),
+    'subproduct_guid': Field('dt:subProduct/bs:guid'),
+    'is_gost': Field('dt:correspondsToGost', parse_bool),
+    'gost': Field('dt:gost'),
+    'producer_guid': Field('dt:producer/bs:guid'),
+}, build=ProductItemRecord)
+
+
+BUSINESS_ENTITY = Schema({
+    'guid': Field('bs:guid'),
+    'uuid': Field('bs:uuid'),
+    'name': Field('dt:name'),
+    'full_name': Field('dt:fullName'),
+    'fio': Field('dt:fio'),
+    'inn': Field('dt:inn'),
+}, build=BusinessEntityRecord)
+
+
+ENTERPRISE = Schema({
+    'guid': Field('bs:guid'),
+    'uuid': Field('bs:uuid'),
+    'is_active': Field('bs:active', parse_bool),
+    'type': Field('dt:type', int),
+    'name': Field('dt:name'),
+    'address': Field('dt:address/dt:addressView'),
+    'numbers': Field('dt:numberList/dt:enterpriseNumber', many=True),
+}, build=EnterpriseRecord)
+
+
+PACKAGE = Schema({
+    'level': Field('dt:level', int),
+    'packing_type_guid': Field('dt:packingType/bs:guid'),
+    'packing_type_uuid': Field('dt:packingType/bs:uuid'),
+    'packing_type_name': Field('dt:packingType/dt:name'),
+    'packing_type_global_id': Field('dt:packingType/dt:globalID'),
+    'quantity': Field('dt:quantity', int, default=0),
+    'product_marks': Field('dt:productMarks', many=True),
+}, build=PackageRecord)
+
+
+STOCK_ENTRY = Schema({
+    'guid': Field('bs:guid'),
+    'uuid': Field('bs:uuid'),
+    'is_active': Field('bs:active', parse_bool),
+    'is_last': Field('bs:last', parse_bool),
+    'status': Field('bs:status', int),
+    'date_created': Field('bs:createDate', datetime.fromisoformat),
+    'date_updated': Field('bs:updateDate', datetime.fromisoformat),
+    'previous_uuid': Field('bs:previous'),
+    'next_uuid': Field('bs:next'),
+    'entry_number': Field('vd:entryNumber'),
+    'product_type': Field('vd:batch/vd:productType', int),
+    'product_guid': Field('vd:batch/vd:product/bs:guid'),
+    'subproduct_guid': Field('vd:batch/vd:subProduct/bs:guid'),
+    'product_item_guid': Field('vd:batch/vd:productItem/bs:guid'),
+    'product_item_name': Field('vd:batch/vd:productItem/dt:name'),
+    'volume': Field('vd:batch/vd:volume', Decimal),
+    'unit_guid': Field('vd:batch/vd:unit/bs:guid'),
+    'unit_name': Field('vd:batch/vd:unit/dt:name'),
+    'date_produced_1': Field('vd:batch/vd:dateOfProduction/vd:firstDate', schema=COMPLEX_DATE),
+    'date_produced_2': Field('vd:batch/vd:dateOfProduction/vd:secondDate', schema=COMPLEX_DATE),
+    'date_expiry_1': Field('vd:batch/vd:expiryDate/vd:firstDate', schema=COMPLEX_DATE),
+    'date_expiry_2': Field('vd:batch/vd:expiryDate/vd:secondDate', schema=COMPLEX_DATE),
+    'is_perishable': Field('vd:batch/vd:perishable', parse_bool),
+    'origin_country': Field('vd:batch/vd:origin/vd:country/dt:name'),
+    'producer_guid': Field('vd:batch/vd:origin/vd:producer/dt:enterprise/bs:guid'),
+    'producer_name': Field('vd:batch/vd:origin/vd:producer/dt:enterprise/dt:name'),
+    'packages': Field('vd:batch/vd:packageList/dt:package', schema=PACKAGE, many=True),
+    'vet_document_uuids': Field('vd:vetDocument/bs:uuid', many=True),
+}, build=StockEntryRecord)
+
+
+VET_DOCUMENT = Schema({
+    'uuid': Field('bs:uuid'),
+    'vetd_type': Field('vd:vetDType'),
+    'consignor_be_guid': Field('vd:certifiedConsignment/vd:consignor/dt:businessEntity/bs:guid'),
+    'consignor_ent_guid': Field('vd:certifiedConsignment/vd:consignor/dt:enterprise/bs:guid'),
+}, build=VetDocumentRecord)
@@ -0,0 +1,98 @@
+import xml.etree.ElementTree as ET
+from typing import Iterator
+
+from .settings import NAMESPACES
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def qname(prefixed_name: str) -> str:
+    """'vd:stockEntry' -> '{http://api.vetrf.ru/schema/cdm/mercury/vet-document/v2}stockEntry'"""
+    prefix, name = prefixed_name.split(':')
+    return f'{{{NAMESPACES[prefix]}}}{name}'
+
+
+def iter_chunks(source: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+    view = memoryview(source)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start+chunk_size]
+
+
+def find_first_text(source: bytes, prefixed_name: str) -> str | None:
+    """Returns text of the first element with given name without parsing the rest of the document"""
+
+    tag = qname(prefixed_name)
+    parser = ET.XMLPullParser(events=('end',))
+    for chunk in iter_chunks(source):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if element.tag == tag:
+                return element.text
+    return None
+
+
+class ElementStream:
+    """
+    Incremental parser of a list response.
+    Response bytes are fed to the parser in chunks and list items are yielded
+    in batches as soon as they are parsed. Items of a batch are cleared and
+    detached when the next batch is requested, so memory of the parsed tree does not
+    depend on page size. The source itself is the whole downloaded body, it is not streamed.
+
+        stream = ElementStream(response.content, 'vd:stockEntryList', 'vd:stockEntry')
+        stock_entry_list = stream.read_container()  # attributes: total, count, offset
+        for stock_entry_xmls in stream.iter_batches(100):
+            ...
+    """
+
+    def __init__(self, source: bytes, container_name: str, item_name: str):
+        self.container_tag = qname(container_name)
+        self.item_tag = qname(item_name)
+        self.container = None
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._events = self._read_events(source)
+
+    def _read_events(self, source: bytes):
+        for chunk in iter_chunks(source):
+            self._parser.feed(chunk)
+            yield from self._parser.read_events()
+        self._parser.close()
+        yield from self._parser.read_events()
+
+    def read_container(self) -> ET.Element | None:
+        """Reads document up to the start of container element. Returns None if there is no container."""
+
+        if self.container is not None:
+            return self.container
+
+        for event, element in self._events:
+            if event == 'start' and element.tag == self.container_tag:
+                self.container = element
+                return element
+
+        return None
+
+    def iter_batches(self, batch_size: int) -> Iterator[list[ET.Element]]:
+        if self.read_container() is None:
+            return
+
+        batch = []
+        for event, element in self._events:
+            if event == 'end' and element.tag == self.item_tag:
+                batch.append(element)
+                if len(batch) >= batch_size:
+                    yield batch
+                    self._release(batch)
+                    batch = []
+            elif event == 'end' and element.tag == self.container_tag:
+                break
+
+        if batch:
+            yield batch
+            self._release(batch)
+
+    def _release(self, batch: list[ET.Element]):
+        for element in batch:
+            element.clear()
+            self.container.remove(element)
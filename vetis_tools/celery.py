@@ -2,6 +2,7 @@ import os
 from time import sleep
 
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vetis_tools.settings')
@@ -18,6 +19,24 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+# in every process executing tasks: pool child processes, or the worker itself with solo pool
+@worker_process_init.connect
+def warm_up_vetis_sessions(**kwargs):
+    from django.conf import settings
+    from vetis_api.transport import warm_up_sessions
+
+    if getattr(settings, 'VETIS_HTTP_WARM_UP', True):
+        warm_up_sessions()
+
+
+@worker_process_shutdown.connect
+def flush_vetis_history(**kwargs):
+    from vetis_api.history import history_writer
+
+    # worker processes may exit without running atexit handlers
+    history_writer.flush()
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from celery.schedules import crontab
 from django.contrib import messages
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -100,6 +101,32 @@ DATABASES = {
     }
 }
 
+# separate connection to the same database for rate limit buckets shared by worker processes,
+# see vetis_api.ratelimit; not needed with SQLite or when VETIS_LOCK_CACHE is Redis or memcached
+DATABASES['vetis-ratelimit'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared by all worker processes on the host, see VETIS_SHARED_CACHE
+    'vetis': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'vetis',
+    },
+    # locks of dictionary loads, see VETIS_LOCK_CACHE; with several worker processes replace
+    # with Redis or memcached, which also keeps rate limit buckets instead of DB, e.g.
+    # {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}
+    'vetis-locks': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vetis-locks',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -157,3 +184,43 @@ CELERY_RESULT_BACKEND = 'django-db'
 CELERY_TIMEZONE = 'Europe/Moscow'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_WORKER_POOL = 'solo'  # SINGLE THREAD! Default 'prefork' doesn't work under win.
+CELERY_BEAT_SCHEDULE = {  # celery -A vetis_tools beat
+    'purge-api-requests-history': {
+        'task': 'vetis_api.tasks.purge_api_requests_history',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
+
+# Vetis API
+
+VETIS_ENDPOINT_BASE_URL = None  # overrides Vetis hosts, e.g. 'http://127.0.0.1:8800' for manage.py vetis_fake_server
+VETIS_HTTP_POOL_SIZE = 10  # keep-alive connections per credentials and endpoint host
+VETIS_HTTP_WARM_UP = True  # open connections to Vetis on worker start
+VETIS_ASYNC_CONCURRENCY = 4  # concurrent requests for dictionary fan-out
+VETIS_SHARED_CACHE = 'vetis'  # cache alias for statistics, must be shared between workers
+VETIS_LOCK_CACHE = 'vetis-locks'  # cache alias for locks, must have atomic add (Redis, memcached; LocMemCache for one worker process); rate limits are kept in DB unless it is Redis or memcached
+VETIS_RATE_LIMITS = {  # per endpoint name and credentials; None disables limiting
+    'default': {'rate': 5.0, 'burst': 10},
+}
+VETIS_CONNECT_TIMEOUT = 10  # seconds
+VETIS_READ_TIMEOUT = 60  # seconds
+VETIS_APPLICATION_TIMEOUT = 120  # seconds to wait for two-step application result
+VETIS_APPLICATION_MODE = 'blocking'  # 'scheduled': worker is not blocked while waiting for application results
+VETIS_PAGE_PIPELINE_WINDOW = 2  # stock journal pages requested ahead of the page being saved
+VETIS_STOCK_LIST_COUNT = 1000  # stock journal entries per page
+VETIS_STREAM_BATCH_SIZE = 100  # stock entries parsed and saved at a time
+VETIS_INITIAL_COPY_IMPORT = True  # PostgreSQL: INITIAL stock journal import through COPY into staging tables
+VETIS_DICTIONARY_CACHE_SIZE = 2000  # products, units, enterprises etc. cached by GUID per model in each worker process, 0 disables
+VETIS_SYNC_CHECKPOINT_MAX_AGE = 24 * 60 * 60  # seconds an interrupted multi-page sync can be resumed from its last committed page
+VETIS_HISTORY_PAYLOAD_STORAGE = 'zlib'  # request history texts: 'zlib' or 'zstd' (zstandard package) compressed in DB, 'file' deduplicated files
+VETIS_HISTORY_PAYLOAD_DIR = BASE_DIR / 'history'  # for 'file' storage
+VETIS_HISTORY_BUFFERED = True  # request history is written by a background thread in its own transaction, False writes it during the call (always on SQLite)
+VETIS_HISTORY_QUEUE_SIZE = 1000  # history entries waiting to be written, more are dropped
+VETIS_HISTORY_BATCH_SIZE = 100  # history entries written at a time
+VETIS_HISTORY_FLUSH_INTERVAL = 1.0  # seconds a history entry may wait for a batch
+VETIS_HISTORY_RETENTION = {  # days, None keeps forever; failed requests are those without HTTP 200
+    'payloads': 7,  # request and response texts of successful requests
+    'failed_payloads': 30,
+    'records': 180,  # history records of successful requests
+    'failed_records': 365,
+}